@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+
+# Micro-benchmark of the codecs (messageCodec.py): bytes per sample and encode/decode time per message.
+# Usage (from the project folder): python3 benchmarks/codecBenchmark.py [iterations]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from constants import MqttAppConstants
+from messageCodec import MessageCodec
+
+TIMESTAMP = 1720985647210731
+
+MESSAGES = {
+    "int value": ({MqttAppConstants.MSG_TIMESTAMP: TIMESTAMP, MqttAppConstants.MSG_SEQ: 1200, MqttAppConstants.MSG_VALUE: 74}, 1),
+    "float value": ({MqttAppConstants.MSG_TIMESTAMP: TIMESTAMP, MqttAppConstants.MSG_SEQ: 1200, MqttAppConstants.MSG_VALUE: 0.7345}, 1),
+    "batch of 25 ints": ({MqttAppConstants.MSG_TIMESTAMP: TIMESTAMP, MqttAppConstants.MSG_SEQ: 1200, MqttAppConstants.MSG_PERIOD: 4000,
+                          MqttAppConstants.MSG_VALUES: list(range(500, 525))}, 25),
+    "batch of 250 floats": ({MqttAppConstants.MSG_TIMESTAMP: TIMESTAMP, MqttAppConstants.MSG_SEQ: 1200, MqttAppConstants.MSG_PERIOD: 4000,
+                             MqttAppConstants.MSG_VALUES: [i / 7 for i in range(250)]}, 250),
+    "command": ({MqttAppConstants.MSG_TIMESTAMP: TIMESTAMP, MqttAppConstants.MSG_CMD: MqttAppConstants.COMMAND_START}, 1),
+}
+
+
+def measure_ns(function, argument, iterations):
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        function(argument)
+    return (time.perf_counter_ns() - start) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print("{:<22}{:<8}{:>10}{:>14}{:>12}{:>12}".format("message", "codec", "bytes", "bytes/sample", "encode ns", "decode ns"))
+    for name, (message, samples) in MESSAGES.items():
+        for codec_name in MqttAppConstants.get_codecs():
+            codec = MessageCodec.get_codec(codec_name)
+            payload = codec.encode(message)
+            assert MessageCodec.decode(payload) == message, "{} does not round-trip with {}".format(name, codec_name)
+            encode_ns = measure_ns(codec.encode, message, iterations)
+            decode_ns = measure_ns(MessageCodec.decode, payload, iterations)
+            print("{:<22}{:<8}{:>10}{:>14.1f}{:>12.0f}{:>12.0f}".format(
+                name, codec_name, len(payload), len(payload) / samples, encode_ns, decode_ns))
+
+
+if __name__ == "__main__":
+    main()
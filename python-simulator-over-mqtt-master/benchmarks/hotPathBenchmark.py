@@ -0,0 +1,105 @@
+import contextlib
+import datetime
+import json
+import os
+import sys
+import time
+
+# Before/after benchmark of the publish and receive hot paths of Mode (messages per second per core).
+# "before" is a copy of the historical implementation (two time.time(), datetime + strftime, json.dumps, one print per
+# message), "after" is the current Mode. Nothing goes on the network: the MQTT client is replaced by a no-op and stdout
+# is sent to /dev/null (a real terminal is even slower).
+# Usage (from the project folder): python3 benchmarks/hotPathBenchmark.py [messages]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from constants import MqttAppConstants
+from mode.mode import Mode
+
+
+class NoNetworkClient:
+    on_message = None
+
+    def publish(self, topic, payload, *args, **kwargs):
+        pass
+
+
+class NoNetworkService:
+    def __init__(self):
+        self.client = NoNetworkClient()
+
+
+class BenchmarkMode(Mode):
+    def run(self):
+        pass
+
+
+class ReceivedMessage:
+    def __init__(self, payload):
+        self.topic = "bench/sensor"
+        self.payload = payload
+
+
+class HistoricalMode:
+    # Copy of the code before the hot path clean-up
+    def __init__(self):
+        self.time_value_pairs = []
+        self.client = NoNetworkClient()
+
+    def publish_message(self, topic, mode, cmdOrValueOrAns):
+        timestamp = time.time()
+        microseconds_timestamp = int(time.time() * 1e6)
+        timestamp_readable = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')
+        message = json.dumps({MqttAppConstants.MSG_TIMESTAMP: microseconds_timestamp, mode: cmdOrValueOrAns})
+        self.client.publish(topic, message)
+        self.add_time_value_pairs(timestamp_readable, cmdOrValueOrAns)
+        print(">>>>[{}]: sending {} at {}".format(topic, message, timestamp_readable))
+
+    def on_message_for_mode(self, client, userdata, message):
+        timestamp = time.time()
+        timestamp_readable = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')
+        message_string = message.payload.decode("utf-8")
+        message_dict = json.loads(message_string)
+        content_extraction = None
+        if message_dict.get(MqttAppConstants.MSG_VALUE):
+            content_extraction = message_dict[MqttAppConstants.MSG_VALUE]
+        elif message_dict.get(MqttAppConstants.MSG_ANS):
+            content_extraction = message_dict[MqttAppConstants.MSG_ANS]
+        self.add_time_value_pairs(timestamp_readable, content_extraction)
+        print("Received message: {} at {}".format(message_string, timestamp_readable))
+
+    def add_time_value_pairs(self, time, cmdOrValueOrAns):
+        if (cmdOrValueOrAns not in MqttAppConstants.get_commands()):
+            self.time_value_pairs.append((time[11:], cmdOrValueOrAns))
+
+
+def messages_per_second(function, messages):
+    start = time.process_time()
+    for value in range(messages):
+        function(value)
+    return messages / (time.process_time() - start)
+
+
+def run_case(name, mode, messages):
+    payload = json.dumps({MqttAppConstants.MSG_TIMESTAMP: 1720985647210731, MqttAppConstants.MSG_VALUE: 74}).encode()
+    received = ReceivedMessage(payload)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        publish = messages_per_second(lambda value: mode.publish_message("bench/sensor", MqttAppConstants.MSG_VALUE, value), messages)
+        receive = messages_per_second(lambda value: mode.on_message_for_mode(None, None, received), messages)
+    print("{:<34}{:>14.0f}{:>14.0f}".format(name, publish, receive))
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    print("{:<34}{:>14}{:>14}".format("implementation", "publish/s", "receive/s"))
+    run_case("before (historical)", HistoricalMode(), messages)
+    for echo in ("all", "10", "none"):
+        # receive_workers=0: the whole processing is measured, in the calling thread
+        run_case("after, echo {}".format(echo), BenchmarkMode(NoNetworkService(), echo=echo, topic="bench", receive_workers=0), messages)
+    # With the receive pipeline, the network thread only pays for the timestamp and the enqueue
+    mode = BenchmarkMode(NoNetworkService(), echo="none", topic="bench", receive_queue=messages)
+    run_case("after, network thread of pipeline", mode, messages)
+    mode.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import os
+import random
+import sys
+import time
+
+# Cost per sample of the values published by the sensors: the historical random.randint(1, 100) call per sample against
+# the block generators of signalGenerator.py (the NumPy block computation is included, amortized over the block).
+# Usage (from the project folder): python3 benchmarks/signalBenchmark.py [samples] [rate]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from signalGenerator import SignalGenerator
+
+
+def ns_per_sample(function, samples):
+    start = time.perf_counter_ns()
+    for _ in range(samples):
+        function()
+    return (time.perf_counter_ns() - start) / samples
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    print("{:<44}{:>14}".format("values ({} per second)".format(rate), "ns/sample"))
+    print("{:<44}{:>14.0f}".format("random.randint(1, 100) per sample", ns_per_sample(lambda: random.randint(1, 100), samples)))
+    for spec in ("random", "ordered", "sine:frequency=5,noise=0.1", "ecg", "ecg:amplitude=1000,offset=2048,dtype=int16"):
+        generator = SignalGenerator.from_spec(rate, spec)
+        print("{:<44}{:>14.0f}".format(spec, ns_per_sample(generator.next_value, samples)))
+
+
+if __name__ == "__main__":
+    main()
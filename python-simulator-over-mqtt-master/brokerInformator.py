@@ -1,4 +1,6 @@
+import os
 from constants import MqttAppConstants
+from embeddedBroker import EmbeddedBroker
 
 # BrokerInformator class provides connection information for different MQTT brokers.
 class BrokerInformator:
@@ -17,11 +19,14 @@ class BrokerInformator:
         elif broker_name == MqttAppConstants.WEBSOCKET_HIVEMQ:
             # Here, the hivemq version allow us to do websocket over mqtt.
             return BrokerInformator.websocket_client_over_hivemq()
+        elif broker_name == MqttAppConstants.EMBEDDED:
+            return BrokerInformator.embedded()
         else:
             raise ValueError("Invalid broker name")
         
     # Each broker method must return a dictionary with the same fields:
     # "url", "port", "username", "password", "tls" and "ws".
+    # The embedded broker has an extra "embedded" field: the options of the broker started by the application.
 
     @staticmethod
     def local():
@@ -82,6 +87,29 @@ class BrokerInformator:
         }
     
 
+    @staticmethod
+    def embedded():
+        # Network faults are injected with environment variables, so that every mode (sensor, server, fleet, bench)
+        # can use them: EMBEDDED_BROKER_LATENCY_MS, EMBEDDED_BROKER_JITTER_MS, EMBEDDED_BROKER_LOSS, EMBEDDED_BROKER_SEED,
+        # and so are the bound of the outgoing queue of each client: EMBEDDED_BROKER_MAX_QUEUED, EMBEDDED_BROKER_OVERFLOW
+        seed = os.environ.get("EMBEDDED_BROKER_SEED")
+        return {
+            "url": EmbeddedBroker.DEFAULT_HOST,
+            "port": int(os.environ.get("EMBEDDED_BROKER_PORT", EmbeddedBroker.DEFAULT_PORT)),
+            "username": None,
+            "password": None,
+            "tls": False,
+            "ws": False,
+            "embedded": {
+                "latency_ms": float(os.environ.get("EMBEDDED_BROKER_LATENCY_MS", 0)),
+                "jitter_ms": float(os.environ.get("EMBEDDED_BROKER_JITTER_MS", 0)),
+                "loss": float(os.environ.get("EMBEDDED_BROKER_LOSS", 0)),
+                "seed": int(seed) if seed is not None else None,
+                "max_queued": int(os.environ.get("EMBEDDED_BROKER_MAX_QUEUED", EmbeddedBroker.DEFAULT_MAX_QUEUED)),
+                "overflow": os.environ.get("EMBEDDED_BROKER_OVERFLOW", EmbeddedBroker.DROP),
+            }
+        }
+
     @staticmethod
     def get_url(broker_info):
         return broker_info["url"]
@@ -105,3 +133,8 @@ class BrokerInformator:
     @staticmethod
     def get_ws(broker_info):
         return broker_info["ws"]
+
+    @staticmethod
+    def get_embedded(broker_info):
+        # Options of the embedded broker, None for the other brokers
+        return broker_info.get("embedded")
@@ -0,0 +1,137 @@
+import argparse
+import os
+import struct
+import numpy as np
+import pandas as pd
+try:
+    # Optional: only needed to convert Parquet recordings
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# Capture files hold recorded samples (e.g. ESP32 AD8232 ECG captures) for the replay mode, in a raw binary layout that
+# is read through mmap (numpy.memmap): only the pages of the samples being replayed are loaded, a multi-GB recording
+# never is as a whole.
+#   header: magic b"SCAP", version, sample typecode (h, i, q, f, d), 2 bytes of padding, sample rate (float64, Hz),
+#           number of samples (uint64)
+#   then the samples, little endian
+# CSV and Parquet recordings are converted ONCE, chunk after chunk, into a capture file next to them (<file>.scap) that
+# is reused as long as it is more recent than the recording. Raw headerless captures can be converted too.
+#
+# python3 captureFile.py recording.csv --column value --rate 250           -> recording.csv.scap
+# python3 captureFile.py adc.raw --raw-dtype int16 --rate 500 -o adc.scap
+class CaptureFile:
+
+    MAGIC = b"SCAP"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBcxxdQ")
+    EXTENSION = ".scap"
+    TYPECODES = {"h": "<i2", "i": "<i4", "q": "<i8", "f": "<f4", "d": "<f8"}
+    DTYPE_TYPECODES = {np.dtype(dtype).name: typecode for typecode, dtype in TYPECODES.items()}
+    CHUNK_ROWS = 1_000_000 # rows converted at once
+
+    def __init__(self, path):
+        # Opens an existing capture file (mapped, nothing is read yet)
+        self.path = path
+        with open(path, "rb") as file:
+            magic, version, typecode, self.rate, self.count = CaptureFile.HEADER.unpack(file.read(CaptureFile.HEADER.size))
+        if magic != CaptureFile.MAGIC or version != CaptureFile.VERSION:
+            raise ValueError("{} is not a capture file (convert it first, see captureFile.py)".format(path))
+        self.dtype = np.dtype(CaptureFile.TYPECODES[typecode.decode()])
+        self.samples = np.memmap(path, dtype=self.dtype, mode="r", offset=CaptureFile.HEADER.size, shape=(self.count,))
+
+    def describe(self):
+        return "{}: {} samples ({}) at {:g} Hz, {:.1f} s".format(self.path, self.count, self.dtype.name, self.rate,
+                                                                self.count / self.rate if self.rate else 0)
+
+    # ---------------------------------------------------- CONVERSION ----------------------------------------------------
+
+    @staticmethod
+    def ensure_capture(path, column=None, rate=None):
+        # Path of a capture file for this recording, converted first if needed
+        if path.endswith(CaptureFile.EXTENSION):
+            return path
+        capture_path = path + CaptureFile.EXTENSION
+        if not os.path.exists(capture_path) or os.path.getmtime(capture_path) < os.path.getmtime(path):
+            CaptureFile.convert(path, capture_path, column, rate)
+        return capture_path
+
+    @staticmethod
+    def convert(source, destination, column=None, rate=None, raw_dtype=None):
+        if raw_dtype is not None:
+            chunks = CaptureFile.read_raw(source, raw_dtype)
+        elif source.endswith(".parquet"):
+            chunks = CaptureFile.read_parquet(source, column)
+        else:
+            chunks = CaptureFile.read_csv(source, column)
+        # Written into a temporary file of the same folder, renamed at the end: an interrupted or failed conversion
+        # never leaves a truncated capture file that ensure_capture would take as up to date
+        temporary = "{}.{}.tmp".format(destination, os.getpid())
+        try:
+            count, typecode = 0, None
+            with open(temporary, "wb") as file:
+                file.write(bytes(CaptureFile.HEADER.size)) # written at the end, when the count is known
+                for values, chunk_rate in chunks:
+                    if typecode is None:
+                        # The type of the first chunk is kept: integers stay integers (ADC samples)
+                        typecode = CaptureFile.DTYPE_TYPECODES.get(values.dtype.name, "d")
+                        rate = rate or chunk_rate
+                    values.astype(CaptureFile.TYPECODES[typecode]).tofile(file)
+                    count += len(values)
+                if typecode is None:
+                    raise ValueError("{} holds no sample".format(source))
+                if not rate:
+                    raise ValueError("The sample rate of {} is unknown, give it (--rate)".format(source))
+                file.seek(0)
+                file.write(CaptureFile.HEADER.pack(CaptureFile.MAGIC, CaptureFile.VERSION, typecode.encode(), rate, count))
+            os.replace(temporary, destination)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        print("{} samples of {} converted into {}".format(count, source, destination))
+        return destination
+
+    @staticmethod
+    def rate_from_times(times_ns):
+        # Sample rate of a recording with a time column in nanoseconds (e.g. the results files of this application)
+        return 1e9 / float(np.median(np.diff(times_ns))) if len(times_ns) > 1 else None
+
+    @staticmethod
+    def read_csv(path, column):
+        first = True
+        for chunk in pd.read_csv(path, chunksize=CaptureFile.CHUNK_ROWS):
+            name = column or ("value" if "value" in chunk.columns else chunk.columns[-1])
+            chunk_rate = None
+            if first and "timestamp_ns" in chunk.columns:
+                chunk_rate = CaptureFile.rate_from_times(chunk["timestamp_ns"].to_numpy())
+            first = False
+            yield pd.to_numeric(chunk[name], errors="coerce").dropna().to_numpy(), chunk_rate
+
+    @staticmethod
+    def read_parquet(path, column):
+        if pq is None:
+            raise ImportError("pyarrow is needed to convert Parquet files (pip install pyarrow)")
+        parquet = pq.ParquetFile(path)
+        name = column or ("value" if "value" in parquet.schema.names else parquet.schema.names[-1])
+        for batch in parquet.iter_batches(batch_size=CaptureFile.CHUNK_ROWS, columns=[name]):
+            yield batch.column(0).to_numpy(zero_copy_only=False), None
+
+    @staticmethod
+    def read_raw(path, raw_dtype):
+        samples = np.memmap(path, dtype=np.dtype(raw_dtype), mode="r")
+        for start in range(0, len(samples), CaptureFile.CHUNK_ROWS):
+            yield np.asarray(samples[start:start + CaptureFile.CHUNK_ROWS]), None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="captureFile.py", description="Converts a recording into a capture file for the replay mode")
+    parser.add_argument("source", help="CSV, Parquet or raw binary recording")
+    parser.add_argument("-o", "--output", help="capture file (default: <source>.scap)")
+    parser.add_argument("--column", help="column of the samples (default: 'value', or the last column)")
+    parser.add_argument("--rate", type=float, help="sample rate in Hz (default: from the timestamp_ns column)")
+    parser.add_argument("--raw-dtype", choices=sorted(CaptureFile.DTYPE_TYPECODES), help="the source is a raw binary file of this type")
+    options = parser.parse_args()
+    output = CaptureFile.convert(options.source, options.output or options.source + CaptureFile.EXTENSION, options.column,
+                                 options.rate, options.raw_dtype)
+    print(CaptureFile(output).describe())
@@ -0,0 +1,147 @@
+import itertools
+import json
+import threading
+import time
+import numpy as np
+
+# ClockSync estimates the offset (and drift) of the sensor clock against the server clock, so that the one-way latency
+# stays meaningful when the sensor and the server run on different machines (or on an ESP32): a clock skew of a few
+# milliseconds is as large as the transit times we measure.
+#
+# NTP-style exchange over the usual topic pair, every interval_s seconds:
+#   server  t1 --- {cmd: sync, id: n} ------------------>  t2  sensor
+#   server  t4 <-- {ans: sync, id: n, received: t2} ---  t3  (t3 = timestamp of the answer)
+#   offset = ((t2 - t1) + (t3 - t4)) / 2     sensor clock - server clock
+#   delay  = (t4 - t1) - (t3 - t2)           round trip without the time spent in the sensor
+# The true offset is within offset +/- delay / 2. As in NTP, only the exchange with the lowest delay of each group of
+# FILTER_SIZE exchanges is kept (the others were delayed in a queue), and a line fitted through the kept exchanges gives
+# the offset at any time (the slope is the drift of the clocks, in ppm).
+class ClockSync:
+
+    DEFAULT_INTERVAL_S = 10.0
+    FILTER_SIZE = 8
+    MAX_PENDING = 100 # requests never answered (sensor without sync support) are forgotten
+    # Over a shorter span, the noise of the delays is much larger than the drift (a few ppm): the offset is taken constant
+    MIN_DRIFT_SPAN_S = 60.0
+
+    def __init__(self, send_request=None, interval_s=DEFAULT_INTERVAL_S):
+        # send_request(request_id) publishes a sync command carrying this request id
+        self.send_request = send_request
+        self.interval_s = interval_s
+        self.request_ids = itertools.count()
+        self.requested = 0
+        self.pending = {} # request id -> t1 (ns)
+        self.samples = [] # (time of the exchange on the server clock, offset, delay), in ns
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    # ---------------------------------------------------- EXCHANGES ----------------------------------------------------
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="clock-sync", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            self.request()
+            if self.stopped.wait(self.interval_s):
+                return
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def request(self):
+        request_id = next(self.request_ids)
+        with self.lock:
+            if len(self.pending) >= ClockSync.MAX_PENDING:
+                del self.pending[min(self.pending)]
+            # Taken before publishing: the delay is slightly overestimated, never underestimated
+            self.pending[request_id] = time.time_ns()
+            self.requested += 1
+        self.send_request(request_id)
+
+    def add_exchange(self, request_id, received_us, answered_us, answer_received_ns):
+        # received_us, answered_us: t2 and t3 of the sensor (message timestamps are in microseconds), answer_received_ns: t4
+        with self.lock:
+            sent_ns = self.pending.pop(request_id, None)
+            if sent_ns is None:
+                return # answer to another server, or forgotten
+            received_ns, answered_ns = received_us * 1000, answered_us * 1000
+            offset_ns = ((received_ns - sent_ns) + (answered_ns - answer_received_ns)) // 2
+            delay_ns = (answer_received_ns - sent_ns) - (answered_ns - received_ns)
+            self.samples.append(((sent_ns + answer_received_ns) // 2, offset_ns, delay_ns))
+
+    # ---------------------------------------------------- ESTIMATION ----------------------------------------------------
+
+    def kept_samples(self):
+        # Lowest delay exchange of each group of FILTER_SIZE exchanges (the last group may be incomplete)
+        with self.lock:
+            samples = np.array(self.samples, dtype=np.int64).reshape(-1, 3)
+        kept = [group[np.argmin(group[:, 2])] for group in
+                (samples[start:start + ClockSync.FILTER_SIZE] for start in range(0, len(samples), ClockSync.FILTER_SIZE))]
+        return np.array(kept, dtype=np.int64).reshape(-1, 3)
+
+    def estimate(self):
+        # None before the first answered exchange
+        kept = self.kept_samples()
+        if len(kept) == 0:
+            return None
+        times_ns, offsets_ns, delays_ns = kept[:, 0], kept[:, 1], kept[:, 2]
+        reference_ns = int(times_ns[-1])
+        if len(kept) >= 3 and times_ns[-1] - times_ns[0] >= ClockSync.MIN_DRIFT_SPAN_S * 1e9:
+            drift, offset_ns = np.polyfit((times_ns - reference_ns).astype(np.float64), offsets_ns.astype(np.float64), 1)
+            residuals_ns = offsets_ns - (offset_ns + drift * (times_ns - reference_ns))
+            # Each kept exchange bounds the offset within +/- delay / 2, plus the distance of the fitted line to them
+            error_bound_ns = float(delays_ns.max()) / 2 + float(np.sqrt(np.mean(residuals_ns ** 2)))
+        else:
+            # The most precise exchange: the lowest delay
+            drift, offset_ns = 0.0, float(offsets_ns[np.argmin(delays_ns)])
+            error_bound_ns = float(delays_ns.min()) / 2
+        return {
+            "exchanges": len(self.samples),
+            "kept": len(kept),
+            "reference_ns": reference_ns,
+            "offset_ns": offset_ns,
+            "drift_ppm": drift * 1e6,
+            "error_bound_ns": error_bound_ns,
+            "min_delay_ns": int(delays_ns.min()),
+        }
+
+    def offset_at(self, times_ns):
+        # Offset (sensor - server) at these times, int64 ns: subtracted from a sensor time, gives the server time
+        estimate = self.estimate()
+        times_ns = np.asarray(times_ns, dtype=np.int64)
+        if estimate is None:
+            return np.zeros_like(times_ns)
+        offsets_ns = estimate["offset_ns"] + estimate["drift_ppm"] / 1e6 * (times_ns - estimate["reference_ns"])
+        return np.round(offsets_ns).astype(np.int64)
+
+    def describe(self):
+        estimate = self.estimate()
+        if estimate is None:
+            return "no clock estimate ({} sync requests, no answer)".format(self.requested)
+        return ("sensor clock offset {:+.3f} ms, drift {:+.2f} ppm, error bound +/- {:.3f} ms ({} exchanges)"
+                .format(estimate["offset_ns"] / 1e6, estimate["drift_ppm"], estimate["error_bound_ns"] / 1e6, estimate["exchanges"]))
+
+    # ---------------------------------------------------- FILES ----------------------------------------------------
+
+    @staticmethod
+    def get_file_path(results_file_path):
+        # Saved next to the results file of the server: results/<broker>-server-<date>-clock.json
+        return results_file_path[:-len(".csv")] + "-clock.json" if results_file_path.endswith(".csv") else results_file_path + "-clock.json"
+
+    def save(self, path):
+        with open(path, "w") as file:
+            json.dump({"samples": self.samples, "estimate": self.estimate()}, file, indent=1)
+        return path
+
+    @staticmethod
+    def load(path):
+        with open(path) as file:
+            data = json.load(file)
+        clock = ClockSync()
+        clock.samples = [tuple(sample) for sample in data["samples"]]
+        return clock
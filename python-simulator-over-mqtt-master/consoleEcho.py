@@ -0,0 +1,64 @@
+import datetime
+import time
+
+# ConsoleEcho prints the exchanged messages in the terminal WITHOUT slowing down the hot paths.
+# Printing one line per message costs more than building and publishing the message itself at high rates (and floods
+# the terminal), so the values are echoed at most max_lines_per_second times per second; the skipped lines are counted
+# and reported on the next printed line. The line is only formatted if it is actually printed.
+# Commands and answers are rare and important: they are always printed (see always()).
+class ConsoleEcho:
+
+    ALL = "all"   # print every message (historical behaviour)
+    NONE = "none" # print nothing but commands and answers
+    DEFAULT = "10" # at most 10 value lines per second
+
+    def __init__(self, spec=DEFAULT):
+        # spec: "all", "none" or a maximum number of lines per second
+        spec = str(spec).strip().lower()
+        if spec == ConsoleEcho.ALL:
+            self.interval_ns = 0
+        elif spec == ConsoleEcho.NONE:
+            self.interval_ns = None
+        else:
+            lines_per_second = float(spec)
+            if lines_per_second <= 0:
+                raise ValueError("The echo rate must be positive, or use 'none'")
+            self.interval_ns = int(1e9 / lines_per_second)
+        self.next_line_ns = 0
+        self.skipped = 0
+
+    def show(self, line_format, *arguments):
+        if self.interval_ns is None:
+            return
+        if self.interval_ns:
+            now = time.monotonic_ns()
+            if now < self.next_line_ns:
+                self.skipped += 1
+                return
+            self.next_line_ns = now + self.interval_ns
+        if self.skipped:
+            print(line_format.format(*arguments) + " (+{} not shown)".format(self.skipped))
+            self.skipped = 0
+        else:
+            print(line_format.format(*arguments))
+
+    def always(self, line_format, *arguments):
+        print(line_format.format(*arguments))
+
+
+class ReadableTime:
+    # Lazy human readable version of a time.time_ns() timestamp: only formatted if the line is printed
+    __slots__ = ("ns",)
+
+    def __init__(self, ns):
+        self.ns = ns
+
+    def __str__(self):
+        return ReadableTime.format(self.ns)
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+    @staticmethod
+    def format(ns, pattern='%Y-%m-%d %H:%M:%S.%f'):
+        return datetime.datetime.fromtimestamp(ns / 1e9).strftime(pattern)
@@ -7,6 +7,12 @@ class MqttAppConstants:
     MODE_SENSOR = "sensor"
     MODE_SERVER = "server"
     MODE_WSS_CLIENT_OVER_MQTT = "client" # YOU NEED TO USE BROKER THAT SUPPPORTS WeSockets over MQTT (like hivemq)
+    MODE_FLEET = "fleet" # many virtual sensors in one process (load testing), options: ./mqttCliApp.py fleet [broker] --help
+    MODE_REPORT = "report" # not a simulation: builds the Excel report from the results files of a sensor and a server run
+    MODE_BENCH = "bench" # headless benchmark matrix (brokers x rates x payload sizes x QoS x sensors), broker: "local,hivemq"
+    MODE_WARD = "ward" # one server for many sensors: wildcard subscription (ex: "+" listens to "+/sensor"), see mode/wardMode.py
+    MODE_PING = "ping" # command round trip benchmark (ping storm), options: ./mqttCliApp.py ping [broker] --help
+    MODE_REPLAY = "replay" # sensors publishing a recording (capture file, CSV, Parquet), options: ./mqttCliApp.py replay [broker] --help
 
     ######## Available broker 
     # if you add a new broker here, please complete brokerInformator.py and update get_brokers
@@ -15,6 +21,7 @@ class MqttAppConstants:
     HIVEMQ = "hivemq"
     MARTIN_HIVEMQ = "martin_hivemq"
     WEBSOCKET_HIVEMQ = "wss_over_hivemq"
+    EMBEDDED = "embedded" # pure Python broker started by the application itself (see embeddedBroker.py)
 
     ####### Topic duplication
     # Topic duplication in order to allow 1:1 communication beetween the sensor and the servor
@@ -29,6 +36,12 @@ class MqttAppConstants:
     HEARING_FROM_SENSOR =  "/sensor"
     HEARING_FROM_SERVER =  "/server"
 
+    # A ward server for the pattern "ward1/+" publishes its commands for all the sensors on "ward1/broadcast/server",
+    # for "+" on "broadcast/server". MQTT does not allow publishing on a wildcard topic, hence these dedicated topics:
+    # each sensor listens to the broadcast topic of every level above its own topic ("ward1/bed3" listens to
+    # "broadcast/server" and "ward1/broadcast/server"), so a ward server only reaches the sensors under its pattern.
+    BROADCAST_TOPIC = "broadcast"
+
     ####### Servor commands
     # Servor command for controlling the sensor
     # if you add a new command here, you need to update both sensorMode.py and servorMode.py =>
@@ -36,6 +49,7 @@ class MqttAppConstants:
     COMMAND_PING = "ping"
     COMMAND_START = "start"
     COMMAND_STOP = "stop"
+    COMMAND_SYNC = "sync" # clock synchronization request (sent in the background by the server, see clockSync.py)
 
     ####### Sensor answers
     # The sensor answeres the server command
@@ -43,6 +57,7 @@ class MqttAppConstants:
     PING_RESPONSE_WHEN_ALREADY_PUBLISHING = "pong.publishing" # Means the sensor is online but already publishing
     START_RESPONSE = "start.publishing"                       # Means the sensor has started to publish
     STOP_RESPONSE = "stop.publishing"                         # Means the sensor has stopped the publication of values
+    SYNC_RESPONSE = "sync.time"                               # Carries the time the sync command was received (MSG_RECEIVED)
 
     ###### Message fields,
     # ----- SERVER
@@ -50,29 +65,80 @@ class MqttAppConstants:
     # ----- SENSOR
     # 1) answers command server {timestamp: time, ans: answer}
     # OR 
-    # 2) sends time series values, a json {timestamp: time, value: val} 
+    # 2) sends time series values, a json {timestamp: time, seq: n, value: val}
+    # OR
+    # 3) in batching mode, sends several values at once {timestamp: time of the first value, seq: n, period: period, values: [val, ...]}
+    #    (period in microseconds beetween two values, see sampleBatcher.py)
+    # seq is the sequence number of the value (of the first value for a batch), it starts at 0 and is incremented for each
+    # value: the reports match sent and received values with it (loss, duplicates, reordering...)
+    # A command may carry a request id {timestamp: time, cmd: command, id: n}: the sensor copies it in its answer
+    # {timestamp: time, ans: answer, id: n}, so that the answer can be matched to its command (ping mode)
+    # The answer to sync also carries the time the sensor received the command {timestamp: time, ans: sync.time, id: n,
+    # received: time}, both in microseconds on the sensor clock (see clockSync.py)
     MSG_TIMESTAMP = "timestamp"
     MSG_CMD = "cmd"
     MSG_ANS = "ans"
     MSG_VALUE = "value"
+    MSG_VALUES = "values"
+    MSG_PERIOD = "period"
+    MSG_SEQ = "seq"
+    MSG_ID = "id"
+    MSG_RECEIVED = "received"
+    MSG_PADDING = "pad" # optional filler of the value messages, to reach a given payload size (bench mode)
+
+    ###### Codecs (how the messages above are serialized, see messageCodec.py)
+    # if you add a new codec here, please complete messageCodec.py and update get_codecs
+    CODEC_JSON = "json"     # default, understood by the backend and the ESP32
+    CODEC_BINARY = "binary" # packed binary format, for high message rates between simulators
+
+    ###### Signals (values published by the sensors, see signalGenerator.py)
+    # if you add a new signal here, please complete signalGenerator.py and update get_signals
+    SIGNAL_RANDOM = "random"   # integers in [1, 100] (historical behaviour)
+    SIGNAL_ORDERED = "ordered" # 1, 2, 3...
+    SIGNAL_ECG = "ecg"         # synthetic ECG (pysimulator-esp32-ecg-topic)
+    SIGNAL_SINE = "sine"
+    SIGNAL_NOISE = "noise"
    
     @staticmethod
     def get_modes():
-        return [MqttAppConstants.MODE_SENSOR, MqttAppConstants.MODE_SERVER, MqttAppConstants.MODE_WSS_CLIENT_OVER_MQTT]
+        return [MqttAppConstants.MODE_SENSOR, MqttAppConstants.MODE_SERVER, MqttAppConstants.MODE_WSS_CLIENT_OVER_MQTT, MqttAppConstants.MODE_FLEET, MqttAppConstants.MODE_REPORT, MqttAppConstants.MODE_BENCH, MqttAppConstants.MODE_WARD, MqttAppConstants.MODE_PING, MqttAppConstants.MODE_REPLAY]
     
     @staticmethod
     def get_brokers():
-        return [MqttAppConstants.LOCAL, MqttAppConstants.MOSQUITTO, MqttAppConstants.HIVEMQ, MqttAppConstants.MARTIN_HIVEMQ, MqttAppConstants.WEBSOCKET_HIVEMQ]
+        return [MqttAppConstants.LOCAL, MqttAppConstants.MOSQUITTO, MqttAppConstants.HIVEMQ, MqttAppConstants.MARTIN_HIVEMQ, MqttAppConstants.WEBSOCKET_HIVEMQ, MqttAppConstants.EMBEDDED]
     
+    @staticmethod
+    def get_codecs():
+        return [MqttAppConstants.CODEC_JSON, MqttAppConstants.CODEC_BINARY]
+
+    @staticmethod
+    def get_signals():
+        return [MqttAppConstants.SIGNAL_RANDOM, MqttAppConstants.SIGNAL_ORDERED, MqttAppConstants.SIGNAL_ECG, MqttAppConstants.SIGNAL_SINE, MqttAppConstants.SIGNAL_NOISE]
+
     @staticmethod
     def get_commands(): # Only send by the server
-        return [MqttAppConstants.COMMAND_PING, MqttAppConstants.COMMAND_START, MqttAppConstants.COMMAND_STOP]
+        return [MqttAppConstants.COMMAND_PING, MqttAppConstants.COMMAND_START, MqttAppConstants.COMMAND_STOP, MqttAppConstants.COMMAND_SYNC]
     
     @staticmethod
     def get_response(): # Only send by the sensor
-        return [MqttAppConstants.PING_RESPONSE, MqttAppConstants.PING_RESPONSE_WHEN_ALREADY_PUBLISHING, MqttAppConstants.START_RESPONSE, MqttAppConstants.STOP_RESPONSE]
+        return [MqttAppConstants.PING_RESPONSE, MqttAppConstants.PING_RESPONSE_WHEN_ALREADY_PUBLISHING, MqttAppConstants.START_RESPONSE, MqttAppConstants.STOP_RESPONSE, MqttAppConstants.SYNC_RESPONSE]
     
     @staticmethod
     def get_full_topic_name(current_user_topic, who_to_hear_from):
         # As mentioned earlier, we apply the principle of topic duplication but obviously, we need a base topic
         return current_user_topic + who_to_hear_from
+
+    @staticmethod
+    def get_broadcast_topic(topic_pattern=""):
+        # Topic on which the commands for all the sensors of a pattern are sent: the levels before the first wildcard
+        levels = topic_pattern.split("/")
+        prefix = levels[:next((index for index, level in enumerate(levels) if level in ("+", "#")), len(levels) - 1)]
+        return MqttAppConstants.get_full_topic_name("/".join(prefix + [MqttAppConstants.BROADCAST_TOPIC]), MqttAppConstants.HEARING_FROM_SERVER)
+
+    @staticmethod
+    def get_broadcast_topics(topic):
+        # Broadcast topics a sensor listens to: one per level above its topic ("ward1/bed3" -> "broadcast/server",
+        # "ward1/broadcast/server")
+        levels = topic.split("/")
+        return [MqttAppConstants.get_full_topic_name("/".join(levels[:depth] + [MqttAppConstants.BROADCAST_TOPIC]), MqttAppConstants.HEARING_FROM_SERVER)
+                for depth in range(len(levels))]
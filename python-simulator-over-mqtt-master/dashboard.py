@@ -0,0 +1,98 @@
+import collections
+import contextlib
+import sys
+import threading
+import time
+from consoleEcho import ReadableTime
+from topicStats import TopicStatsTable
+
+try:
+    import curses # not shipped with Python on Windows (pip install windows-curses)
+except ImportError:
+    curses = None
+
+# LiveDashboard shows the TopicStatsTable of a mode in the terminal, refreshed REFRESH_S times per second, instead of one
+# line per received message: a session of hours stays readable and costs nothing more than the aggregates.
+# In a terminal (and with curses) it takes the whole screen and the commands are single keys (see KEYS); everything the
+# other threads print meanwhile is shown in the last lines of the screen. Otherwise (output redirected to a file, no
+# curses) the table is printed every PLAIN_INTERVAL_S seconds and the commands are typed as usual.
+class LiveDashboard:
+
+    REFRESH_S = 0.25
+    PLAIN_INTERVAL_S = 5.0
+    EVENT_LINES = 5
+    KEYS = {"p": "ping", "s": "start", "t": "stop"}
+
+    def __init__(self, table, title):
+        self.table = table
+        self.title = title
+        self.events = collections.deque(maxlen=LiveDashboard.EVENT_LINES) # last lines printed by the other threads
+        self.partial_line = ""
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def is_available():
+        return curses is not None and sys.stdin.isatty() and sys.stdout.isatty()
+
+    def run(self, send_command):
+        # Blocking with curses (until q or Ctrl+C, both raise KeyboardInterrupt), returns at once otherwise
+        if not LiveDashboard.is_available():
+            print("No terminal for the dashboard: the statistics are printed every {:g} s".format(LiveDashboard.PLAIN_INTERVAL_S))
+            self.thread = threading.Thread(target=self.print_tables, name="dashboard", daemon=True)
+            self.thread.start()
+            return
+        with contextlib.redirect_stdout(self):
+            curses.wrapper(self.loop, send_command)
+
+    def print_tables(self):
+        while not self.stopped.wait(LiveDashboard.PLAIN_INTERVAL_S):
+            print("\n".join(TopicStatsTable.format_rows(self.table.get_rows())))
+
+    # ---------------------------------------------------- CURSES ----------------------------------------------------
+
+    def loop(self, screen, send_command):
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass # terminal without an invisible cursor
+        screen.timeout(int(LiveDashboard.REFRESH_S * 1000)) # getch() waits at most one refresh period
+        while True:
+            self.draw(screen)
+            key = screen.getch()
+            if key < 0 or key > 255:
+                continue
+            key = chr(key).lower()
+            if key == "q":
+                raise KeyboardInterrupt
+            if key in LiveDashboard.KEYS:
+                send_command(LiveDashboard.KEYS[key])
+
+    def draw(self, screen):
+        height, width = screen.getmaxyx()
+        lines = ["{}  {}".format(self.title, ReadableTime(time.time_ns())), ""]
+        lines += TopicStatsTable.format_rows(self.table.get_rows())
+        lines += ["", "  ".join("[{}] {}".format(key, command) for key, command in LiveDashboard.KEYS.items()) + "  [q] quit", ""]
+        lines += list(self.events)
+        screen.erase()
+        for row, line in enumerate(lines[:height]):
+            try:
+                screen.addnstr(row, 0, line, width - 1)
+            except curses.error:
+                pass # last cell of the screen
+        screen.refresh()
+
+    # ---------------------------------------------------- PRINTS ----------------------------------------------------
+
+    def write(self, text):
+        # sys.stdout while the dashboard is shown (prints of the MQTT and receive threads)
+        lines = (self.partial_line + text).split("\n")
+        self.partial_line = lines.pop()
+        self.events.extend(line for line in lines if line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.stopped.set()
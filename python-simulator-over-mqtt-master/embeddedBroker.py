@@ -0,0 +1,413 @@
+import argparse
+import asyncio
+import collections
+import random
+import struct
+import threading
+
+# EmbeddedBroker is a small pure Python MQTT 3.1.1 broker (asyncio), started INSIDE the application when the broker
+# "embedded" is chosen: the measures no longer depend on a Mosquitto installation or on the network weather, and can
+# run on an isolated CI machine. It implements what the simulator uses:
+# - CONNECT / DISCONNECT, PINGREQ, SUBSCRIBE / UNSUBSCRIBE (wildcards + and #)
+# - PUBLISH at QoS 0, 1 and 2 from the clients (the messages are delivered at QoS 0 or 1, without retransmission).
+#   A QoS 2 message is kept until its PUBREL and only forwarded then (exactly once, even if the client sends it again).
+# Each client has a bounded outgoing queue written by its own task, which waits for the socket to drain: a subscriber
+# slower than the publishers makes its queue grow up to max_queued messages, then the overflow policy applies
+# (drop: the next messages for this client are dropped and counted, disconnect: the client is disconnected).
+# No retained messages, no persistent sessions, no will, no websockets, no authentication.
+#
+# Network faults can be injected on each delivered message (reproducible with a seed):
+# - latency_ms: fixed delay
+# - jitter_ms: random extra delay, uniform in [-jitter_ms, +jitter_ms] (messages can be reordered, like on a network)
+# - loss: probability of dropping the message
+#
+# Standalone: python3 embeddedBroker.py --port 1884 --latency-ms 5 --jitter-ms 2 --loss 0.01
+
+class MqttPacket:
+    CONNECT = 1
+    CONNACK = 2
+    PUBLISH = 3
+    PUBACK = 4
+    PUBREC = 5
+    PUBREL = 6
+    PUBCOMP = 7
+    SUBSCRIBE = 8
+    SUBACK = 9
+    UNSUBSCRIBE = 10
+    UNSUBACK = 11
+    PINGREQ = 12
+    PINGRESP = 13
+    DISCONNECT = 14
+
+    UINT16 = struct.Struct("!H")
+
+    @staticmethod
+    async def read(reader):
+        # Returns (packet type, flags, body)
+        first_byte = (await reader.readexactly(1))[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        body = await reader.readexactly(length) if length else b""
+        return first_byte >> 4, first_byte & 0x0F, body
+
+    @staticmethod
+    def build(packet_type, flags, body):
+        length = len(body)
+        encoded_length = bytearray()
+        while True:
+            byte = length % 128
+            length //= 128
+            encoded_length.append(byte | 0x80 if length else byte)
+            if not length:
+                break
+        return bytes([packet_type << 4 | flags]) + bytes(encoded_length) + body
+
+    @staticmethod
+    def read_string(body, offset):
+        (length,) = MqttPacket.UINT16.unpack_from(body, offset)
+        offset += 2
+        return body[offset:offset + length].decode("utf-8"), offset + length
+
+    @staticmethod
+    def encode_string(text):
+        data = text.encode("utf-8")
+        return MqttPacket.UINT16.pack(len(data)) + data
+
+
+class BrokerSession:
+    # One connected client
+
+    def __init__(self, broker, writer, client_id):
+        self.broker = broker
+        self.writer = writer
+        self.client_id = client_id
+        self.subscriptions = {} # topic filter -> granted QoS
+        self.next_packet_id = 0
+        self.closed = False
+        self.pending_qos2 = {} # packet id -> (topic, payload) of a QoS 2 PUBLISH waiting for its PUBREL
+        self.outgoing = collections.deque() # packets not written yet (see write_outgoing)
+        self.has_outgoing = asyncio.Event()
+        self.high_water = writer.transport.get_write_buffer_limits()[1]
+        self.writer_task = asyncio.get_running_loop().create_task(self.write_outgoing())
+
+    def take_packet_id(self):
+        self.next_packet_id = self.next_packet_id % 65535 + 1
+        return self.next_packet_id
+
+    def send(self, packet):
+        if self.closed:
+            return
+        if not self.outgoing and self.writer.transport.get_write_buffer_size() < self.high_water:
+            self.writer.write(packet) # the client keeps up: no task switch
+        else:
+            self.outgoing.append(packet)
+            self.has_outgoing.set()
+
+    async def write_outgoing(self):
+        # The packets pile up in `outgoing` while the socket buffer is above its high water mark, drain() waits for it
+        try:
+            while not self.closed:
+                await self.has_outgoing.wait()
+                self.has_outgoing.clear()
+                while self.outgoing and not self.closed:
+                    self.writer.write(self.outgoing.popleft())
+                    await self.writer.drain()
+        except ConnectionError:
+            self.close()
+
+    def deliver(self, topic, payload, qos):
+        if self.closed:
+            return
+        if len(self.outgoing) >= self.broker.max_queued:
+            # The acknowledgements and answers to the client itself are never dropped, only the deliveries
+            self.broker.on_overflow(self)
+            return
+        body = MqttPacket.encode_string(topic)
+        if qos:
+            body += MqttPacket.UINT16.pack(self.take_packet_id())
+        self.send(MqttPacket.build(MqttPacket.PUBLISH, qos << 1, body + payload))
+        self.broker.delivered += 1
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.outgoing.clear()
+            self.has_outgoing.set() # the writer task stops
+            self.writer.close()
+
+
+class EmbeddedBroker:
+
+    DEFAULT_HOST = "127.0.0.1"
+    DEFAULT_PORT = 1884 # not 1883, so that it never fights with a real local broker
+    DEFAULT_MAX_QUEUED = 10000 # messages waiting to be written to one client
+    DROP = "drop"
+    DISCONNECT = "disconnect"
+
+    _running = {} # (host, port) -> broker started by this process
+    _lock = threading.Lock()
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, latency_ms=0, jitter_ms=0, loss=0, seed=None,
+                 max_queued=DEFAULT_MAX_QUEUED, overflow=DROP):
+        if overflow not in EmbeddedBroker.get_overflow_policies():
+            raise ValueError("Unknown overflow policy {}, use one of {}".format(overflow, EmbeddedBroker.get_overflow_policies()))
+        if max_queued <= 0:
+            raise ValueError("The outgoing queue of a client must be positive")
+        self.host = host
+        self.port = port
+        self.latency_s = latency_ms / 1000
+        self.jitter_s = jitter_ms / 1000
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.sessions = {} # client id -> BrokerSession
+        # Exact topic filters are found with one dict lookup, only the wildcard filters are matched one by one
+        self.exact_subscriptions = {} # topic -> {session: qos}
+        self.wildcard_subscriptions = {} # filter -> {session: qos}
+        self.loop = None
+        self.server = None
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.max_queued = max_queued
+        self.overflow = overflow
+        self.overflowed = 0 # deliveries refused because the queue of the subscriber was full
+        self.slow_disconnects = 0
+
+    @staticmethod
+    def get_overflow_policies():
+        return [EmbeddedBroker.DROP, EmbeddedBroker.DISCONNECT]
+
+    # ---------------------------------------------------- STARTING ----------------------------------------------------
+
+    @staticmethod
+    def ensure_running(host=DEFAULT_HOST, port=DEFAULT_PORT, **options):
+        # Starts the broker in a background thread of this process, once. If the port is already taken (e.g. the
+        # sensor terminal started it and this is the server terminal), the existing broker is used.
+        with EmbeddedBroker._lock:
+            if (host, port) in EmbeddedBroker._running:
+                return EmbeddedBroker._running[(host, port)]
+            broker = EmbeddedBroker(host, port, **options)
+            try:
+                broker.start_in_thread()
+            except OSError:
+                print("Port {} already in use, using the broker that is already running there".format(port))
+                return None
+            EmbeddedBroker._running[(host, port)] = broker
+            print("Embedded broker listening on {}:{} {}".format(host, port, broker.describe_faults()))
+            return broker
+
+    def describe_faults(self):
+        return "(latency {:g} ms, jitter {:g} ms, loss {:g}, queue {} messages then {})".format(
+            self.latency_s * 1000, self.jitter_s * 1000, self.loss, self.max_queued, self.overflow)
+
+    def describe(self):
+        return "{} received, {} delivered, {} dropped, {} overflowed, {} slow clients disconnected".format(
+            self.received, self.delivered, self.dropped, self.overflowed, self.slow_disconnects)
+
+    def start_in_thread(self):
+        started = threading.Event()
+        errors = []
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.server = self.loop.run_until_complete(asyncio.start_server(self.handle_client, self.host, self.port))
+            except OSError as error:
+                errors.append(error)
+                started.set()
+                return
+            started.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=serve, name="embedded-broker", daemon=True).start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    async def serve_forever(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print("Embedded broker listening on {}:{} {}".format(self.host, self.port, self.describe_faults()))
+        async with self.server:
+            await self.server.serve_forever()
+
+    # ---------------------------------------------------- CLIENTS ----------------------------------------------------
+
+    async def handle_client(self, reader, writer):
+        session = None
+        try:
+            packet_type, _, body = await MqttPacket.read(reader)
+            if packet_type != MqttPacket.CONNECT:
+                return
+            session = self.connect(writer, body)
+            while not session.closed:
+                packet_type, flags, body = await MqttPacket.read(reader)
+                if packet_type == MqttPacket.PUBLISH:
+                    self.on_publish(session, flags, body)
+                elif packet_type == MqttPacket.PUBREL:
+                    self.on_pubrel(session, body)
+                elif packet_type == MqttPacket.SUBSCRIBE:
+                    self.on_subscribe(session, body)
+                elif packet_type == MqttPacket.UNSUBSCRIBE:
+                    self.on_unsubscribe(session, body)
+                elif packet_type == MqttPacket.PINGREQ:
+                    session.send(MqttPacket.build(MqttPacket.PINGRESP, 0, b""))
+                elif packet_type == MqttPacket.DISCONNECT:
+                    break
+                # PUBACK, PUBREC, PUBCOMP of our deliveries: nothing to do (no retransmission)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if session is not None:
+                self.disconnect(session)
+                session.close()
+            writer.close()
+
+    def connect(self, writer, body):
+        _, offset = MqttPacket.read_string(body, 0) # protocol name
+        offset += 4 # protocol level, flags, keep alive
+        client_id, _ = MqttPacket.read_string(body, offset)
+        if not client_id:
+            client_id = "embedded-{}".format(id(writer))
+        previous = self.sessions.get(client_id)
+        if previous is not None:
+            # Same client id: the previous connection is closed (MQTT 3.1.1)
+            self.disconnect(previous)
+            previous.close()
+        session = BrokerSession(self, writer, client_id)
+        self.sessions[client_id] = session
+        session.send(MqttPacket.build(MqttPacket.CONNACK, 0, b"\x00\x00"))
+        return session
+
+    def disconnect(self, session):
+        for topic_filter in list(session.subscriptions):
+            self.remove_subscription(session, topic_filter)
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+
+    # ---------------------------------------------------- SUBSCRIPTIONS ----------------------------------------------------
+
+    def on_subscribe(self, session, body):
+        (packet_id,) = MqttPacket.UINT16.unpack_from(body, 0)
+        offset = 2
+        granted = bytearray()
+        while offset < len(body):
+            topic_filter, offset = MqttPacket.read_string(body, offset)
+            qos = min(body[offset], 1) # delivered at QoS 0 or 1
+            offset += 1
+            session.subscriptions[topic_filter] = qos
+            table = self.wildcard_subscriptions if ("+" in topic_filter or "#" in topic_filter) else self.exact_subscriptions
+            table.setdefault(topic_filter, {})[session] = qos
+            granted.append(qos)
+        session.send(MqttPacket.build(MqttPacket.SUBACK, 0, MqttPacket.UINT16.pack(packet_id) + bytes(granted)))
+
+    def on_unsubscribe(self, session, body):
+        (packet_id,) = MqttPacket.UINT16.unpack_from(body, 0)
+        offset = 2
+        while offset < len(body):
+            topic_filter, offset = MqttPacket.read_string(body, offset)
+            self.remove_subscription(session, topic_filter)
+        session.send(MqttPacket.build(MqttPacket.UNSUBACK, 0, MqttPacket.UINT16.pack(packet_id)))
+
+    def remove_subscription(self, session, topic_filter):
+        session.subscriptions.pop(topic_filter, None)
+        for table in (self.exact_subscriptions, self.wildcard_subscriptions):
+            subscribers = table.get(topic_filter)
+            if subscribers is not None:
+                subscribers.pop(session, None)
+                if not subscribers:
+                    del table[topic_filter]
+
+    @staticmethod
+    def topic_matches(topic_filter, topic):
+        filter_levels = topic_filter.split("/")
+        topic_levels = topic.split("/")
+        for index, level in enumerate(filter_levels):
+            if level == "#":
+                return True
+            if index >= len(topic_levels) or (level != "+" and level != topic_levels[index]):
+                return False
+        return len(filter_levels) == len(topic_levels)
+
+    def subscribers_of(self, topic):
+        subscribers = dict(self.exact_subscriptions.get(topic, {}))
+        for topic_filter, sessions in self.wildcard_subscriptions.items():
+            if EmbeddedBroker.topic_matches(topic_filter, topic):
+                for session, qos in sessions.items():
+                    subscribers[session] = max(qos, subscribers.get(session, 0))
+        return subscribers
+
+    # ---------------------------------------------------- PUBLICATIONS ----------------------------------------------------
+
+    def on_publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        topic, offset = MqttPacket.read_string(body, 0)
+        if qos == 2:
+            # Forwarded on PUBREL: a PUBLISH sent again before (no PUBREC received) is not forwarded twice
+            packet_id = body[offset:offset + 2]
+            session.pending_qos2.setdefault(packet_id, (topic, body[offset + 2:]))
+            session.send(MqttPacket.build(MqttPacket.PUBREC, 0, packet_id))
+            return
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            session.send(MqttPacket.build(MqttPacket.PUBACK, 0, packet_id))
+        self.route(topic, body[offset:], qos)
+
+    def on_pubrel(self, session, body):
+        packet_id = body[:2]
+        message = session.pending_qos2.pop(packet_id, None)
+        session.send(MqttPacket.build(MqttPacket.PUBCOMP, 0, packet_id))
+        if message is not None:
+            self.route(*message, 2)
+
+    def route(self, topic, payload, qos):
+        self.received += 1
+        for subscriber, subscription_qos in self.subscribers_of(topic).items():
+            self.forward(subscriber, topic, payload, min(qos, subscription_qos))
+
+    def on_overflow(self, session):
+        self.overflowed += 1
+        if self.overflow == EmbeddedBroker.DISCONNECT:
+            self.slow_disconnects += 1
+            print("Embedded broker: {} does not read its messages fast enough, disconnected".format(session.client_id))
+            self.disconnect(session)
+            session.close()
+
+    def forward(self, subscriber, topic, payload, qos):
+        if self.loss and self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.latency_s
+        if self.jitter_s:
+            delay += self.random.uniform(-self.jitter_s, self.jitter_s)
+        if delay > 0:
+            self.loop.call_later(delay, subscriber.deliver, topic, payload, qos)
+        else:
+            subscriber.deliver(topic, payload, qos)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="embeddedBroker.py")
+    parser.add_argument("--host", default=EmbeddedBroker.DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=EmbeddedBroker.DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--loss", type=float, default=0, help="probability of dropping a delivered message (0 - 1)")
+    parser.add_argument("--seed", type=int, help="seed of the jitter and loss draws (reproducible runs)")
+    parser.add_argument("--max-queued", type=int, default=EmbeddedBroker.DEFAULT_MAX_QUEUED,
+                        help="messages waiting to be written to one client at most")
+    parser.add_argument("--overflow", choices=EmbeddedBroker.get_overflow_policies(), default=EmbeddedBroker.DROP,
+                        help="what to do with a client whose queue is full")
+    options = parser.parse_args()
+    broker = EmbeddedBroker(options.host, options.port, options.latency_ms, options.jitter_ms, options.loss, options.seed,
+                            options.max_queued, options.overflow)
+    try:
+        asyncio.run(broker.serve_forever())
+    except KeyboardInterrupt:
+        print("Embedded broker stopped: {}".format(broker.describe()))
@@ -0,0 +1,120 @@
+import math
+import numpy as np
+
+# LatencyHistogram counts latencies (nanoseconds) in logarithmic buckets, like an HDR histogram: each bucket is
+# `precision` wider than the previous one, so a percentile is known within `precision` (1 % by default) whatever the
+# number of values, with a fixed memory (~1900 buckets from 1 µs to 100 s).
+# Two histograms with the same parameters MERGE by adding their buckets: runs, sensors or processes can each keep their
+# own histogram and the percentiles of the whole are still exact (within the precision), unlike averaging percentiles.
+# Values outside [lowest_ns, highest_ns] (e.g. negative latencies caused by unsynchronized clocks) are counted in the
+# first/last bucket, the exact minimum and maximum are kept aside.
+class LatencyHistogram:
+
+    LOWEST_NS = 1000             # 1 µs
+    HIGHEST_NS = 100 * 10**9     # 100 s
+    PRECISION = 0.01             # relative width of a bucket
+
+    def __init__(self, lowest_ns=LOWEST_NS, highest_ns=HIGHEST_NS, precision=PRECISION):
+        self.lowest_ns = lowest_ns
+        self.highest_ns = highest_ns
+        self.precision = precision
+        self.log_base = math.log1p(precision)
+        self.bucket_count = int(math.ceil(math.log(highest_ns / lowest_ns) / self.log_base)) + 1
+        self.counts = np.zeros(self.bucket_count, dtype=np.int64)
+        self.total = 0
+        self.sum_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+        self.out_of_range = 0
+
+    # ---------------------------------------------------- RECORDING ----------------------------------------------------
+
+    def bucket_index(self, value_ns):
+        value_ns = min(max(value_ns, self.lowest_ns), self.highest_ns)
+        return int(math.log(value_ns / self.lowest_ns) / self.log_base)
+
+    def record(self, value_ns):
+        # One value (the receive paths), see record_many for whole columns
+        self.counts[self.bucket_index(value_ns)] += 1
+        self.total += 1
+        self.sum_ns += value_ns
+        self.min_ns = value_ns if self.min_ns is None else min(self.min_ns, value_ns)
+        self.max_ns = value_ns if self.max_ns is None else max(self.max_ns, value_ns)
+        if not self.lowest_ns <= value_ns <= self.highest_ns:
+            self.out_of_range += 1
+
+    def record_many(self, values_ns):
+        # A column of values (numpy array, pandas Series...), vectorized
+        values = np.asarray(values_ns, dtype=np.int64)
+        if values.size == 0:
+            return
+        clipped = np.clip(values, self.lowest_ns, self.highest_ns).astype(np.float64)
+        indexes = (np.log(clipped / self.lowest_ns) / self.log_base).astype(np.int64)
+        self.counts += np.bincount(indexes, minlength=self.bucket_count)
+        self.total += int(values.size)
+        self.sum_ns += int(values.sum())
+        low, high = int(values.min()), int(values.max())
+        self.min_ns = low if self.min_ns is None else min(self.min_ns, low)
+        self.max_ns = high if self.max_ns is None else max(self.max_ns, high)
+        self.out_of_range += int(((values < self.lowest_ns) | (values > self.highest_ns)).sum())
+
+    def merge(self, other):
+        if (self.lowest_ns, self.highest_ns, self.precision) != (other.lowest_ns, other.highest_ns, other.precision):
+            raise ValueError("Only histograms with the same lowest_ns, highest_ns and precision can be merged")
+        self.counts += other.counts
+        self.total += other.total
+        self.sum_ns += other.sum_ns
+        for value in (other.min_ns, other.max_ns):
+            if value is not None:
+                self.min_ns = value if self.min_ns is None else min(self.min_ns, value)
+                self.max_ns = value if self.max_ns is None else max(self.max_ns, value)
+        self.out_of_range += other.out_of_range
+        return self
+
+    # ---------------------------------------------------- READING ----------------------------------------------------
+
+    def bucket_value(self, index):
+        # Middle of the bucket (geometric), the reported value of every value counted in it
+        return self.lowest_ns * (1 + self.precision) ** (index + 0.5)
+
+    def value_at_percentile(self, percentile):
+        if self.total == 0:
+            return None
+        if percentile >= 100:
+            return self.max_ns
+        rank = max(1, math.ceil(percentile / 100 * self.total))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        # The exact extremes are better than the middle of their bucket
+        return min(max(self.bucket_value(index), self.min_ns), self.max_ns)
+
+    def mean(self):
+        return self.sum_ns / self.total if self.total else None
+
+    # ---------------------------------------------------- FILES ----------------------------------------------------
+
+    def to_dict(self):
+        # Compact (only the non empty buckets) and JSON friendly
+        indexes = np.flatnonzero(self.counts)
+        return {
+            "lowest_ns": self.lowest_ns,
+            "highest_ns": self.highest_ns,
+            "precision": self.precision,
+            "total": self.total,
+            "sum_ns": self.sum_ns,
+            "min_ns": self.min_ns,
+            "max_ns": self.max_ns,
+            "out_of_range": self.out_of_range,
+            "buckets": {str(index): int(self.counts[index]) for index in indexes},
+        }
+
+    @staticmethod
+    def from_dict(data):
+        histogram = LatencyHistogram(data["lowest_ns"], data["highest_ns"], data["precision"])
+        for index, count in data["buckets"].items():
+            histogram.counts[int(index)] = count
+        histogram.total = data["total"]
+        histogram.sum_ns = data["sum_ns"]
+        histogram.min_ns = data["min_ns"]
+        histogram.max_ns = data["max_ns"]
+        histogram.out_of_range = data["out_of_range"]
+        return histogram
@@ -0,0 +1,208 @@
+import datetime
+import json
+import os
+import numpy as np
+import pandas as pd
+from latencyHistogram import LatencyHistogram
+try:
+    # Optional: only needed for --plot
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+# LatencyReport gives the numbers tracked when comparing brokers, computed from the values matched on their sequence
+# numbers (see ResultReporter.match_by_sequence):
+# - latency percentiles (p50, p90, p99, p99.9) and maximum, from a LatencyHistogram
+# - jitter: mean difference of latency beetween two consecutive values
+# - throughput: values received per second
+# for the whole run and per time window (window_s seconds of reception).
+# It is saved as compact JSON (summary + histogram) and CSV (one row per window), plus an optional PNG plot. The JSON
+# files of several runs or sensors can be merged (the histograms are added, see LatencyHistogram).
+class LatencyReport:
+
+    PERCENTILES = (50, 90, 99, 99.9)
+    DEFAULT_WINDOW_S = 1.0
+    # Counts of ResultReporter.match_by_sequence, summed when reports are merged
+    COUNTS = ("sent", "received", "matched", "lost", "duplicates", "reordered", "unknown")
+
+    def __init__(self, broker_name, window_s=DEFAULT_WINDOW_S):
+        self.broker_name = broker_name
+        self.window_s = window_s
+        self.histogram = LatencyHistogram()
+        self.counts = dict.fromkeys(LatencyReport.COUNTS, 0)
+        self.jitter_sum_ns = 0
+        self.jitter_count = 0
+        self.first_receive_ns = None
+        self.last_receive_ns = None
+        self.windows = None # DataFrame, one row per window (only for a single run, not kept by merges)
+        # Latencies measured across two clocks corrected by ClockSync are only known within +/- this error, None otherwise
+        self.clock_error_ms = None
+
+    @staticmethod
+    def from_matched(broker_name, sent_ns, received_ns, stats, window_s=DEFAULT_WINDOW_S):
+        # sent_ns, received_ns: int64 arrays of the matched values, in sequence number order
+        # stats: counts of ResultReporter.match_by_sequence
+        latency = LatencyReport(broker_name, window_s)
+        latency.counts.update({name: stats[name] for name in LatencyReport.COUNTS})
+        latency.clock_error_ms = stats.get("clock_error_ms")
+        if received_ns.size == 0:
+            return latency
+        transit_ns = received_ns - sent_ns
+        latency.histogram.record_many(transit_ns)
+        jitter_ns = np.abs(np.diff(transit_ns))
+        latency.jitter_sum_ns = int(jitter_ns.sum())
+        latency.jitter_count = int(jitter_ns.size)
+        latency.first_receive_ns = int(received_ns.min())
+        latency.last_receive_ns = int(received_ns.max())
+        latency.windows = LatencyReport.compute_windows(received_ns, transit_ns, window_s)
+        return latency
+
+    @staticmethod
+    def compute_windows(received_ns, transit_ns, window_s):
+        window_ns = int(window_s * 1e9)
+        frame = pd.DataFrame({
+            "window": (received_ns - received_ns.min()) // window_ns,
+            "latency_ms": transit_ns / 1e6,
+            "jitter_ms": np.abs(np.diff(transit_ns, prepend=transit_ns[0])) / 1e6,
+        })
+        grouped = frame.groupby("window")
+        windows = pd.DataFrame({"window_start_s": grouped.size().index * window_s,
+                                "received": grouped.size(),
+                                "throughput_per_s": grouped.size() / window_s})
+        percentiles = grouped["latency_ms"].quantile([p / 100 for p in LatencyReport.PERCENTILES]).unstack()
+        percentiles.columns = ["p{:g}_ms".format(p) for p in LatencyReport.PERCENTILES]
+        windows = windows.join(percentiles)
+        windows["max_ms"] = grouped["latency_ms"].max()
+        windows["jitter_ms"] = grouped["jitter_ms"].mean()
+        return windows.reset_index(drop=True)
+
+    # ---------------------------------------------------- MERGE ----------------------------------------------------
+
+    def merge(self, other):
+        # Merging concurrent sensors gives their total throughput, merging successive runs their average throughput over
+        # the whole period
+        self.histogram.merge(other.histogram)
+        for name in LatencyReport.COUNTS:
+            self.counts[name] += other.counts[name]
+        if other.clock_error_ms is not None:
+            self.clock_error_ms = max(self.clock_error_ms or 0, other.clock_error_ms)
+        self.jitter_sum_ns += other.jitter_sum_ns
+        self.jitter_count += other.jitter_count
+        for value in (other.first_receive_ns, other.last_receive_ns):
+            if value is not None:
+                self.first_receive_ns = value if self.first_receive_ns is None else min(self.first_receive_ns, value)
+                self.last_receive_ns = value if self.last_receive_ns is None else max(self.last_receive_ns, value)
+        self.windows = None
+        return self
+
+    @staticmethod
+    def merge_files(paths):
+        reports = [LatencyReport.load(path) for path in paths]
+        merged = LatencyReport("+".join(sorted({report.broker_name for report in reports})), reports[0].window_s)
+        for report in reports:
+            merged.merge(report)
+        return merged
+
+    # ---------------------------------------------------- NUMBERS ----------------------------------------------------
+
+    def get_summary(self):
+        summary = dict(self.counts)
+        summary["mean_ms"] = LatencyReport.to_ms(self.histogram.mean())
+        for percentile in LatencyReport.PERCENTILES:
+            summary["p{:g}_ms".format(percentile)] = LatencyReport.to_ms(self.histogram.value_at_percentile(percentile))
+        summary["max_ms"] = LatencyReport.to_ms(self.histogram.max_ns)
+        summary["jitter_ms"] = LatencyReport.to_ms(self.jitter_sum_ns / self.jitter_count) if self.jitter_count else None
+        duration_ns = (self.last_receive_ns - self.first_receive_ns) if self.first_receive_ns is not None else 0
+        summary["throughput_per_s"] = self.histogram.total / (duration_ns / 1e9) if duration_ns else None
+        summary["clock_error_ms"] = self.clock_error_ms
+        return summary
+
+    @staticmethod
+    def to_ms(value_ns):
+        return None if value_ns is None else value_ns / 1e6
+
+    def print_summary(self):
+        summary = self.get_summary()
+        if summary["p50_ms"] is None:
+            print("Broker {}: no value received".format(self.broker_name))
+            return
+        # ("p99.9_ms" cannot be a format field name)
+        latencies = ["p{:g} {:.3f} ms".format(p, summary["p{:g}_ms".format(p)]) for p in LatencyReport.PERCENTILES]
+        print("Broker {}: latency {}, max {:.3f} ms{}".format(self.broker_name, ", ".join(latencies), summary["max_ms"],
+              "" if self.clock_error_ms is None else " (clocks synchronized within +/- {:.3f} ms)".format(self.clock_error_ms)))
+        print("Broker {}: jitter {} ms, throughput {} values/s, {lost} lost, {duplicates} duplicates, {reordered} reordered"
+              .format(self.broker_name,
+                      "-" if summary["jitter_ms"] is None else "{:.3f}".format(summary["jitter_ms"]),
+                      "-" if summary["throughput_per_s"] is None else "{:.1f}".format(summary["throughput_per_s"]),
+                      **summary))
+
+    # ---------------------------------------------------- FILES ----------------------------------------------------
+
+    def to_dict(self):
+        return {
+            "broker": self.broker_name,
+            "window_s": self.window_s,
+            "summary": self.get_summary(),
+            "counts": self.counts,
+            "jitter_sum_ns": self.jitter_sum_ns,
+            "jitter_count": self.jitter_count,
+            "first_receive_ns": self.first_receive_ns,
+            "last_receive_ns": self.last_receive_ns,
+            "clock_error_ms": self.clock_error_ms,
+            "histogram": self.histogram.to_dict(),
+        }
+
+    @staticmethod
+    def load(path):
+        with open(path) as file:
+            data = json.load(file)
+        report = LatencyReport(data["broker"], data["window_s"])
+        report.histogram = LatencyHistogram.from_dict(data["histogram"])
+        report.counts.update(data["counts"])
+        report.jitter_sum_ns = data["jitter_sum_ns"]
+        report.jitter_count = data["jitter_count"]
+        report.first_receive_ns = data["first_receive_ns"]
+        report.last_receive_ns = data["last_receive_ns"]
+        report.clock_error_ms = data.get("clock_error_ms") # absent from older reports
+        return report
+
+    def save(self, results_folder, plot=False):
+        # results/<broker>-latency-<date>.json (+ .csv per window, + .png), returns the path of the JSON file
+        os.makedirs(results_folder, exist_ok=True)
+        date = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        base_path = os.path.join(results_folder, "{}-latency-{}".format(self.broker_name, date))
+        with open(base_path + ".json", "w") as file:
+            json.dump(self.to_dict(), file, indent=1)
+        saved = [base_path + ".json"]
+        if self.windows is not None:
+            self.windows.to_csv(base_path + ".csv", index=False, float_format="%.6f")
+            saved.append(base_path + ".csv")
+        if plot:
+            if plt is None:
+                print("matplotlib is not installed, no plot (pip install matplotlib)")
+            else:
+                self.plot(base_path + ".png")
+                saved.append(base_path + ".png")
+        self.print_summary()
+        print("Latency report saved in {}".format(", ".join(saved)))
+        return base_path + ".json"
+
+    def plot(self, path):
+        figure, (over_time, distribution) = plt.subplots(2, 1, figsize=(12, 9))
+        if self.windows is not None:
+            for column in ["p50_ms", "p99_ms", "max_ms"]:
+                over_time.plot(self.windows["window_start_s"], self.windows[column], label=column)
+            over_time.set_xlabel("time (s)")
+            over_time.set_ylabel("latency (ms)")
+            over_time.legend()
+        indexes = np.flatnonzero(self.histogram.counts)
+        distribution.bar([self.histogram.bucket_value(index) / 1e6 for index in indexes], self.histogram.counts[indexes],
+                         width=[self.histogram.bucket_value(index) / 1e6 * self.histogram.precision for index in indexes])
+        distribution.set_xscale("log")
+        distribution.set_xlabel("latency (ms)")
+        distribution.set_ylabel("values")
+        figure.suptitle("Latency through the broker {}".format(self.broker_name))
+        figure.savefig(path)
+        plt.close(figure)
@@ -0,0 +1,231 @@
+import inspect
+import json
+import os
+import time
+
+# A LoadProfile changes the publication rate of a sensor over time, to find the saturation point (the "knee") of a
+# broker or of the backend in ONE run instead of restarting the sensor by hand at different rates. It is a list of
+# stages, each one expanded into phases of constant or linearly changing rate:
+#   ramp:from=10,to=1000,duration=60,steps=10       linear ramp, cut in `steps` phases (one per load level)
+#   step:from=100,to=1000,step=100,hold=10           ladder: from, from+step... to, each rate held `hold` seconds
+#   burst:base=50,peak=1000,period=10,length=1,cycles=6   `length` s at peak every `period` s, base rate in between
+#   poisson:rate=200,duration=60,seed=1              Poisson arrivals (random exponential gaps, mean rate `rate`)
+#   soak:rate=100,duration=3600                      long constant load
+# Stages are chained with ";" (ramp:...;soak:...), or given as a JSON file: a list of {"kind": "ramp", "from": 10, ...}.
+# Everything is deterministic (the Poisson gaps come from the seed): two runs of a profile offer the same load.
+#
+# Each value keeps its sequence number: the sensor saves the first sequence number of every phase next to its results
+# (<results>-profile.json, see ProfileDriver), the report mode tags each value with its phase and gives the latency and
+# the loss per offered load (see ResultReporter.generate_load_report).
+class LoadPhase:
+
+    def __init__(self, name, duration_s, from_rate, to_rate=None, poisson_seed=None):
+        if duration_s <= 0 or from_rate <= 0 or (to_rate is not None and to_rate <= 0):
+            raise ValueError("The durations and rates of a load profile must be positive")
+        self.name = name
+        self.duration_s = duration_s
+        self.from_rate = from_rate
+        self.to_rate = from_rate if to_rate is None else to_rate
+        self.poisson_seed = poisson_seed # None = regular arrivals
+        self.start_s = 0.0 # set by LoadProfile
+
+    def rate_at(self, elapsed_s):
+        # elapsed_s: since the start of the phase
+        return self.from_rate + (self.to_rate - self.from_rate) * min(1.0, elapsed_s / self.duration_s)
+
+    def offered_rate(self):
+        return (self.from_rate + self.to_rate) / 2
+
+
+class LoadProfile:
+
+    SEPARATOR = ";"
+    KEYWORD_OPTIONS = {"from": "start"} # option of a stage -> argument of its builder
+
+    def __init__(self, phases):
+        if not phases:
+            raise ValueError("A load profile needs at least one phase")
+        self.phases = phases
+        start_s = 0.0
+        for phase in phases:
+            phase.start_s = start_s
+            start_s += phase.duration_s
+        self.duration_s = start_s
+
+    @staticmethod
+    def from_spec(spec):
+        # "ramp:from=10,to=100,duration=30;soak:rate=100,duration=600", or the path of a JSON file
+        if spec.strip().endswith(".json") and os.path.exists(spec.strip()):
+            with open(spec.strip()) as file:
+                stages = json.load(file)
+            return LoadProfile([phase for stage in stages for phase in LoadProfile.expand(stage)])
+        phases = []
+        for stage_spec in filter(None, (part.strip() for part in spec.split(LoadProfile.SEPARATOR))):
+            kind, _, options_text = stage_spec.lower().partition(":")
+            stage = {"kind": kind}
+            for option in filter(None, options_text.split(",")):
+                key, _, value = option.partition("=")
+                stage[key.strip()] = float(value)
+            phases += LoadProfile.expand(stage)
+        return LoadProfile(phases)
+
+    @staticmethod
+    def expand(stage):
+        # One stage (kind + options) -> its phases. "from" is a Python keyword: it is the `start` argument of the builders.
+        stage = dict(stage)
+        kind = stage.pop("kind", None)
+        builder = LoadProfile.get_stage_builders().get(kind)
+        if builder is None:
+            raise ValueError("Invalid load profile stage {}, use one of {}".format(kind, sorted(LoadProfile.get_stage_builders())))
+        options = {LoadProfile.KEYWORD_OPTIONS.get(key, key): value for key, value in stage.items()}
+        parameters = inspect.signature(builder).parameters
+        unknown = [key for key in options if key not in parameters]
+        missing = [name for name, parameter in parameters.items() if parameter.default is parameter.empty and name not in options]
+        if unknown or missing:
+            names = {argument: key for key, argument in LoadProfile.KEYWORD_OPTIONS.items()}
+            raise ValueError("Invalid load profile stage {}:{}{}".format(
+                kind,
+                " unknown option(s) {}".format(", ".join(names.get(key, key) for key in unknown)) if unknown else "",
+                " missing option(s) {}".format(", ".join(names.get(name, name) for name in missing)) if missing else ""))
+        return builder(**options)
+
+    @staticmethod
+    def get_stage_builders():
+        return {
+            "ramp": LoadProfile.ramp,
+            "step": LoadProfile.step,
+            "burst": LoadProfile.burst,
+            "poisson": LoadProfile.poisson,
+            "soak": LoadProfile.soak,
+        }
+
+    # ---------------------------------------------------- STAGES ----------------------------------------------------
+
+    @staticmethod
+    def ramp(start, to, duration, steps=10):
+        steps = max(1, int(steps))
+        phases = []
+        for index in range(steps):
+            low = start + (to - start) * index / steps
+            high = start + (to - start) * (index + 1) / steps
+            phases.append(LoadPhase("ramp {:g}-{:g}/s".format(low, high), duration / steps, low, high))
+        return phases
+
+    @staticmethod
+    def step(start, to, step, hold):
+        if step <= 0:
+            raise ValueError("The step of a step ladder must be positive")
+        phases = []
+        rate = start
+        while rate <= to + 1e-9:
+            phases.append(LoadPhase("step {:g}/s".format(rate), hold, rate))
+            rate += step
+        return phases
+
+    @staticmethod
+    def burst(base, peak, period, length, cycles=1):
+        if not 0 < length < period:
+            raise ValueError("The length of a burst must be shorter than its period")
+        phases = []
+        for cycle in range(int(cycles)):
+            phases.append(LoadPhase("burst {:g}/s".format(peak), length, peak))
+            phases.append(LoadPhase("base {:g}/s".format(base), period - length, base))
+        return phases
+
+    @staticmethod
+    def poisson(rate, duration, seed=0):
+        return [LoadPhase("poisson {:g}/s".format(rate), duration, rate, poisson_seed=int(seed))]
+
+    @staticmethod
+    def soak(rate, duration):
+        return [LoadPhase("soak {:g}/s".format(rate), duration, rate)]
+
+    # ---------------------------------------------------- READING ----------------------------------------------------
+
+    def phase_at(self, elapsed_s, hint=0):
+        # Index of the phase running elapsed_s after the start (searched from hint, the current phase), None at the end
+        for index in range(hint, len(self.phases)):
+            phase = self.phases[index]
+            if elapsed_s < phase.start_s + phase.duration_s:
+                return index
+        return None
+
+    def describe(self):
+        return "{} phases, {:g} s: {}".format(len(self.phases), self.duration_s, ", ".join(
+            "{} ({:g} s)".format(phase.name, phase.duration_s) for phase in self.phases))
+
+
+class ProfileDriver:
+    # Applies a LoadProfile to the RateScheduler of ONE publisher, from the publisher's own thread or task (update() is
+    # called before each wait of the scheduler, a cheap time comparison most of the time). The phases actually run are
+    # logged with their first sequence number and saved with save().
+
+    UPDATE_INTERVAL_NS = 50_000_000 # the rate of a ramp is updated every 50 ms
+    COLUMNS = ("phase", "name", "offered_rate", "start_ns", "end_ns", "first_seq", "end_seq")
+
+    def __init__(self, profile, scheduler, announce=True):
+        # announce: print each new phase (not for the thousands of sensors of a fleet)
+        self.profile = profile
+        self.scheduler = scheduler
+        self.announce = announce
+        self.start_ns = None
+        self.index = None
+        self.next_update_ns = 0
+        self.log = [] # one row per phase run (see COLUMNS)
+
+    def start(self, seq):
+        self.start_ns = time.monotonic_ns()
+        self.index = None
+        self.next_update_ns = 0
+        return self.update(seq)
+
+    def update(self, seq):
+        # seq: sequence number of the next value. Returns False once the profile is over.
+        now = time.monotonic_ns()
+        if now < self.next_update_ns:
+            return True
+        self.next_update_ns = now + ProfileDriver.UPDATE_INTERVAL_NS
+        elapsed_s = (now - self.start_ns) / 1e9
+        index = self.profile.phase_at(elapsed_s, self.index or 0)
+        if index != self.index:
+            self.close_phase(seq)
+            self.index = index
+            if index is None:
+                return False
+            phase = self.profile.phases[index]
+            self.scheduler.set_arrivals(phase.poisson_seed)
+            self.log.append({"phase": index, "name": phase.name, "offered_rate": phase.offered_rate(), "start_ns": time.time_ns(),
+                             "end_ns": None, "first_seq": seq, "end_seq": None})
+            if self.announce:
+                print("Load profile: phase {} {}".format(index, phase.name))
+        phase = self.profile.phases[self.index]
+        rate = phase.rate_at(elapsed_s - phase.start_s)
+        if rate != self.scheduler.rate:
+            self.scheduler.set_rate(rate)
+        return True
+
+    def close_phase(self, seq):
+        if self.log and self.log[-1]["end_seq"] is None:
+            self.log[-1].update(end_ns=time.time_ns(), end_seq=seq)
+
+    def finish(self, seq):
+        # End of the publication (profile over or stopped), seq: sequence number of the next value
+        self.close_phase(seq)
+        self.scheduler.set_arrivals(None)
+
+    def save(self, path):
+        with open(path, "w") as file:
+            json.dump(self.log, file, indent=1)
+        return path
+
+    @staticmethod
+    def load(path):
+        # The phases saved by save(), one dict per phase run (see COLUMNS)
+        with open(path) as file:
+            return json.load(file)
+
+    @staticmethod
+    def get_file_path(results_path):
+        # Saved next to the results file of the sensor (a .json file: not taken for a results file by the report mode)
+        # results/<broker>-sensor-<date>.csv -> results/<broker>-sensor-<date>-profile.json
+        return results_path[:-len(".csv")] + "-profile.json"
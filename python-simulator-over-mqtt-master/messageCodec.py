@@ -0,0 +1,188 @@
+import json
+import numbers
+import struct
+import sys
+from array import array
+from constants import MqttAppConstants
+
+# Codecs turn the message dictionaries used everywhere in the application ({"timestamp": ..., "value": ...},
+# {"timestamp": ..., "cmd": ...}, batches...) into MQTT payloads and back.
+# - JsonCodec: the historical format, readable and understood by the backend and the ESP32 (DEFAULT)
+# - BinaryCodec: packed format (struct/array), smaller and faster at high message rates
+#
+# Negotiation: a binary payload always starts with BinaryCodec.MAGIC (0xB1, which can never start a JSON/UTF-8 text),
+# a JSON payload starts with "{". The receiver looks at the first byte (MessageCodec.decode), so each side only chooses
+# the codec it SENDS with and understands both.
+#
+# Every number of the binary format is little-endian, the values of a batch included (see BinaryCodec.batch_bytes).
+
+class JsonCodec:
+    NAME = MqttAppConstants.CODEC_JSON
+
+    @staticmethod
+    def encode(message):
+        return json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+    @staticmethod
+    def decode(payload):
+        return json.loads(payload)
+
+
+class BinaryCodec:
+    NAME = MqttAppConstants.CODEC_BINARY
+    MAGIC = 0xB1
+
+    # Message kind (second byte)
+    KIND_VALUE = 1
+    KIND_BATCH = 2
+    KIND_CMD = 3
+    KIND_ANS = 4
+
+    # Value type (third byte): array typecodes, plus "s" for UTF-8 strings (commands and answers)
+    TYPE_INT32 = ord("i")
+    TYPE_INT64 = ord("q")
+    TYPE_FLOAT64 = ord("d")
+    TYPE_STRING = ord("s")
+
+    # Flags (fourth byte)
+    FLAG_EXTRA_FIELDS = 0x01 # the payload ends with a JSON object holding the fields that have no binary slot
+    FLAG_SEQ = 0x02          # the header is followed by the sequence number (int64)
+    FLAG_ID = 0x04           # then by the request id (int64) of a command or of its answer
+
+    # magic, kind, value type, flags, timestamp (microseconds)
+    HEADER = struct.Struct("<BBBBq")
+    # batch: period (microseconds), number of values
+    BATCH_HEADER = struct.Struct("<II")
+    SEQ = struct.Struct("<q")
+    ID = struct.Struct("<q")
+    STRING_LENGTH = struct.Struct("<H")
+    SCALARS = {TYPE_INT32: struct.Struct("<i"), TYPE_INT64: struct.Struct("<q"), TYPE_FLOAT64: struct.Struct("<d")}
+
+    KIND_TO_FIELD = {
+        KIND_VALUE: MqttAppConstants.MSG_VALUE,
+        KIND_BATCH: MqttAppConstants.MSG_VALUES,
+        KIND_CMD: MqttAppConstants.MSG_CMD,
+        KIND_ANS: MqttAppConstants.MSG_ANS,
+    }
+    # Fields encoded in the binary layout, every other field goes into the JSON extra fields
+    NATIVE_FIELDS = {MqttAppConstants.MSG_TIMESTAMP, MqttAppConstants.MSG_PERIOD, MqttAppConstants.MSG_SEQ, MqttAppConstants.MSG_ID,
+                     *KIND_TO_FIELD.values()}
+
+    @staticmethod
+    def value_type(values):
+        # numbers.Integral/Real: numpy scalars (np.int64...) are integers and floats too
+        if all(isinstance(value, numbers.Integral) for value in values):
+            if all(-2**31 <= value < 2**31 for value in values):
+                return BinaryCodec.TYPE_INT32
+            return BinaryCodec.TYPE_INT64
+        if all(isinstance(value, numbers.Real) for value in values):
+            return BinaryCodec.TYPE_FLOAT64
+        raise ValueError("Only numbers can be sent with the binary codec, not {!r}".format(
+            next(value for value in values if not isinstance(value, numbers.Real))))
+
+    @staticmethod
+    def batch_bytes(value_type, values):
+        # array writes the numbers in the byte order of the machine: swapped on a big-endian one
+        packed = array(chr(value_type), values)
+        if sys.byteorder == "big":
+            packed.byteswap()
+        return packed.tobytes()
+
+    @staticmethod
+    def batch_values(value_type, payload, offset, count):
+        # The values of a batch and the offset of what follows them
+        values = array(chr(value_type))
+        end = offset + count * values.itemsize
+        values.frombytes(payload[offset:end])
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values.tolist(), end
+
+    @staticmethod
+    def encode(message):
+        timestamp = message[MqttAppConstants.MSG_TIMESTAMP]
+        extra = {key: value for key, value in message.items() if key not in BinaryCodec.NATIVE_FIELDS}
+        flags = BinaryCodec.FLAG_EXTRA_FIELDS if extra else 0
+        seq = message.get(MqttAppConstants.MSG_SEQ)
+        if seq is not None:
+            flags |= BinaryCodec.FLAG_SEQ
+            body_prefix = BinaryCodec.SEQ.pack(seq)
+        else:
+            body_prefix = b""
+        request_id = message.get(MqttAppConstants.MSG_ID)
+        if request_id is not None:
+            flags |= BinaryCodec.FLAG_ID
+            body_prefix += BinaryCodec.ID.pack(request_id) # after the seq, if any
+
+        if MqttAppConstants.MSG_VALUES in message:
+            values = message[MqttAppConstants.MSG_VALUES]
+            value_type = BinaryCodec.value_type(values)
+            body = BinaryCodec.BATCH_HEADER.pack(message[MqttAppConstants.MSG_PERIOD], len(values)) + BinaryCodec.batch_bytes(value_type, values)
+            kind = BinaryCodec.KIND_BATCH
+        elif MqttAppConstants.MSG_VALUE in message:
+            value = message[MqttAppConstants.MSG_VALUE]
+            value_type = BinaryCodec.value_type((value,))
+            body = BinaryCodec.SCALARS[value_type].pack(value)
+            kind = BinaryCodec.KIND_VALUE
+        else:
+            kind = BinaryCodec.KIND_CMD if MqttAppConstants.MSG_CMD in message else BinaryCodec.KIND_ANS
+            text = message[BinaryCodec.KIND_TO_FIELD[kind]].encode("utf-8")
+            value_type = BinaryCodec.TYPE_STRING
+            body = BinaryCodec.STRING_LENGTH.pack(len(text)) + text
+
+        payload = BinaryCodec.HEADER.pack(BinaryCodec.MAGIC, kind, value_type, flags, timestamp) + body_prefix + body
+        if extra:
+            payload += JsonCodec.encode(extra)
+        return payload
+
+    @staticmethod
+    def decode(payload):
+        _, kind, value_type, flags, timestamp = BinaryCodec.HEADER.unpack_from(payload)
+        offset = BinaryCodec.HEADER.size
+        message = {MqttAppConstants.MSG_TIMESTAMP: timestamp}
+        if flags & BinaryCodec.FLAG_SEQ:
+            message[MqttAppConstants.MSG_SEQ] = BinaryCodec.SEQ.unpack_from(payload, offset)[0]
+            offset += BinaryCodec.SEQ.size
+        if flags & BinaryCodec.FLAG_ID:
+            message[MqttAppConstants.MSG_ID] = BinaryCodec.ID.unpack_from(payload, offset)[0]
+            offset += BinaryCodec.ID.size
+
+        if kind == BinaryCodec.KIND_BATCH:
+            period, count = BinaryCodec.BATCH_HEADER.unpack_from(payload, offset)
+            offset += BinaryCodec.BATCH_HEADER.size
+            values, end = BinaryCodec.batch_values(value_type, payload, offset, count)
+            message[MqttAppConstants.MSG_PERIOD] = period
+            message[MqttAppConstants.MSG_VALUES] = values
+        elif kind == BinaryCodec.KIND_VALUE:
+            scalar = BinaryCodec.SCALARS[value_type]
+            message[MqttAppConstants.MSG_VALUE] = scalar.unpack_from(payload, offset)[0]
+            end = offset + scalar.size
+        elif kind in (BinaryCodec.KIND_CMD, BinaryCodec.KIND_ANS):
+            (length,) = BinaryCodec.STRING_LENGTH.unpack_from(payload, offset)
+            offset += BinaryCodec.STRING_LENGTH.size
+            end = offset + length
+            message[BinaryCodec.KIND_TO_FIELD[kind]] = bytes(payload[offset:end]).decode("utf-8")
+        else:
+            raise ValueError("Unknown binary message kind: {}".format(kind))
+
+        if flags & BinaryCodec.FLAG_EXTRA_FIELDS:
+            message.update(JsonCodec.decode(payload[end:]))
+        return message
+
+
+class MessageCodec:
+    CODECS = {JsonCodec.NAME: JsonCodec, BinaryCodec.NAME: BinaryCodec}
+
+    @staticmethod
+    def get_codec(codec_name):
+        try:
+            return MessageCodec.CODECS[codec_name]
+        except KeyError:
+            raise ValueError("Invalid codec name, use one of {}".format(MqttAppConstants.get_codecs()))
+
+    @staticmethod
+    def decode(payload):
+        # Whatever the codec used by the sender (see the negotiation above)
+        if payload and payload[0] == BinaryCodec.MAGIC:
+            return BinaryCodec.decode(payload)
+        return JsonCodec.decode(payload)
@@ -0,0 +1,152 @@
+import http.server
+import threading
+import time
+from latencyHistogram import LatencyHistogram
+from latencyReport import LatencyReport
+
+# Live metrics of a simulator process (sensor, server, ward, fleet): counters, gauges and latency histograms, exposed
+# - over HTTP in the Prometheus text format (--metrics-port, http://127.0.0.1:<port>/metrics),
+# - as one summary line in the terminal every --metrics-interval seconds (with the rate of each counter).
+# Cheap enough to stay on during load tests: most metrics are READ when scraped from counters the modes already keep
+# (function=...), the hot paths only increment plain integers and record the transit latency in a LatencyHistogram
+# (under a lock of the mode: several receive workers record in the same histogram, see Mode.record_transit).
+# The values are read without lock by the HTTP and summary threads: a scrape may be one message behind, never wrong.
+class Metric:
+
+    def __init__(self, name, help_text, kind, function=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind # "counter" or "gauge"
+        self.function = function # returns the current value, when the value is kept elsewhere
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        if self.function is not None:
+            value = self.function()
+            return 0 if value is None else value
+        return self.value
+
+
+class MetricsRegistry:
+
+    PREFIX = "mqtt_simulator_"
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, labels=None):
+        # labels: added to every exposed metric, e.g. {"mode": "server", "broker": "local"}
+        self.labels = ",".join('{}="{}"'.format(key, value) for key, value in sorted((labels or {}).items()))
+        self.metrics = [] # Metric, in registration order (the order of the summary line)
+        self.histograms = [] # (name, help, LatencyHistogram)
+        self.stopped = threading.Event()
+        self.server = None
+        self.summary_thread = None
+        self.previous = {} # counter name -> (value, monotonic time) of the previous summary line
+
+    # ---------------------------------------------------- REGISTRATION ----------------------------------------------------
+
+    def counter(self, name, help_text, function=None):
+        metric = Metric(name, help_text, "counter", function)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, function=None):
+        metric = Metric(name, help_text, "gauge", function)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text):
+        # Returns the LatencyHistogram itself: the hot path calls histogram.record(ns) directly
+        histogram = LatencyHistogram()
+        self.histograms.append((name, help_text, histogram))
+        return histogram
+
+    # ---------------------------------------------------- PROMETHEUS ----------------------------------------------------
+
+    def format_labels(self, extra=""):
+        labels = ",".join(label for label in (self.labels, extra) if label)
+        return "{" + labels + "}" if labels else ""
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            name = MetricsRegistry.PREFIX + metric.name
+            lines.append("# HELP {} {}".format(name, metric.help_text))
+            lines.append("# TYPE {} {}".format(name, metric.kind))
+            lines.append("{}{} {}".format(name, self.format_labels(), metric.get()))
+        # Latencies as summaries, in seconds: quantiles, sum and count
+        for name, help_text, histogram in self.histograms:
+            name = MetricsRegistry.PREFIX + name
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} summary".format(name))
+            for quantile in MetricsRegistry.QUANTILES:
+                value_ns = histogram.value_at_percentile(quantile * 100) if histogram.total else float("nan")
+                lines.append("{}{} {}".format(name, self.format_labels('quantile="{:g}"'.format(quantile)), value_ns / 1e9))
+            lines.append("{}_sum{} {}".format(name, self.format_labels(), histogram.sum_ns / 1e9))
+            lines.append("{}_count{} {}".format(name, self.format_labels(), histogram.total))
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port, host="127.0.0.1"):
+        registry = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *arguments):
+                pass # one line per scrape would flood the terminal
+
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        print("Metrics available on http://{}:{}/metrics".format(host, self.server.server_port))
+
+    # ---------------------------------------------------- TERMINAL ----------------------------------------------------
+
+    def summary_line(self):
+        now = time.monotonic()
+        parts = []
+        for metric in self.metrics:
+            value = metric.get()
+            if metric.kind == "counter":
+                previous_value, previous_time = self.previous.get(metric.name, (0, None))
+                self.previous[metric.name] = (value, now)
+                name = metric.name[:-len("_total")] if metric.name.endswith("_total") else metric.name
+                if previous_time is None:
+                    parts.append("{} {}".format(name, value))
+                else:
+                    parts.append("{} {} ({:.1f}/s)".format(name, value, (value - previous_value) / (now - previous_time)))
+            else:
+                parts.append("{} {:g}".format(metric.name, value))
+        for name, _, histogram in self.histograms:
+            if histogram.total:
+                parts.append("{} p50 {:.3f} ms p99 {:.3f} ms".format(name, LatencyReport.to_ms(histogram.value_at_percentile(50)),
+                                                                     LatencyReport.to_ms(histogram.value_at_percentile(99))))
+        return "[metrics] " + " | ".join(parts)
+
+    def start_summary(self, interval_s):
+        def print_summaries():
+            while not self.stopped.wait(interval_s):
+                print(self.summary_line())
+        self.summary_thread = threading.Thread(target=print_summaries, name="metrics-summary", daemon=True)
+        self.summary_thread.start()
+
+    def close(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,223 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import threading
+import time
+import pandas as pd
+from brokerInformator import BrokerInformator
+from constants import MqttAppConstants
+from consoleEcho import ConsoleEcho
+from mqttConnector import MqttConnector
+from resultReporter import ResultReporter
+from mode.sensorMode import SensorMode
+from mode.serverMode import ServerMode
+
+# Bench mode runs a benchmark MATRIX without anybody typing: brokers x rates x payload sizes x QoS x sensor counts.
+# For each cell, pairs of SensorMode/ServerMode are created in this process (one pair per sensor, each on its own topic
+# and connections), the servers send start, the values of the warm-up are ignored, the values sent during the
+# measurement are matched on their sequence numbers (see ResultReporter), then the servers send stop. Every cell gives
+# one row of a consolidated table: results/bench-<date>.csv
+#
+# ./mqttCliApp.py bench local,mosquitto --rates 100,1000 --payload-sizes 0,1024 --qos 0,1 --sensors 1,10
+
+class BenchConfig:
+    # Default values, can be overridden by a JSON config file (same keys) and then by command line flags
+    DEFAULTS = {
+        "rates": [100],               # values per second, per sensor
+        "payload_sizes": [0],         # bytes of a value message (padded), 0 = no padding
+        "qos": [0],                   # QoS of the publications and subscriptions
+        "sensors": [1],               # number of sensor/server pairs
+        "warmup": 2.0,                # seconds of publication before the measurement
+        "duration": 10.0,             # seconds of measurement
+        "drain": 2.0,                 # seconds waited after stop, for the values still in flight
+        "connect_timeout": 10.0,      # seconds to connect all the clients of a cell
+        "batch": "",                  # values per message: "25" (25 values) or "40ms" (40 ms of values), "" = one value
+        "codec": MqttAppConstants.CODEC_JSON, # codec used to send messages (see messageCodec.py)
+        "topic_prefix": "bench",      # topics: <topic_prefix>/<run>/<cell>/<pair>
+    }
+
+    def __init__(self, **options):
+        for key, default in BenchConfig.DEFAULTS.items():
+            setattr(self, key, options.get(key, default))
+
+    @staticmethod
+    def parse_list(text):
+        # "100,1000" -> [100, 1000]
+        return [float(item) if "." in item else int(item) for item in text.split(",") if item]
+
+    @staticmethod
+    def from_arguments(arguments):
+        parser = argparse.ArgumentParser(prog="mqttCliApp.py bench [broker,broker...]")
+        parser.add_argument("--config", help="JSON file containing the bench configuration")
+        parser.add_argument("--rates", type=BenchConfig.parse_list)
+        parser.add_argument("--payload-sizes", dest="payload_sizes", type=BenchConfig.parse_list)
+        parser.add_argument("--qos", type=BenchConfig.parse_list)
+        parser.add_argument("--sensors", type=BenchConfig.parse_list)
+        parser.add_argument("--warmup", type=float)
+        parser.add_argument("--duration", type=float)
+        parser.add_argument("--drain", type=float)
+        parser.add_argument("--connect-timeout", dest="connect_timeout", type=float)
+        parser.add_argument("--batch")
+        parser.add_argument("--codec", choices=MqttAppConstants.get_codecs())
+        parser.add_argument("--topic-prefix", dest="topic_prefix")
+        parsed = vars(parser.parse_args(arguments))
+
+        options = {}
+        config_file = parsed.pop("config")
+        if config_file:
+            with open(config_file) as file:
+                options.update(json.load(file))
+        # Flags always win over the config file
+        options.update({key: value for key, value in parsed.items() if value is not None})
+
+        unknown_keys = set(options) - set(BenchConfig.DEFAULTS)
+        if unknown_keys:
+            raise ValueError("Unknown bench option(s): {}".format(sorted(unknown_keys)))
+        config = BenchConfig(**options)
+        if any(rate <= 0 for rate in config.rates) or any(count <= 0 for count in config.sensors):
+            raise ValueError("rates and sensors must be positive")
+        if any(qos not in (0, 1, 2) for qos in config.qos):
+            raise ValueError("qos must be 0, 1 or 2")
+        if config.duration <= 0:
+            raise ValueError("duration must be positive")
+        return config
+
+
+class BenchPair:
+    # One sensor and its server, each with its own connection, driven without prompts
+
+    def __init__(self, config, broker_info, topic, rate, payload_size, qos):
+        mode_options = {"topic": topic, "codec_name": config.codec, "echo": ConsoleEcho.NONE, "qos": qos}
+        self.sensor_service = MqttConnector(broker_info)
+        self.server_service = MqttConnector(broker_info)
+        self.sensor = SensorMode(self.sensor_service, rate=rate, ordered=True, batch=config.batch, **mode_options)
+        if payload_size:
+            self.sensor.set_payload_size(payload_size)
+        # Same process, same clock: no clock synchronization. The cells are measured from the records, not from live statistics
+        self.server = ServerMode(self.server_service, sync_interval=0, topic_stats=False, **mode_options)
+        self.publishing_thread = None
+
+    def connect(self):
+        for service in (self.sensor_service, self.server_service):
+            service.connect_broker()
+        self.sensor.listen()
+        self.server.listen()
+
+    def is_connected(self):
+        return self.sensor_service.client.is_connected() and self.server_service.client.is_connected()
+
+    def start(self, timeout=1.0, attempts=5):
+        # In the same process, we can check that the sensor received START (and send it again if it was lost)
+        self.publishing_thread = threading.Thread(target=self.sensor.publish_until_stopped, daemon=True)
+        self.publishing_thread.start()
+        for _ in range(attempts):
+            self.server.send_command(MqttAppConstants.COMMAND_START)
+            if self.sensor.wait_until_publishing(timeout):
+                return
+        raise TimeoutError("The sensor on {} never received start".format(self.sensor.topic_for_hearing_from_server))
+
+    def stop(self, timeout=1.0):
+        self.server.send_command(MqttAppConstants.COMMAND_STOP)
+        deadline = time.monotonic() + timeout
+        while self.sensor.allow_to_publish and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # STOP lost: the sensor is stopped directly so that it does not publish for ever
+        self.sensor.allow_to_publish = False
+        self.publishing_thread.join(timeout)
+
+    def close(self):
+        for service in (self.sensor_service, self.server_service):
+            service.disconnect_broker()
+        # The values still in the receive queue of the server are part of the measurement
+        self.server.drain_received()
+
+    def measured_values(self, start_ns, end_ns):
+        # Values sent during the measurement, and their receptions
+        sent = ResultReporter.records_to_frame(self.sensor.get_all_times_values_interactions())
+        sent = sent[(sent["timestamp_ns"] >= start_ns) & (sent["timestamp_ns"] < end_ns)]
+        received = ResultReporter.records_to_frame(self.server.get_all_times_values_interactions())
+        if len(sent):
+            received = received[received["seq"].between(sent["seq"].min(), sent["seq"].max())]
+        else:
+            received = received.iloc[0:0]
+        return sent, received
+
+
+class BenchMode:
+
+    def __init__(self, broker_names, arguments):
+        for broker_name in broker_names:
+            BrokerInformator.get_broker(broker_name) # fails now rather than in the middle of the matrix
+        self.broker_names = broker_names
+        self.config = BenchConfig.from_arguments(arguments)
+        self.run_id = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    def get_cells(self):
+        return list(itertools.product(self.broker_names, self.config.rates, self.config.payload_sizes, self.config.qos,
+                                      self.config.sensors))
+
+    def run(self):
+        cells = self.get_cells()
+        rows = []
+        for index, (broker_name, rate, payload_size, qos, sensors) in enumerate(cells):
+            cell = {"broker": broker_name, "rate": rate, "payload_bytes": payload_size, "qos": qos, "sensors": sensors}
+            print("[{}/{}] {}".format(index + 1, len(cells), ", ".join("{} {}".format(k, v) for k, v in cell.items())))
+            try:
+                cell.update(self.run_cell(index, broker_name, rate, payload_size, qos, sensors))
+            except OSError as error:
+                # Broker unreachable, timeout...: the cell is reported as failed and the matrix goes on
+                print("Cell failed: {}".format(error))
+                cell["error"] = str(error)
+            rows.append(cell)
+        self.save_table(rows)
+
+    def run_cell(self, index, broker_name, rate, payload_size, qos, sensors):
+        broker_info = BrokerInformator.get_broker(broker_name)
+        pairs = [BenchPair(self.config, broker_info, "{}/{}/{}/{}".format(self.config.topic_prefix, self.run_id, index, i),
+                           rate, payload_size, qos) for i in range(sensors)]
+        try:
+            for pair in pairs:
+                pair.connect()
+            deadline = time.monotonic() + self.config.connect_timeout
+            while not all(pair.is_connected() for pair in pairs):
+                if time.monotonic() > deadline:
+                    raise TimeoutError("Could not connect all the clients in {} s".format(self.config.connect_timeout))
+                time.sleep(0.05)
+
+            for pair in pairs:
+                pair.start()
+            time.sleep(self.config.warmup)
+            start_ns = time.time_ns()
+            time.sleep(self.config.duration)
+            end_ns = time.time_ns()
+            for pair in pairs:
+                pair.stop()
+            time.sleep(self.config.drain)
+        finally:
+            for pair in pairs:
+                pair.close()
+
+        # The pairs are concurrent: their latency reports merge into the cell one (see LatencyReport.merge)
+        latency = None
+        for pair in pairs:
+            report, stats = ResultReporter.match_by_sequence(*pair.measured_values(start_ns, end_ns))
+            pair_latency = ResultReporter.build_latency_report(broker_name, report, stats)
+            latency = pair_latency if latency is None else latency.merge(pair_latency)
+        summary = latency.get_summary()
+        summary["send_rate_per_s"] = summary["sent"] / ((end_ns - start_ns) / 1e9)
+        latency.print_summary()
+        return summary
+
+    def save_table(self, rows):
+        table = pd.DataFrame(rows)
+        os.makedirs(ResultReporter.results_folder, exist_ok=True)
+        path = os.path.join(ResultReporter.results_folder, "bench-{}.csv".format(self.run_id))
+        table.to_csv(path, index=False, float_format="%.6f")
+        columns = [column for column in ("broker", "rate", "payload_bytes", "qos", "sensors", "sent", "lost",
+                                         "send_rate_per_s", "throughput_per_s", "p50_ms", "p99_ms", "p99.9_ms", "max_ms",
+                                         "jitter_ms", "error") if column in table.columns]
+        print(table[columns].to_string(index=False, float_format=lambda value: "{:.3f}".format(value)))
+        print("Bench results saved in {}".format(path))
+        return path
@@ -0,0 +1,642 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from constants import MqttAppConstants
+from mqttConnector import MqttConnector
+from metrics import MetricsRegistry
+from latencyHistogram import LatencyHistogram
+from latencyReport import LatencyReport
+from loadProfile import LoadProfile, ProfileDriver
+from resultReporter import ResultReporter
+from resultWriter import StreamingResultWriter
+from mqttEventLoop import MqttEventLoopBridge
+from rateScheduler import RateScheduler
+from sampleBatcher import SampleBatcher
+from messageCodec import MessageCodec
+from signalGenerator import SignalGenerator
+
+try:
+    import resource # Unix only
+except ImportError:
+    resource = None
+
+# Fleet mode simulates MANY sensors (1 000 - 10 000) from one process, for load testing the broker and the backend.
+# Each virtual sensor behaves like SensorMode (same topics, same commands, same answers) but all of them share a single
+# asyncio event loop: no loop_start() thread per client and no input() prompt per sensor.
+# One process tops out at a few tens of thousands of small messages per second (the GIL): with "processes", the fleet is
+# sharded over worker processes (one per CPU core with 0), driven by a FleetCoordinator (see below).
+
+class FleetConfig:
+    # Default values, can be overridden by a JSON config file (same keys) and then by command line flags
+    DEFAULTS = {
+        "sensors": 100,               # number of virtual sensors
+        "rate": 1,                    # values per second, per sensor
+        "topic_prefix": "fleet",      # sensor i uses the topic "<topic_prefix><i>" (so "<topic_prefix><i>/sensor" ...)
+        "first_index": 0,             # index of the first sensor (useful to split a fleet across several processes)
+        "ordered": False,             # ordered values (1, 2, 3...) instead of random ones
+        "signal": "",                 # or any signal of signalGenerator.py ("ecg", "sine:frequency=2"...), one generator per sensor
+        "batch": "",                  # values per message: "25" (25 values) or "40ms" (40 ms of values), "" = one value
+        "codec": MqttAppConstants.CODEC_JSON, # codec used to send messages (see messageCodec.py)
+        "profile": "",                # load profile replacing the constant rate, e.g. "step:from=1,to=10,step=1,hold=30" (see loadProfile.py)
+        "autostart": False,           # start publishing as soon as connected, without waiting for a "start" command
+        "connect_concurrency": 64,    # number of connections opened at the same time
+        "summary_interval": 5,        # seconds between two summary lines in the terminal
+        "metrics_port": 0,            # serve live metrics (Prometheus text format) on this local port, 0 = no (see metrics.py)
+        "processes": 1,               # worker processes sharing the sensors, 0 = one per CPU core (see FleetCoordinator)
+        "duration": 0,                # seconds before the fleet stops by itself (and prints its report), 0 = until Ctrl+C
+        "groups": [],                 # sub-populations replacing "sensors", each one overriding the GROUP_KEYS options, e.g.
+                                      # [{"sensors": 200, "rate": 250, "signal": "ecg", "topic_prefix": "ecg"}, {"sensors": 5000}]
+    }
+    GROUP_KEYS = ("sensors", "rate", "topic_prefix", "first_index", "ordered", "signal", "batch", "codec", "profile", "autostart")
+
+    def __init__(self, **options):
+        for key, default in FleetConfig.DEFAULTS.items():
+            setattr(self, key, options.get(key, default))
+
+    @staticmethod
+    def from_arguments(arguments):
+        parser = argparse.ArgumentParser(prog="mqttCliApp.py fleet [broker]")
+        parser.add_argument("--config", help="JSON file containing the fleet configuration")
+        parser.add_argument("--sensors", type=int)
+        parser.add_argument("--rate", type=float)
+        parser.add_argument("--topic-prefix", dest="topic_prefix")
+        parser.add_argument("--first-index", dest="first_index", type=int)
+        parser.add_argument("--ordered", action="store_const", const=True)
+        parser.add_argument("--signal")
+        parser.add_argument("--batch")
+        parser.add_argument("--codec", choices=MqttAppConstants.get_codecs())
+        parser.add_argument("--profile")
+        parser.add_argument("--autostart", action="store_const", const=True)
+        parser.add_argument("--connect-concurrency", dest="connect_concurrency", type=int)
+        parser.add_argument("--summary-interval", dest="summary_interval", type=float)
+        parser.add_argument("--metrics-port", dest="metrics_port", type=int)
+        parser.add_argument("--processes", type=int)
+        parser.add_argument("--duration", type=float)
+        parsed = vars(parser.parse_args(arguments))
+
+        options = {}
+        config_file = parsed.pop("config")
+        if config_file:
+            with open(config_file) as file:
+                options.update(json.load(file))
+        # Flags always win over the config file
+        options.update({key: value for key, value in parsed.items() if value is not None})
+
+        unknown_keys = set(options) - set(FleetConfig.DEFAULTS)
+        if unknown_keys:
+            raise ValueError("Unknown fleet option(s): {}".format(sorted(unknown_keys)))
+        config = FleetConfig(**options)
+        for group in config.groups:
+            unknown_keys = set(group) - set(FleetConfig.GROUP_KEYS)
+            if unknown_keys:
+                raise ValueError("Unknown fleet group option(s): {}, use {}".format(sorted(unknown_keys), FleetConfig.GROUP_KEYS))
+        if any(group.sensors <= 0 or group.rate <= 0 for group in config.get_groups()):
+            raise ValueError("sensors and rate must be positive")
+        for group in config.get_groups():
+            if group.profile:
+                LoadProfile.from_spec(group.profile) # checks the spec before connecting anything
+        if config.processes < 0:
+            raise ValueError("processes must be positive, or 0 for one per CPU core")
+        return config
+
+    def get_options(self):
+        return {key: getattr(self, key) for key in FleetConfig.DEFAULTS}
+
+    def get_groups(self):
+        # One FleetConfig per sub-population (the config itself without groups)
+        if not self.groups:
+            return [self]
+        options = self.get_options()
+        options["groups"] = []
+        return [FleetConfig(**dict(options, **group)) for group in self.groups]
+
+    def get_sensor_count(self):
+        return sum(group.sensors for group in self.get_groups())
+
+    def get_processes(self):
+        return self.processes or os.cpu_count() or 1
+
+    def split(self, parts):
+        # The groups of each of the `parts` workers: every group is cut in contiguous slices of sensors (first_index and
+        # sensors of the slice), so that the topics and client ids stay the ones of a single process fleet
+        shards = [[] for _ in range(parts)]
+        for group in self.get_groups():
+            base, extra = divmod(group.sensors, parts)
+            first_index = group.first_index
+            for part in range(parts):
+                sensors = base + (1 if part < extra else 0)
+                if sensors:
+                    shards[part].append(dict({key: getattr(group, key) for key in FleetConfig.GROUP_KEYS},
+                                             first_index=first_index, sensors=sensors))
+                first_index += sensors
+        return [shard for shard in shards if shard]
+
+
+class VirtualSensor:
+    # One simulated sensor of the fleet, it speaks the same protocol as SensorMode
+
+    def __init__(self, fleet, index, broker_info, config=None):
+        # config: FleetConfig of the group of this sensor (rate, signal...), the fleet one by default
+        self.fleet = fleet
+        self.config = config or fleet.config
+        topic = "{}{}".format(self.config.topic_prefix, index)
+        self.topic_for_hearing_from_sensor = MqttAppConstants.get_full_topic_name(topic, MqttAppConstants.HEARING_FROM_SENSOR)
+        self.topic_for_hearing_from_server = MqttAppConstants.get_full_topic_name(topic, MqttAppConstants.HEARING_FROM_SERVER)
+        self.broadcast_topics = MqttAppConstants.get_broadcast_topics(topic)
+
+        client_id = "python-fleet-{}-{}".format(self.config.topic_prefix, index)
+        self.mqtt_service = MqttConnector(broker_info, client_id=client_id)
+        self.client = self.mqtt_service.client
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+
+        self.connected = False
+        self.connections = 0 # successful connections, the first one included
+        self.allow_to_publish = False
+        self.next_seq = 0
+        self.values_sent = 0
+        # Load profile of the group (parsed once per fleet): it sets the rate, starting with the one of its first phase
+        profile = fleet.get_profile(self.config.profile) if self.config.profile else None
+        rate = profile.phases[0].from_rate if profile is not None else self.config.rate
+        self.scheduler = RateScheduler(rate)
+        self.batcher = SampleBatcher.from_spec(rate, str(self.config.batch))
+        self.codec = MessageCodec.get_codec(self.config.codec)
+        signal_spec = self.config.signal or (MqttAppConstants.SIGNAL_ORDERED if self.config.ordered else MqttAppConstants.SIGNAL_RANDOM)
+        self.signal = SignalGenerator.from_spec(rate, signal_spec)
+        # A driver per sensor since each one starts at its own time
+        self.profile_driver = ProfileDriver(profile, self.scheduler, announce=False) if profile is not None else None
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            print("[{}] failed to connect, return code {}".format(self.mqtt_service.client_id, rc))
+            return
+        self.connected = True
+        self.connections += 1
+        self.mqtt_service.reconnect_attempt = 0
+        # (Re)subscribe here so that a reconnection keeps listening to the server
+        self.client.subscribe([(self.topic_for_hearing_from_server, 0)] + [(topic, 0) for topic in self.broadcast_topics])
+        if self.config.autostart and self.fleet.shard is None and not self.allow_to_publish:
+            self.start_publishing()
+
+    def on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        # rc != 0: connection lost. The event loop does not reconnect by itself (no loop_start() thread), the bridge does
+        # it after the backoff of MqttConnector, so that a fleet cut at once does not come back at once.
+        if rc != 0 and not self.mqtt_service.stopping.is_set():
+            print("[{}] connection lost (rc {}), reconnecting".format(self.mqtt_service.client_id, rc))
+            self.schedule_reconnect()
+
+    def schedule_reconnect(self, error=None):
+        # Also called back when an attempt fails (error), with the next delay of the backoff
+        if not self.mqtt_service.stopping.is_set():
+            self.fleet.bridge.schedule_reconnect(self.client, self.mqtt_service.backoff_delay(), self.schedule_reconnect)
+
+    def on_message(self, client, userdata, message):
+        received_ns = time.time_ns() # t2 of the clock synchronization (see clockSync.py)
+        try:
+            received_json = MessageCodec.decode(message.payload)
+            received_value = received_json[MqttAppConstants.MSG_CMD]
+        except (ValueError, KeyError, struct.error):
+            return
+        request_id = received_json.get(MqttAppConstants.MSG_ID) # copied in the answer (ping mode)
+
+        if received_value == MqttAppConstants.COMMAND_PING:
+            if self.allow_to_publish:
+                self.publish(MqttAppConstants.MSG_ANS, MqttAppConstants.PING_RESPONSE_WHEN_ALREADY_PUBLISHING, request_id)
+            else:
+                self.publish(MqttAppConstants.MSG_ANS, MqttAppConstants.PING_RESPONSE, request_id)
+        elif received_value == MqttAppConstants.COMMAND_START:
+            self.publish(MqttAppConstants.MSG_ANS, MqttAppConstants.START_RESPONSE, request_id)
+            self.start_publishing()
+        elif received_value == MqttAppConstants.COMMAND_STOP:
+            self.allow_to_publish = False
+            self.flush_batch()
+            self.publish(MqttAppConstants.MSG_ANS, MqttAppConstants.STOP_RESPONSE, request_id)
+        elif received_value == MqttAppConstants.COMMAND_SYNC:
+            message = {MqttAppConstants.MSG_ANS: MqttAppConstants.SYNC_RESPONSE, MqttAppConstants.MSG_ID: request_id,
+                       MqttAppConstants.MSG_RECEIVED: received_ns // 1000, MqttAppConstants.MSG_TIMESTAMP: time.time_ns() // 1000}
+            self.client.publish(self.topic_for_hearing_from_sensor, self.codec.encode(message))
+
+    def publish(self, mode, cmdOrValueOrAns, request_id=None):
+        message = {MqttAppConstants.MSG_TIMESTAMP: time.time_ns() // 1000,
+                   mode: cmdOrValueOrAns}
+        if request_id is not None:
+            message[MqttAppConstants.MSG_ID] = request_id
+        if mode == MqttAppConstants.MSG_VALUE:
+            message[MqttAppConstants.MSG_SEQ] = self.next_seq
+            self.next_seq += 1
+        self.client.publish(self.topic_for_hearing_from_sensor, self.codec.encode(message))
+
+    def publish_batch(self, batch):
+        base_timestamp, period_us, values, base_seq = batch
+        message = self.codec.encode(
+            {MqttAppConstants.MSG_TIMESTAMP: base_timestamp,
+             MqttAppConstants.MSG_SEQ: base_seq,
+             MqttAppConstants.MSG_PERIOD: period_us,
+             MqttAppConstants.MSG_VALUES: values}
+        )
+        self.client.publish(self.topic_for_hearing_from_sensor, message)
+
+    def flush_batch(self):
+        if self.batcher:
+            batch = self.batcher.flush()
+            if batch:
+                self.publish_batch(batch)
+
+    def start_publishing(self):
+        if not self.allow_to_publish:
+            # Spread the sensors over one period so that they do not all publish at the same instant
+            self.scheduler.start(offset=random.random() / self.scheduler.rate)
+            if self.profile_driver is not None:
+                self.profile_driver.start(self.next_seq)
+            self.allow_to_publish = True
+
+    def produce_value(self):
+        # Computed by blocks ahead of the publication (see signalGenerator.py)
+        return self.signal.next_value()
+
+    async def publish_values(self):
+        while True:
+            if not (self.allow_to_publish and self.connected):
+                await asyncio.sleep(1 / self.scheduler.rate)
+                continue
+            if self.profile_driver is not None and not self.profile_driver.update(self.next_seq):
+                self.allow_to_publish = False
+                self.flush_batch()
+                continue
+            await asyncio.sleep(self.scheduler.delay())
+            # Lateness of the wake-up on the schedule: grows when the process (event loop) cannot keep up
+            self.fleet.lag_histogram.record(max(0, time.monotonic_ns() - self.scheduler.next_deadline_ns))
+            for _ in range(self.scheduler.collect_due()):
+                if self.batcher:
+                    # The load profile may have changed the rate since the last sample
+                    batch = self.batcher.follow_rate(self.scheduler.rate)
+                    if batch:
+                        self.publish_batch(batch)
+                    batch = self.batcher.add(self.produce_value(), self.next_seq)
+                    self.next_seq += 1
+                    if batch:
+                        self.publish_batch(batch)
+                else:
+                    self.publish(MqttAppConstants.MSG_VALUE, self.produce_value())
+                self.values_sent += 1
+
+
+class FleetMode:
+
+    def __init__(self, broker_info, arguments=None, config=None, shard=None):
+        # config: FleetConfig (instead of the command line arguments), shard: ShardControl of a worker process of a
+        # FleetCoordinator, None in a single process fleet
+        self.broker_info = broker_info
+        self.config = config or FleetConfig.from_arguments(arguments)
+        self.shard = shard
+        self.sensors = []
+        self.bridge = None
+        self.metrics = None
+        self.lag_histogram = LatencyHistogram() # wake-up lateness of the publishers (see VirtualSensor.publish_values)
+        self.profiles = {} # load profile spec -> LoadProfile
+
+    def get_profile(self, spec):
+        if spec not in self.profiles:
+            self.profiles[spec] = LoadProfile.from_spec(spec)
+        return self.profiles[spec]
+
+    @staticmethod
+    def raise_file_descriptor_limit(sensors):
+        # paho uses 3 file descriptors per client (the socket and an internal socket pair)
+        if resource is None:
+            return
+        needed = 3 * sensors + 64
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < needed:
+            new_soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+            if new_soft < needed:
+                print("Warning: only {} file descriptors available, {} needed (see ulimit -n)".format(new_soft, needed))
+
+    def describe_groups(self):
+        return FleetMode.describe_config_groups(self.config)
+
+    @staticmethod
+    def describe_config_groups(config):
+        return ", ".join("{} sensors {} ({})".format(group.sensors, "with the load profile {}".format(group.profile) if group.profile
+                                                     else "at {} value(s)/s".format(group.rate), group.topic_prefix)
+                         for group in config.get_groups())
+
+    def run(self):
+        if self.shard is None and self.config.get_processes() > 1:
+            FleetCoordinator(self.broker_info, self.config).run()
+            return
+        FleetMode.raise_file_descriptor_limit(self.config.get_sensor_count())
+        if self.shard is None:
+            print("Fleet mode activated: {}.".format(self.describe_groups()))
+        if self.config.metrics_port:
+            self.metrics = MetricsRegistry({"mode": "fleet", "prefix": self.config.topic_prefix})
+            self.register_metrics(self.metrics)
+            self.metrics.start_http_server(self.config.metrics_port)
+        try:
+            asyncio.run(self.main())
+        finally:
+            if self.metrics is not None:
+                self.metrics.close()
+
+    def register_metrics(self, metrics):
+        # Summed over the sensors when scraped (see metrics.py), the sensors only keep their own plain counters
+        metrics.gauge("sensors", "virtual sensors of this process", lambda: len(self.sensors))
+        metrics.gauge("connected_sensors", "virtual sensors connected to the broker", lambda: sum(sensor.connected for sensor in self.sensors))
+        metrics.gauge("publishing_sensors", "virtual sensors publishing", lambda: sum(sensor.allow_to_publish for sensor in self.sensors))
+        metrics.counter("values_sent_total", "values published, batched values included", lambda: sum(sensor.values_sent for sensor in self.sensors))
+        metrics.counter("skipped_values_total", "deadlines dropped by the schedulers (late publication)",
+                        lambda: sum(sensor.scheduler.skipped for sensor in self.sensors))
+        metrics.counter("reconnects_total", "reconnections to the broker",
+                        lambda: sum(max(0, sensor.connections - 1) for sensor in self.sensors))
+        metrics.gauge("mqtt_out_queue", "MQTT packets waiting to be sent by paho, all the sensors",
+                      lambda: sum(sensor.mqtt_service.get_out_queue() for sensor in self.sensors))
+
+    def get_counters(self):
+        # Sent to the coordinator by the worker processes, summed over the workers (see FleetCoordinator)
+        publishing = [sensor for sensor in self.sensors if sensor.allow_to_publish]
+        return {
+            "sensors": len(self.sensors),
+            "connected": sum(1 for sensor in self.sensors if sensor.connected),
+            "publishing": len(publishing),
+            "target_rate": sum(sensor.scheduler.rate for sensor in publishing),
+            "values_sent": sum(sensor.values_sent for sensor in self.sensors),
+            "skipped": sum(sensor.scheduler.skipped for sensor in self.sensors),
+            "reconnects": sum(max(0, sensor.connections - 1) for sensor in self.sensors),
+            "out_queue": sum(sensor.mqtt_service.get_out_queue() for sensor in self.sensors),
+        }
+
+    async def main(self):
+        loop = asyncio.get_running_loop()
+        self.bridge = MqttEventLoopBridge(loop)
+        self.sensors = [VirtualSensor(self, index, self.broker_info, group)
+                        for group in self.config.get_groups() for index in range(group.first_index, group.first_index + group.sensors)]
+        for sensor in self.sensors:
+            self.bridge.attach(sensor.client)
+
+        # The workers of a sharded fleet do not print, their coordinator does
+        tasks = [] if self.shard is not None else [loop.create_task(self.print_summary())]
+        await self.connect_all(loop)
+        tasks += [loop.create_task(sensor.publish_values()) for sensor in self.sensors]
+        try:
+            if self.shard is not None:
+                await self.follow_coordinator()
+            elif self.config.duration:
+                await asyncio.wait(tasks, timeout=self.config.duration)
+                print("[fleet] {} s elapsed: {} values sent".format(self.config.duration, sum(sensor.values_sent for sensor in self.sensors)))
+            else:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.disconnect_all()
+
+    async def follow_coordinator(self):
+        # Worker process: connected, then started and stopped by the coordinator, the counters are sent every REPORT_INTERVAL_S
+        deadline = time.monotonic() + ShardControl.READY_TIMEOUT_S
+        while not all(sensor.connected for sensor in self.sensors) and time.monotonic() < deadline and not self.shard.stop.is_set():
+            await asyncio.sleep(ShardControl.POLL_INTERVAL_S)
+        self.shard.send("ready", self.get_counters())
+        while not (self.shard.start.is_set() or self.shard.stop.is_set()):
+            await asyncio.sleep(ShardControl.POLL_INTERVAL_S)
+        if not self.shard.stop.is_set():
+            for sensor in self.sensors:
+                sensor.start_publishing()
+        next_report = time.monotonic()
+        while not self.shard.stop.is_set():
+            if time.monotonic() >= next_report:
+                self.shard.send("counters", self.get_counters())
+                next_report += ShardControl.REPORT_INTERVAL_S
+            await asyncio.sleep(ShardControl.POLL_INTERVAL_S)
+        for sensor in self.sensors:
+            sensor.allow_to_publish = False
+            sensor.flush_batch()
+        self.shard.send("final", self.get_counters(), self.lag_histogram.to_dict())
+
+    async def connect_all(self, loop):
+        # client.connect() is blocking (TCP + TLS handshakes), we run them in a small thread pool so that thousands
+        # of sensors connect in seconds rather than minutes. The socket callbacks are sent back to the event loop.
+        with ThreadPoolExecutor(max_workers=self.config.connect_concurrency) as executor:
+            connections = [loop.run_in_executor(executor, sensor.mqtt_service.connect_broker) for sensor in self.sensors]
+            results = await asyncio.gather(*connections, return_exceptions=True)
+        failures = [result for result in results if isinstance(result, Exception)]
+        if failures:
+            print("{} sensor(s) could not connect, first error: {}".format(len(failures), failures[0]))
+
+    def disconnect_all(self):
+        for sensor in self.sensors:
+            if sensor.connected:
+                sensor.mqtt_service.disconnect_broker()
+                sensor.client.loop_write() # flush the DISCONNECT packet, the event loop is about to stop
+            else:
+                sensor.mqtt_service.stopping.set() # no more reconnection
+        if self.bridge:
+            self.bridge.stop()
+
+    async def print_summary(self):
+        interval = self.config.summary_interval
+        previous_total = 0
+        while True:
+            await asyncio.sleep(interval)
+            connected = sum(1 for sensor in self.sensors if sensor.connected)
+            publishing = sum(1 for sensor in self.sensors if sensor.allow_to_publish)
+            total = sum(sensor.values_sent for sensor in self.sensors)
+            skipped = sum(sensor.scheduler.skipped for sensor in self.sensors)
+            target = sum(sensor.scheduler.rate for sensor in self.sensors if sensor.allow_to_publish)
+            reconnects = sum(max(0, sensor.connections - 1) for sensor in self.sensors)
+            print("[fleet] connected {}/{} | publishing {} | values sent {} ({:.1f}/s, target {:.1f}/s) | skipped {} | reconnects {}".format(
+                connected, len(self.sensors), publishing, total, (total - previous_total) / interval, target, skipped, reconnects))
+            previous_total = total
+
+    def get_all_times_values_interactions(self):
+        # Fleet mode does not keep every value in memory (it would not scale to thousands of sensors)
+        return []
+
+
+class ShardControl:
+    # What a worker process shares with its FleetCoordinator: the start and stop events, and the queue of its messages
+    # ("ready", "counters", "final" and "error", with the index of the worker)
+
+    POLL_INTERVAL_S = 0.05
+    REPORT_INTERVAL_S = 1.0
+    READY_TIMEOUT_S = 30 # the worker reports ready once all its sensors are connected, or after this delay
+
+    def __init__(self, index, messages, start, stop):
+        self.index = index
+        self.messages = messages
+        self.start = start
+        self.stop = stop
+
+    def send(self, kind, *content):
+        self.messages.put((kind, self.index) + content)
+
+
+class FleetCoordinator:
+    # Shards a fleet over worker processes: each worker runs a FleetMode (its own event loop and GIL) on a slice of every
+    # group of sensors (see FleetConfig.split). The coordinator waits until every worker is connected, starts them all
+    # at once (autostart, otherwise the sensors wait for the commands of a server as usual), stops them all (duration
+    # or Ctrl+C), and sums their counters and merges their lag histograms into ONE report, saved in
+    # results/fleet-<topic_prefix>-<date>.json. The workers ignore Ctrl+C: the coordinator stops them cleanly.
+
+    CONNECT_TIMEOUT_S = 300
+    FINAL_TIMEOUT_S = 30
+
+    def __init__(self, broker_info, config):
+        self.broker_info = broker_info
+        self.config = config
+        self.shards = config.split(config.get_processes())
+        # spawn: same behaviour on Linux, macOS and Windows, no paho state inherited from the coordinator
+        self.context = multiprocessing.get_context("spawn")
+        self.messages = self.context.Queue()
+        self.start = self.context.Event()
+        self.stop = self.context.Event()
+        self.workers = []
+        self.counters = {} # worker index -> last counters
+        self.finals = {} # worker index -> (counters, LatencyHistogram)
+        self.started_at = None
+        self.stopped_at = None
+        self.metrics = None
+
+    @staticmethod
+    def run_worker(broker_info, options, shard, index, messages, start, stop):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        control = ShardControl(index, messages, start, stop)
+        try:
+            config = FleetConfig(**dict(options, groups=shard, processes=1, metrics_port=0, duration=0))
+            FleetMode(broker_info, config=config, shard=control).run()
+        except Exception as error:
+            control.send("error", repr(error))
+
+    def run(self):
+        print("Fleet mode activated: {} sharded over {} processes.".format(FleetMode.describe_config_groups(self.config), len(self.shards)))
+        options = self.config.get_options()
+        for index, shard in enumerate(self.shards):
+            worker = self.context.Process(target=FleetCoordinator.run_worker, name="fleet-worker-{}".format(index),
+                                          args=(self.broker_info, options, shard, index, self.messages, self.start, self.stop))
+            worker.start()
+            self.workers.append(worker)
+        if self.config.metrics_port:
+            self.metrics = MetricsRegistry({"mode": "fleet", "prefix": self.config.topic_prefix})
+            self.register_metrics(self.metrics)
+            self.metrics.start_http_server(self.config.metrics_port)
+        try:
+            self.wait_until_ready()
+            self.follow_workers()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop.set()
+            self.stopped_at = time.monotonic()
+            self.collect_finals()
+            for worker in self.workers:
+                worker.join(5)
+                if worker.is_alive():
+                    worker.terminate()
+            if self.metrics is not None:
+                self.metrics.close()
+            self.report()
+
+    def receive(self, timeout_s):
+        # Handles the next message of a worker, False when none came within timeout_s
+        try:
+            message = self.messages.get(timeout=timeout_s)
+        except queue.Empty:
+            return False
+        kind, index = message[0], message[1]
+        if kind in ("ready", "counters"):
+            self.counters[index] = message[2]
+        elif kind == "final":
+            self.counters[index] = message[2]
+            self.finals[index] = (message[2], LatencyHistogram.from_dict(message[3]))
+        elif kind == "error":
+            print("[fleet] worker {} failed: {}".format(index, message[2]))
+            self.finals[index] = None
+        return True
+
+    def alive(self):
+        return [worker for index, worker in enumerate(self.workers) if worker.is_alive() and index not in self.finals]
+
+    def wait_until_ready(self):
+        deadline = time.monotonic() + FleetCoordinator.CONNECT_TIMEOUT_S
+        while len(self.counters) + len(self.finals) < len(self.workers) and time.monotonic() < deadline and self.alive():
+            self.receive(ShardControl.REPORT_INTERVAL_S)
+        connected = sum(counters["connected"] for counters in self.counters.values())
+        print("[fleet] {} workers ready, {}/{} sensors connected".format(len(self.counters), connected, self.config.get_sensor_count()))
+        if self.config.autostart:
+            self.start.set()
+        self.started_at = time.monotonic()
+
+    def follow_workers(self):
+        next_summary = time.monotonic() + self.config.summary_interval
+        previous_total, previous_time = 0, time.monotonic()
+        end = self.started_at + self.config.duration if self.config.duration else None
+        while self.alive() and (end is None or time.monotonic() < end):
+            self.receive(min(ShardControl.REPORT_INTERVAL_S, max(0.0, next_summary - time.monotonic())))
+            now = time.monotonic()
+            if now >= next_summary:
+                totals = self.get_totals()
+                print("[fleet x{}] connected {}/{} | publishing {} | values sent {} ({:.1f}/s, target {:.1f}/s) | skipped {}".format(
+                    len(self.workers), totals["connected"], totals["sensors"], totals["publishing"], totals["values_sent"],
+                    (totals["values_sent"] - previous_total) / (now - previous_time), totals["target_rate"], totals["skipped"]))
+                previous_total, previous_time = totals["values_sent"], now
+                next_summary += self.config.summary_interval
+
+    def collect_finals(self):
+        deadline = time.monotonic() + FleetCoordinator.FINAL_TIMEOUT_S
+        while len(self.finals) < len(self.workers) and time.monotonic() < deadline:
+            if not self.receive(ShardControl.REPORT_INTERVAL_S) and not self.alive():
+                break
+
+    def get_totals(self):
+        totals = {}
+        for counters in self.counters.values():
+            for key, value in counters.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals or {key: 0 for key in ("sensors", "connected", "publishing", "target_rate", "values_sent", "skipped", "reconnects", "out_queue")}
+
+    def register_metrics(self, metrics):
+        # The last counters sent by the workers (every REPORT_INTERVAL_S), summed
+        metrics.gauge("sensors", "virtual sensors of all the workers", lambda: self.get_totals()["sensors"])
+        metrics.gauge("connected_sensors", "virtual sensors connected to the broker", lambda: self.get_totals()["connected"])
+        metrics.gauge("publishing_sensors", "virtual sensors publishing", lambda: self.get_totals()["publishing"])
+        metrics.counter("values_sent_total", "values published, batched values included", lambda: self.get_totals()["values_sent"])
+        metrics.counter("skipped_values_total", "deadlines dropped by the schedulers (late publication)", lambda: self.get_totals()["skipped"])
+        metrics.counter("reconnects_total", "reconnections to the broker", lambda: self.get_totals()["reconnects"])
+        metrics.gauge("mqtt_out_queue", "MQTT packets waiting to be sent by paho, all the workers", lambda: self.get_totals()["out_queue"])
+        metrics.gauge("workers", "worker processes still running", lambda: len(self.alive()))
+
+    def report(self):
+        elapsed_s = (self.stopped_at or time.monotonic()) - (self.started_at or time.monotonic())
+        lag = LatencyHistogram()
+        workers = []
+        for index in range(len(self.workers)):
+            final = self.finals.get(index)
+            counters = final[0] if final else self.counters.get(index, {})
+            if final:
+                lag.merge(final[1])
+            workers.append(dict(counters, worker=index, complete=final is not None,
+                                throughput=counters.get("values_sent", 0) / elapsed_s if elapsed_s > 0 else 0.0))
+        totals = self.get_totals()
+        totals["throughput"] = totals["values_sent"] / elapsed_s if elapsed_s > 0 else 0.0
+        print("[fleet] {} workers, {:.1f} s: {} values sent, {:.1f} values/s ({}), {} skipped, {} reconnects".format(
+            len(self.workers), elapsed_s, totals["values_sent"], totals["throughput"],
+            " + ".join("{:.0f}".format(worker["throughput"]) for worker in workers), totals["skipped"], totals["reconnects"]))
+        if lag.total:
+            print("[fleet] publisher lag p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms".format(
+                LatencyReport.to_ms(lag.value_at_percentile(50)), LatencyReport.to_ms(lag.value_at_percentile(99)), LatencyReport.to_ms(lag.max_ns)))
+        path = StreamingResultWriter.build_path(ResultReporter.results_folder, "fleet", self.config.topic_prefix)[:-len(".csv")] + ".json"
+        os.makedirs(ResultReporter.results_folder, exist_ok=True)
+        with open(path, "w") as file:
+            json.dump({"processes": len(self.workers), "duration_s": elapsed_s, "groups": [group.get_options() for group in self.config.get_groups()],
+                       "totals": totals, "workers": workers, "publisher_lag": lag.to_dict()}, file, indent=2)
+        print("[fleet] report saved in {}".format(path))
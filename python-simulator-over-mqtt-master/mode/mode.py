@@ -1,66 +1,247 @@
-import json
+import threading
 import time
-import datetime
 
 from constants import MqttAppConstants
+from sampleBatcher import SampleBatcher
+from messageCodec import MessageCodec
+from consoleEcho import ConsoleEcho, ReadableTime
+from recordStore import RecordStore
+from receivePipeline import ReceivePipeline
+from publishWindow import PublishWindow
 from abc import ABC, abstractmethod
 
 class Mode(ABC):
-    def __init__(self, mqtt_service):
+    # Built once: the server commands are never saved (see add_time_value_pairs)
+    COMMANDS = frozenset(MqttAppConstants.get_commands())
+    # Publish and receive hot paths, wrapped by the profiling hooks (see profiler.py)
+    HOT_PATHS = ("publish_message", "publish_batch", "process_received_message")
+
+    def __init__(self, mqtt_service, codec_name=MqttAppConstants.CODEC_JSON, echo=ConsoleEcho.DEFAULT, topic=None, records=None, writer=None, qos=0,
+                 receive_queue=ReceivePipeline.DEFAULT_SIZE, receive_workers=ReceivePipeline.DEFAULT_WORKERS, max_inflight=None):
         self.mqtt_service = mqtt_service
         self.mqtt_service.client.on_message = self.on_message_for_mode
+        # Codec used to SEND messages, received messages are decoded whatever their codec (see messageCodec.py)
+        self.codec = MessageCodec.get_codec(codec_name)
+        # Printing every message is too costly at high rates, see consoleEcho.py
+        self.echo = ConsoleEcho(echo)
+        # QoS of the publications and subscriptions, and paho's window of unacknowledged QoS 1/2 messages (None = tuned for the QoS)
+        self.qos = qos
+        PublishWindow.configure_qos(self.mqtt_service.client, qos, max_inflight)
+        # Optional PublishWindow bounding the values handed to paho (sensor, see publishWindow.py)
+        self.publish_window = None
+        # Optional OfflineBuffer keeping the values produced while the broker is unreachable (sensor, see offlineBuffer.py)
+        self.offline_buffer = None
+        # Filler added to the value messages to reach a payload size (see SensorMode.set_payload_size), None = no filler
+        self.padding = None
 
         # topic duplication
-        topic = input("Enter topic used for communication (between sensor and server): \n")
+        if topic is None:
+            topic = input("Enter topic used for communication (between sensor and server): \n")
         self.topic_for_hearing_from_sensor = MqttAppConstants.get_full_topic_name(topic, MqttAppConstants.HEARING_FROM_SENSOR)
         self.topic_for_hearing_from_server = MqttAppConstants.get_full_topic_name(topic, MqttAppConstants.HEARING_FROM_SERVER)
 
-        self.time_value_pairs = []
+        # Columnar store of the (time, value) records, optionally bounded (ring buffer or spill to disk), see recordStore.py
+        self.time_value_pairs = records if records is not None else RecordStore()
+        # Optional StreamingResultWriter: the records are also saved on disk during the run (see resultWriter.py)
+        self.writer = writer
+        # The sensor records its values from its publishing thread and its answers from the MQTT thread
+        self.records_lock = threading.Lock()
+        # Received messages: bounded queue + workers, out of paho's network thread (0 worker = processed in that thread)
+        self.receive_queue_size = receive_queue
+        self.receive_workers = receive_workers
+        self.receive_pipeline = None
+        # Optional ClockSync fed with the answers to the sync commands (server mode, see clockSync.py)
+        self.clock_sync = None
+        # Optional TopicStatsTable: running aggregates per received topic, in constant memory (server mode, see topicStats.py)
+        self.topic_stats = None
+        # Read by the live metrics (see register_metrics and metrics.py)
+        self.messages_sent = 0
+        self.values_sent = 0
+        self.messages_received = 0
+        self.transit_histogram = None # LatencyHistogram of the sender timestamp -> reception delays, only with metrics
+        # Recorded by every receive worker: a LatencyHistogram update (counts[i] += 1, total += 1) is not atomic
+        self.transit_lock = threading.Lock()
 
-    def publish_message(self, topic, mode, cmdOrValueOrAns):
+    def publish_message(self, topic, mode, cmdOrValueOrAns, seq=None, request_id=None):
         # This function takes care of message publication FOR ALL MODES (sensor and server)
         # --> Remember that the server sends messages of type: {"timestamp": 1720985647.210731, "cmd": "ping"}
         # --> the sensor sends commands of type: {"timestamp": 1720985647.21071, "ans": "pong"} or {"timestamp": 1720985647.210731, "value": "74"}
-        # Thus, this function is able to post either cmd, ans or value.
-        # ------------- JSON FORMAT OF SENDED VALUES
-        # 1) Get current UNIX timestamp (in seconds) with fractions of a second precision (example: 1720733625.1637602 seconds)
-        timestamp = time.time()
-        microseconds_timestamp = int(time.time() * 1e6) # BECAUSE WE WANT MICROSECONDS whereas time.time() return is 1720733625.1637602 seconds
-        timestamp_readable = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')
-        
-        message = json.dumps(
-            {MqttAppConstants.MSG_TIMESTAMP:microseconds_timestamp,
-             mode:cmdOrValueOrAns}
-        )
+        # Thus, this function is able to post either cmd, ans or value. Values also carry their sequence number (seq), the
+        # answers the request id of the command they answer, if any (see the ping mode).
+        # ------------- FORMAT OF SENDED VALUES
+        # 1) Get current UNIX timestamp ONCE, in integer nanoseconds (no float rounding, no datetime object). The message
+        # carries microseconds (example: 1720733625163760), the saved pair keeps the nanoseconds: the human readable
+        # version is only built when needed (printed line, report).
+        timestamp_ns = time.time_ns()
+
+        message = {MqttAppConstants.MSG_TIMESTAMP:timestamp_ns // 1000,
+                   mode:cmdOrValueOrAns}
+        if seq is not None:
+            message[MqttAppConstants.MSG_SEQ] = seq
+        if request_id is not None:
+            message[MqttAppConstants.MSG_ID] = request_id
+        if self.padding is not None and mode == MqttAppConstants.MSG_VALUE:
+            message[MqttAppConstants.MSG_PADDING] = self.padding
+        message = self.codec.encode(message)
         # ------------------------------------------
         # Ajoute les parties prores aux fils (ici, le serveur ajoute une commande et le serveur une commande)
-        self.mqtt_service.client.publish(topic, message)
-        self.add_time_value_pairs(timestamp_readable, cmdOrValueOrAns)
-        print(">>>>[{}]: sending {} at {}".format(topic, message, timestamp_readable))
+        if mode == MqttAppConstants.MSG_VALUE:
+            self.send_values(topic, message)
+        else:
+            self.mqtt_service.client.publish(topic, message, self.qos)
+        self.messages_sent += 1
+        self.add_time_value_pairs(timestamp_ns, cmdOrValueOrAns, -1 if seq is None else seq)
+        if mode == MqttAppConstants.MSG_VALUE:
+            self.values_sent += 1
+            self.echo.show(">>>>[{}]: sending {} {} at {}", topic, mode, cmdOrValueOrAns, ReadableTime(timestamp_ns))
+        else:
+            self.echo.always(">>>>[{}]: sending {} {} at {}", topic, mode, cmdOrValueOrAns, ReadableTime(timestamp_ns))
+
+    def publish_batch(self, topic, batch):
+        # Publication of several values in ONE message (batching mode of the sensor, see sampleBatcher.py)
+        # --> {"timestamp": 1720985647210731, "seq": 120, "period": 4000, "values": [74, 75, 76]}
+        base_timestamp, period_us, values, base_seq = batch
+        message = {MqttAppConstants.MSG_TIMESTAMP:base_timestamp,
+                   MqttAppConstants.MSG_SEQ:base_seq,
+                   MqttAppConstants.MSG_PERIOD:period_us,
+                   MqttAppConstants.MSG_VALUES:values}
+        if self.padding is not None:
+            message[MqttAppConstants.MSG_PADDING] = self.padding
+        self.send_values(topic, self.codec.encode(message))
+        self.messages_sent += 1
+        self.values_sent += len(values)
+        # Each value is saved with its own production time and sequence number, so that the latency reports stay per value
+        sample_timestamps = SampleBatcher.sample_timestamps(base_timestamp, period_us, len(values))
+        for index, (sample_timestamp, value) in enumerate(zip(sample_timestamps, values)):
+            self.add_time_value_pairs(sample_timestamp * 1000, value, base_seq + index)
+        self.echo.show(">>>>[{}]: sending {} values in one message at {}", topic, len(values), ReadableTime(base_timestamp * 1000))
+
+    def send_values(self, topic, payload):
+        # Value messages (single values and batches): kept in the offline buffer while disconnected, bounded by the
+        # publish window otherwise
+        if self.offline_buffer is not None and not self.mqtt_service.is_connected():
+            self.offline_buffer.append(topic, payload)
+        elif self.publish_window is not None:
+            self.publish_window.publish(topic, payload)
+        else:
+            self.mqtt_service.client.publish(topic, payload, self.qos)
 
     def on_message_for_mode(self, client, userdata, messageContainingValueOrAnswerToCommand):
-        # Ajoutez la valeur reçue à la liste
-        timestamp = time.time()  # Obtenir le timestamp UNIX actuel with fractions of a second precision
-        timestamp_readable = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')
-        message_string = messageContainingValueOrAnswerToCommand.payload.decode("utf-8")
-        message_dict = json.loads(message_string)
+        # Runs in paho's network thread: only the reception time is taken here, the message is processed by the
+        # workers of the receive pipeline (see receivePipeline.py), or here when there is no worker.
+        timestamp_ns = time.time_ns()  # Obtenir le timestamp UNIX actuel (integer nanoseconds)
+        self.messages_received += 1
+        if self.receive_workers == 0:
+            self.process_received_message(timestamp_ns, messageContainingValueOrAnswerToCommand.payload,
+                                          messageContainingValueOrAnswerToCommand.topic)
+            return
+        if self.receive_pipeline is None:
+            # Created on the first message: the modes that never use on_message_for_mode (sensor) have no worker
+            self.receive_pipeline = ReceivePipeline(self.process_received_message, self.receive_queue_size, self.receive_workers)
+        self.receive_pipeline.submit(timestamp_ns, messageContainingValueOrAnswerToCommand.payload,
+                                     messageContainingValueOrAnswerToCommand.topic)
+
+    def process_received_message(self, timestamp_ns, payload, topic=None):
+        # Ajoutez la valeur reçue à la liste (topic: the topic the message was received on, only used by the ward mode)
+        message_dict = MessageCodec.decode(payload)
         content_extraction = None
-        if message_dict.get(MqttAppConstants.MSG_VALUE):
+        seq = message_dict.get(MqttAppConstants.MSG_SEQ, -1)
+        if self.transit_histogram is not None:
+            self.record_transit(timestamp_ns, message_dict)
+        if self.topic_stats is not None:
+            self.topic_stats.record(topic or self.topic_for_hearing_from_sensor, timestamp_ns, message_dict)
+        if MqttAppConstants.MSG_VALUES in message_dict:
+            # Batch of values: unpacked into one (time, value) pair per value. They all share the reception time, thus
+            # the measured delta of a value includes the time it waited in the batch (the real delay of that value).
+            for index, value in enumerate(message_dict[MqttAppConstants.MSG_VALUES]):
+                self.add_time_value_pairs(timestamp_ns, value, seq + index if seq >= 0 else -1)
+            self.echo.show("Received {} values in one message at {}", len(message_dict[MqttAppConstants.MSG_VALUES]), ReadableTime(timestamp_ns))
+            return
+        if MqttAppConstants.MSG_VALUE in message_dict:
             content_extraction = message_dict[MqttAppConstants.MSG_VALUE]
-        elif message_dict.get(MqttAppConstants.MSG_ANS):
+            self.add_time_value_pairs(timestamp_ns, content_extraction, seq)
+            self.echo.show("Received message: {} at {}", message_dict, ReadableTime(timestamp_ns))
+            return
+        if MqttAppConstants.MSG_ANS in message_dict:
             content_extraction = message_dict[MqttAppConstants.MSG_ANS]
-        self.add_time_value_pairs(timestamp_readable, content_extraction)
-        print("Received message: {} at {}".format(message_string, timestamp_readable))
+            if content_extraction == MqttAppConstants.SYNC_RESPONSE:
+                # Background clock synchronization: neither recorded nor printed
+                if self.clock_sync is not None:
+                    self.clock_sync.add_exchange(message_dict.get(MqttAppConstants.MSG_ID), message_dict[MqttAppConstants.MSG_RECEIVED],
+                                                 message_dict[MqttAppConstants.MSG_TIMESTAMP], timestamp_ns)
+                return
+        self.add_time_value_pairs(timestamp_ns, content_extraction)
+        self.echo.always("Received message: {} at {}", message_dict, ReadableTime(timestamp_ns))
         
 
-    def add_time_value_pairs(self, time, cmdOrValueOrAns):
+    def record_transit(self, timestamp_ns, message_dict):
+        # Live metrics only: sender timestamp (first value of a batch) -> reception, meaningful when the clocks are synchronized
+        if MqttAppConstants.MSG_VALUE in message_dict or MqttAppConstants.MSG_VALUES in message_dict:
+            transit_ns = timestamp_ns - message_dict[MqttAppConstants.MSG_TIMESTAMP] * 1000
+            with self.transit_lock:
+                self.transit_histogram.record(transit_ns)
+
+    def add_time_value_pairs(self, timestamp_ns, cmdOrValueOrAns, seq=-1):
         # PLEASE BEAR IN MIND THAT WE DO NOT SAVE THE command sends by the server, we are only interest in the time delta
         # BEETWEN what the sensor SENDS and what the server RECEIVE !!!!!!!!
-        if (cmdOrValueOrAns not in MqttAppConstants.get_commands()):
-            self.time_value_pairs.append((time[11:], cmdOrValueOrAns))
+        # The time is kept as integer nanoseconds (time.time_ns()), it is formatted by ResultReporter. seq is -1 for answers.
+        if cmdOrValueOrAns is not None and cmdOrValueOrAns not in Mode.COMMANDS:
+            with self.records_lock:
+                self.time_value_pairs.append(timestamp_ns, cmdOrValueOrAns, seq)
+                if self.writer is not None:
+                    self.writer.append(timestamp_ns, cmdOrValueOrAns, seq)
     
     def get_all_times_values_interactions(self):
+        # RecordStore, iterating over it gives (time in nanoseconds since epoch, value) pairs
         return self.time_value_pairs
+
+    def drain_received(self):
+        # Waits until every received message has been processed
+        if self.receive_pipeline is not None:
+            self.receive_pipeline.drain()
+
+    def get_receive_counters(self):
+        # Counters of the receive pipeline (received, processed, dropped, depth...), None before the first message
+        return self.receive_pipeline.get_counters() if self.receive_pipeline is not None else None
+
+    def register_metrics(self, metrics):
+        # Exposes the counters of this mode in a MetricsRegistry (see metrics.py). They are read when scraped: nothing
+        # is added to the hot paths but the transit latency histogram.
+        metrics.counter("messages_sent_total", "MQTT messages published (values, batches, commands, answers)", lambda: self.messages_sent)
+        metrics.counter("values_sent_total", "values published, batched values included (and the ones dropped by a publish window)", lambda: self.values_sent)
+        metrics.counter("messages_received_total", "MQTT messages received", lambda: self.messages_received)
+        metrics.counter("receive_dropped_total", "received messages dropped, receive queue full",
+                        lambda: self.receive_pipeline.dropped if self.receive_pipeline is not None else 0)
+        metrics.counter("decode_errors_total", "received messages that could not be decoded or processed",
+                        lambda: sum(self.receive_pipeline.errors) if self.receive_pipeline is not None else 0)
+        metrics.gauge("receive_queue_depth", "received messages waiting for a receive worker",
+                      lambda: len(self.receive_pipeline.queue.queue) if self.receive_pipeline is not None else 0)
+        metrics.gauge("mqtt_out_queue", "MQTT packets waiting to be sent by paho", lambda: self.mqtt_service.get_out_queue())
+        metrics.counter("reconnects_total", "reconnections to the broker", lambda: self.mqtt_service.get_reconnects())
+        metrics.gauge("connected", "1 while connected to the broker", lambda: int(self.mqtt_service.is_connected()))
+        metrics.counter("outage_seconds_total", "time spent disconnected from the broker since the first connection",
+                        lambda: (self.mqtt_service.get_availability() or {}).get("down_s"))
+        metrics.gauge("max_time_to_recover_seconds", "longest time taken to reconnect after losing the broker",
+                      lambda: max(self.mqtt_service.outages, default=0))
+        if self.offline_buffer is not None:
+            buffer = self.offline_buffer
+            metrics.gauge("offline_buffer_depth", "values waiting in the offline buffer", lambda: len(buffer))
+            metrics.counter("offline_replayed_total", "values of the offline buffer published after a reconnection", lambda: buffer.replayed)
+            metrics.counter("offline_dropped_total", "values lost while disconnected, offline buffer full", lambda: buffer.dropped)
+        self.transit_histogram = metrics.histogram("transit_latency_seconds", "sender timestamp to reception delay of the values")
+
+    def close(self):
+        # To call once the MQTT client is stopped: flushes the streamed results and frees the records
+        print("Connection: {}".format(self.mqtt_service.describe_availability()))
+        if self.offline_buffer is not None:
+            self.offline_buffer.close()
+            print("Offline {}".format(self.offline_buffer.describe()))
+        if self.receive_pipeline is not None:
+            self.receive_pipeline.close()
+            print("Receive pipeline: {}".format(self.receive_pipeline.describe()))
+        if self.writer is not None:
+            self.writer.close()
+        self.time_value_pairs.close()
     
 
     @abstractmethod
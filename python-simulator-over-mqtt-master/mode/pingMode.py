@@ -0,0 +1,225 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import time
+import pandas as pd
+from constants import MqttAppConstants
+from latencyHistogram import LatencyHistogram
+from latencyReport import LatencyReport
+from messageCodec import MessageCodec
+from mqttConnector import MqttConnector
+from rateScheduler import RateScheduler
+from receivePipeline import ReceivePipeline
+from resultReporter import ResultReporter
+
+# Ping mode measures the CONTROL PLANE: the round trip of a command (server -> broker -> sensor -> broker -> server),
+# the path used by the backend's pingSensor endpoint. It sends a storm of pings carrying a request id (MSG_ID) to one
+# or many sensors (round robin) at a fixed rate; the sensors copy the id in their pong, which is matched to its ping.
+# The storm is repeated in phases, with the sensors idle (stop sent first) or streaming values (start sent first), to
+# see how the data stream degrades the command latency. A pong arriving after --timeout seconds is a timeout.
+# One row per phase (RTT percentiles, timeouts) is printed and saved in results/ping-<date>.csv
+#
+# ./mqttCliApp.py ping local --topics fleet0,fleet1 --rate 50 --duration 10 --phases idle,streaming
+# ./mqttCliApp.py ping local --fleet-prefix fleet --fleet-sensors 100 --rate 200
+
+class PingConfig:
+    # Default values, can be overridden by a JSON config file (same keys) and then by command line flags
+    DEFAULTS = {
+        "topics": [],                 # base topics of the pinged sensors
+        "fleet_prefix": "",           # or the sensors of a fleet: "<fleet_prefix><i>" (see FleetConfig.topic_prefix)
+        "fleet_sensors": 0,           # number of sensors of that fleet
+        "rate": 10.0,                 # pings per second, all sensors together
+        "duration": 10.0,             # seconds of pings per phase
+        "timeout": 2.0,               # seconds after which a ping without pong is a timeout
+        "settle": 1.0,                # seconds waited after the start/stop sent at the beginning of a phase
+        "phases": ["idle", "streaming"],
+        "qos": 0,                     # QoS of the pings and of the subscriptions
+        "codec": MqttAppConstants.CODEC_JSON, # codec used to send the pings (see messageCodec.py)
+    }
+    IDLE = "idle"
+    STREAMING = "streaming"
+    # Command sent to the sensors before each kind of phase
+    PHASE_COMMANDS = {IDLE: MqttAppConstants.COMMAND_STOP, STREAMING: MqttAppConstants.COMMAND_START}
+
+    def __init__(self, **options):
+        for key, default in PingConfig.DEFAULTS.items():
+            setattr(self, key, options.get(key, default))
+
+    @staticmethod
+    def parse_list(text):
+        return [item for item in text.split(",") if item]
+
+    @staticmethod
+    def from_arguments(arguments):
+        parser = argparse.ArgumentParser(prog="mqttCliApp.py ping [broker]")
+        parser.add_argument("--config", help="JSON file containing the ping configuration")
+        parser.add_argument("--topics", type=PingConfig.parse_list)
+        parser.add_argument("--fleet-prefix", dest="fleet_prefix")
+        parser.add_argument("--fleet-sensors", dest="fleet_sensors", type=int)
+        parser.add_argument("--rate", type=float)
+        parser.add_argument("--duration", type=float)
+        parser.add_argument("--timeout", type=float)
+        parser.add_argument("--settle", type=float)
+        parser.add_argument("--phases", type=PingConfig.parse_list)
+        parser.add_argument("--qos", type=int, choices=(0, 1, 2))
+        parser.add_argument("--codec", choices=MqttAppConstants.get_codecs())
+        parsed = vars(parser.parse_args(arguments))
+
+        options = {}
+        config_file = parsed.pop("config")
+        if config_file:
+            with open(config_file) as file:
+                options.update(json.load(file))
+        # Flags always win over the config file
+        options.update({key: value for key, value in parsed.items() if value is not None})
+
+        unknown_keys = set(options) - set(PingConfig.DEFAULTS)
+        if unknown_keys:
+            raise ValueError("Unknown ping option(s): {}".format(sorted(unknown_keys)))
+        config = PingConfig(**options)
+        if not config.get_topics():
+            raise ValueError("No sensor to ping: use --topics or --fleet-prefix and --fleet-sensors")
+        if config.rate <= 0 or config.duration <= 0 or config.timeout <= 0:
+            raise ValueError("rate, duration and timeout must be positive")
+        unknown_phases = set(config.phases) - set(PingConfig.PHASE_COMMANDS)
+        if unknown_phases:
+            raise ValueError("Unknown phase(s) {}, use {}".format(sorted(unknown_phases), list(PingConfig.PHASE_COMMANDS)))
+        return config
+
+    def get_topics(self):
+        return list(self.topics) + ["{}{}".format(self.fleet_prefix, index) for index in range(self.fleet_sensors)]
+
+
+class PingPhase:
+    # Round trips of the pings sent during one phase
+
+    def __init__(self, name):
+        self.name = name
+        self.histogram = LatencyHistogram()
+        self.sent = 0
+        self.answered = 0
+        self.late = 0 # pongs received after the timeout (counted in timeouts)
+        self.timeouts = 0
+        self.answers = {} # answer -> count ("pong" or "pong.publishing": the state of the sensors)
+        self.start_ns = None
+        self.end_ns = None
+
+    def get_row(self):
+        row = {"phase": self.name, "sent": self.sent, "answered": self.answered, "timeouts": self.timeouts,
+               "late": self.late}
+        row["send_rate_per_s"] = self.sent / ((self.end_ns - self.start_ns) / 1e9) if self.end_ns else None
+        row["mean_ms"] = LatencyReport.to_ms(self.histogram.mean())
+        for percentile in LatencyReport.PERCENTILES:
+            row["p{:g}_ms".format(percentile)] = LatencyReport.to_ms(self.histogram.value_at_percentile(percentile))
+        row["max_ms"] = LatencyReport.to_ms(self.histogram.max_ns)
+        row.update({"answers_{}".format(answer): count for answer, count in sorted(self.answers.items())})
+        return row
+
+
+class PingMode:
+
+    def __init__(self, broker_info, arguments):
+        self.config = PingConfig.from_arguments(arguments)
+        self.topics = self.config.get_topics()
+        self.command_topics = [MqttAppConstants.get_full_topic_name(topic, MqttAppConstants.HEARING_FROM_SERVER) for topic in self.topics]
+        self.codec = MessageCodec.get_codec(self.config.codec)
+        self.mqtt_service = MqttConnector(broker_info)
+        self.mqtt_service.client.on_message = self.on_message
+        # The values streamed by the sensors arrive on the same subscriptions: the network thread only takes the reception
+        # time, the messages are decoded by the receive pipeline (see receivePipeline.py)
+        self.receive_pipeline = ReceivePipeline(self.process_received_message)
+        self.request_ids = itertools.count()
+        # request id -> (send time in ns, PingPhase), filled by the sending thread, emptied by the receive worker
+        self.pending = {}
+        self.timeout_ns = int(self.config.timeout * 1e9)
+        self.run_id = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    def run(self):
+        self.mqtt_service.connect_broker()
+        self.mqtt_service.client.subscribe([(MqttAppConstants.get_full_topic_name(topic, MqttAppConstants.HEARING_FROM_SENSOR), self.config.qos)
+                                            for topic in self.topics])
+        self.mqtt_service.client.loop_start()
+        phases = []
+        try:
+            for name in self.config.phases:
+                phases.append(self.run_phase(name))
+        finally:
+            if phases and phases[-1].name == PingConfig.STREAMING:
+                self.send_to_all(MqttAppConstants.COMMAND_STOP)
+            self.mqtt_service.disconnect_broker()
+            self.receive_pipeline.close()
+        self.save_table(phases)
+
+    def run_phase(self, name):
+        print("Phase {}: {} to {} sensors, then {} pings per second for {} s".format(
+            name, PingConfig.PHASE_COMMANDS[name], len(self.topics), self.config.rate, self.config.duration))
+        self.send_to_all(PingConfig.PHASE_COMMANDS[name])
+        time.sleep(self.config.settle)
+        phase = PingPhase(name)
+        scheduler = RateScheduler(self.config.rate)
+        topics = itertools.cycle(self.command_topics)
+        phase.start_ns = time.monotonic_ns()
+        end_ns = phase.start_ns + int(self.config.duration * 1e9)
+        while time.monotonic_ns() < end_ns:
+            for _ in range(scheduler.wait()):
+                self.send_ping(next(topics), phase)
+        phase.end_ns = time.monotonic_ns()
+        # Last chance for the pongs of the last pings, the others are timeouts
+        time.sleep(self.config.timeout)
+        self.receive_pipeline.drain()
+        for request_id, (_, pending_phase) in list(self.pending.items()):
+            if pending_phase is phase and self.pending.pop(request_id, None) is not None:
+                phase.timeouts += 1
+        return phase
+
+    def send_to_all(self, command):
+        message = self.codec.encode({MqttAppConstants.MSG_TIMESTAMP: time.time_ns() // 1000, MqttAppConstants.MSG_CMD: command})
+        for topic in self.command_topics:
+            self.mqtt_service.client.publish(topic, message, self.config.qos)
+
+    def send_ping(self, topic, phase):
+        request_id = next(self.request_ids)
+        sent_ns = time.time_ns()
+        # Registered before publishing: the pong may come back before publish() returns
+        self.pending[request_id] = (sent_ns, phase)
+        self.mqtt_service.client.publish(topic, self.codec.encode({MqttAppConstants.MSG_TIMESTAMP: sent_ns // 1000,
+                                                                   MqttAppConstants.MSG_CMD: MqttAppConstants.COMMAND_PING,
+                                                                   MqttAppConstants.MSG_ID: request_id}), self.config.qos)
+        phase.sent += 1
+
+    def on_message(self, client, userdata, message):
+        self.receive_pipeline.submit(time.time_ns(), message.payload)
+
+    def process_received_message(self, timestamp_ns, payload):
+        message = MessageCodec.decode(payload)
+        request_id = message.get(MqttAppConstants.MSG_ID)
+        if request_id is None:
+            return # streamed value, or answer to start/stop
+        pending = self.pending.pop(request_id, None)
+        if pending is None:
+            return # answer of another server, or duplicate
+        sent_ns, phase = pending
+        rtt_ns = timestamp_ns - sent_ns
+        answer = message.get(MqttAppConstants.MSG_ANS)
+        phase.answers[answer] = phase.answers.get(answer, 0) + 1
+        if rtt_ns > self.timeout_ns:
+            phase.late += 1
+            phase.timeouts += 1
+            return
+        phase.answered += 1
+        phase.histogram.record(rtt_ns)
+
+    def save_table(self, phases):
+        table = pd.DataFrame([phase.get_row() for phase in phases])
+        answer_columns = [column for column in table.columns if column.startswith("answers_")]
+        table[answer_columns] = table[answer_columns].fillna(0).astype(int) # an answer never seen in a phase
+        os.makedirs(ResultReporter.results_folder, exist_ok=True)
+        path = os.path.join(ResultReporter.results_folder, "ping-{}.csv".format(self.run_id))
+        table.to_csv(path, index=False, float_format="%.6f")
+        columns = [column for column in ("phase", "sent", "answered", "timeouts", "late", "p50_ms", "p90_ms", "p99_ms",
+                                         "p99.9_ms", "max_ms") if column in table.columns]
+        print(table[columns].to_string(index=False, float_format=lambda value: "{:.3f}".format(value)))
+        print("Ping results saved in {}".format(path))
+        return path
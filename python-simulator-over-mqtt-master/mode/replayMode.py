@@ -0,0 +1,170 @@
+import argparse
+import json
+import threading
+from brokerInformator import BrokerInformator
+from captureFile import CaptureFile
+from constants import MqttAppConstants
+from mqttConnector import MqttConnector
+from offlineBuffer import OfflineBuffer
+from publishWindow import PublishWindow
+from recordStore import RecordStore
+from resultReporter import ResultReporter
+from resultWriter import StreamingResultWriter
+from signalGenerator import ReplaySignal
+from mode.sensorMode import SensorMode
+
+# Replay mode publishes RECORDED samples (e.g. real ECG captures of an ESP32 + AD8232) instead of generated ones, so that
+# the backend is tested with real morphologies and noise. Each replayed sensor is a SensorMode (same topics, commands
+# and answers) whose values come from the memory-mapped capture file (see captureFile.py): CSV and Parquet recordings
+# are converted once into a capture file next to them, then a multi-GB recording is replayed without being loaded.
+# Speed: 1 = real time (the rate of the recording), 10 = ten times faster, "max" = as fast as possible.
+# Several sensors can replay the same file, each one offset seconds later in the recording than the previous one.
+#
+# ./mqttCliApp.py replay local --file ecg.csv --sensors 4 --offset 30 --loop --autostart
+# ./mqttCliApp.py replay local --file ecg.scap --speed max --batch 25
+
+class ReplayConfig:
+    # Default values, can be overridden by a JSON config file (same keys) and then by command line flags
+    DEFAULTS = {
+        "file": "",                   # recording: capture file (.scap), CSV or Parquet (converted once)
+        "column": "",                 # column of the samples in a CSV/Parquet recording (default: "value", or the last one)
+        "rate": 0.0,                  # sample rate of a CSV/Parquet recording without timestamp_ns column, in Hz
+        "speed": "1",                 # replay speed: a factor of the recorded rate, or "max"
+        "loop": False,                # start again from the beginning at the end of the recording
+        "sensors": 1,                 # number of sensors replaying the file
+        "offset": 0.0,                # seconds between the starting points of two sensors in the recording
+        "topic_prefix": "replay",     # sensor i uses the topic "<topic_prefix><i>" (so "<topic_prefix><i>/sensor" ...)
+        "batch": "",                  # values per message: "25" (25 values) or "40ms" (40 ms of values), "" = one value
+        "codec": MqttAppConstants.CODEC_JSON, # codec used to send messages (see messageCodec.py)
+        "autostart": False,           # start publishing as soon as connected, without waiting for a "start" command
+        "max_records": 100000,        # records kept in memory per sensor (ring buffer), all of them are saved in results/
+        "echo": "1",                  # printed value lines per second and per sensor (see consoleEcho.py)
+        "qos": 0,                     # QoS of the publications and subscriptions
+        "window": PublishWindow.DEFAULT_SIZE, # values in flight at most per sensor, 0 = no bound (see publishWindow.py)
+        "window_policy": PublishWindow.BLOCK, # what to do with a value when the window is full
+        "offline_buffer": 0,          # value messages kept per sensor while disconnected, 0 = lost (opt-in)
+        "catch_up_rate": OfflineBuffer.DEFAULT_CATCH_UP_RATE, # buffered messages published per second after a reconnection
+    }
+    MAX_SPEED = "max"
+    # "max": the scheduler never sleeps, the values are published by bursts of max_burst (see RateScheduler)
+    MAX_SPEED_RATE = 1e9
+
+    def __init__(self, **options):
+        for key, default in ReplayConfig.DEFAULTS.items():
+            setattr(self, key, options.get(key, default))
+
+    @staticmethod
+    def from_arguments(arguments):
+        parser = argparse.ArgumentParser(prog="mqttCliApp.py replay [broker]")
+        parser.add_argument("--config", help="JSON file containing the replay configuration")
+        parser.add_argument("--file")
+        parser.add_argument("--column")
+        parser.add_argument("--rate", type=float)
+        parser.add_argument("--speed")
+        parser.add_argument("--loop", action="store_const", const=True)
+        parser.add_argument("--sensors", type=int)
+        parser.add_argument("--offset", type=float)
+        parser.add_argument("--topic-prefix", dest="topic_prefix")
+        parser.add_argument("--batch")
+        parser.add_argument("--codec", choices=MqttAppConstants.get_codecs())
+        parser.add_argument("--autostart", action="store_const", const=True)
+        parser.add_argument("--max-records", dest="max_records", type=int)
+        parser.add_argument("--echo")
+        parser.add_argument("--qos", type=int, choices=(0, 1, 2))
+        parser.add_argument("--window", type=int)
+        parser.add_argument("--window-policy", dest="window_policy", choices=PublishWindow.get_policies())
+        parser.add_argument("--offline-buffer", dest="offline_buffer", type=int)
+        parser.add_argument("--catch-up-rate", dest="catch_up_rate", type=float)
+        parsed = vars(parser.parse_args(arguments))
+
+        options = {}
+        config_file = parsed.pop("config")
+        if config_file:
+            with open(config_file) as file:
+                options.update(json.load(file))
+        # Flags always win over the config file
+        options.update({key: value for key, value in parsed.items() if value is not None})
+
+        unknown_keys = set(options) - set(ReplayConfig.DEFAULTS)
+        if unknown_keys:
+            raise ValueError("Unknown replay option(s): {}".format(sorted(unknown_keys)))
+        config = ReplayConfig(**options)
+        if not config.file:
+            raise ValueError("No recording to replay: use --file")
+        if config.sensors <= 0:
+            raise ValueError("sensors must be positive")
+        if str(config.speed) != ReplayConfig.MAX_SPEED and float(config.speed) <= 0:
+            raise ValueError("speed must be positive or '{}'".format(ReplayConfig.MAX_SPEED))
+        return config
+
+    def get_publish_rate(self, recorded_rate):
+        if str(self.speed) == ReplayConfig.MAX_SPEED:
+            return ReplayConfig.MAX_SPEED_RATE
+        return recorded_rate * float(self.speed)
+
+    def get_batch(self, recorded_rate):
+        # A batch of T milliseconds is T milliseconds of the RECORDING at full speed: sized from the publish rate
+        # (MAX_SPEED_RATE) it would hold millions of values
+        batch = str(self.batch).strip().lower()
+        if str(self.speed) == ReplayConfig.MAX_SPEED and batch.endswith("ms"):
+            return str(max(1, round(float(batch[:-2]) * recorded_rate / 1000)))
+        return batch
+
+
+class ReplayMode:
+
+    def __init__(self, broker_name, arguments):
+        self.broker_name = broker_name
+        self.broker_info = BrokerInformator.get_broker(broker_name)
+        self.config = ReplayConfig.from_arguments(arguments)
+        self.capture = CaptureFile(CaptureFile.ensure_capture(self.config.file, self.config.column or None, self.config.rate or None))
+        self.sensors = []
+        self.threads = []
+
+    def create_sensor(self, index):
+        topic = "{}{}".format(self.config.topic_prefix, index)
+        mqtt_service = MqttConnector(self.broker_info, client_id="python-replay-{}".format(topic))
+        mqtt_service.connect_broker()
+        signal = ReplaySignal(self.capture, offset_s=index * self.config.offset, loop=self.config.loop)
+        # Every replayed value is saved in results/<broker>-<topic>-<date>.csv, only the last ones are kept in memory
+        writer = StreamingResultWriter(StreamingResultWriter.build_path(ResultReporter.results_folder, self.broker_name, topic))
+        offline_buffer = OfflineBuffer(self.config.offline_buffer, catch_up_rate=self.config.catch_up_rate) if self.config.offline_buffer else None
+        return SensorMode(mqtt_service, rate=self.config.get_publish_rate(self.capture.rate), batch=self.config.get_batch(self.capture.rate),
+                          signal=signal, window=self.config.window, window_policy=self.config.window_policy, offline_buffer=offline_buffer,
+                          codec_name=self.config.codec, echo=self.config.echo, topic=topic, qos=self.config.qos,
+                          records=RecordStore(max_records=self.config.max_records), writer=writer)
+
+    def run(self):
+        print("Replay mode activated: {}, {} sensor(s), speed {}.".format(self.capture.describe(), self.config.sensors, self.config.speed))
+        self.sensors = [self.create_sensor(index) for index in range(self.config.sensors)]
+        for sensor in self.sensors:
+            sensor.listen()
+            if self.config.autostart:
+                sensor.allow_to_publish = True
+            self.threads.append(threading.Thread(target=self.replay, args=(sensor,), name="replay-{}".format(len(self.threads)), daemon=True))
+        for thread in self.threads:
+            thread.start()
+        try:
+            # Without --loop, the mode stops once every sensor reached the end of the recording
+            for thread in self.threads:
+                while thread.is_alive():
+                    thread.join(1.0)
+        finally:
+            self.close()
+
+    @staticmethod
+    def replay(sensor):
+        while not sensor.finished:
+            sensor.publish_until_stopped()
+
+    def close(self):
+        for sensor in self.sensors:
+            sensor.allow_to_publish = False
+        # The publishing threads flush their last batch before the connections are closed (a thread still waiting for a
+        # start command is a daemon, it is abandoned)
+        for thread in self.threads:
+            thread.join(1.0)
+        for sensor in self.sensors:
+            sensor.mqtt_service.disconnect_broker()
+            sensor.close()
+            print("[{}] {} values published, saved in {}".format(sensor.topic_for_hearing_from_sensor, sensor.next_seq, sensor.writer.path))
@@ -1,30 +1,80 @@
-import json
-import random
+import threading
 import time
 from constants import MqttAppConstants
 from mode.mode import Mode
+from rateScheduler import RateScheduler
+from sampleBatcher import SampleBatcher
+from messageCodec import MessageCodec
+from publishWindow import PublishWindow
+from signalGenerator import SignalGenerator
+from loadProfile import ProfileDriver
 
 class SensorMode(Mode):
-    def __init__(self, mqtt_service):
-        super().__init__(mqtt_service)
+    def __init__(self, mqtt_service, rate=None, ordered=None, batch=None, signal=None, window=None, window_policy=PublishWindow.BLOCK,
+                 offline_buffer=None, load_profile=None, late_policy=RateScheduler.CATCH_UP, **mode_options):
+        # mode_options: see Mode.__init__ (codec_name, echo, topic, records, writer, qos)
+        # rate, ordered, batch: asked to the user when not given (see the questions below)
+        # signal: spec of the published values (see signalGenerator.py), replaces ordered, or a SignalGenerator (replay mode)
+        # window, window_policy: values in flight at most and what to do beyond (see publishWindow.py), None = no bound
+        # offline_buffer: OfflineBuffer keeping the values while the broker is unreachable (see offlineBuffer.py), None = lost
+        # load_profile: LoadProfile changing the rate during each publication (see loadProfile.py), replaces rate
+        # late_policy: what the scheduler does with the values that are due when the publisher is late (see rateScheduler.py)
+        super().__init__(mqtt_service, **mode_options)
         self.mqtt_service.client.on_message = self.on_message_for_sensor
         # Interaction with user
-        number_of_values_per_second = self.ask_for_integer("How many data per second do you want to send: ")
-        self.publishing_function_mode = self.ask_for_value_mode()
+        if rate is None and load_profile is not None:
+            rate = load_profile.phases[0].from_rate
+        number_of_values_per_second = rate if rate is not None else self.ask_for_integer("How many data per second do you want to send: ")
+        if signal is None:
+            if ordered is None:
+                signal = self.ask_for_signal()
+            else:
+                signal = MqttAppConstants.SIGNAL_ORDERED if ordered else MqttAppConstants.SIGNAL_RANDOM
+        # The values are computed by blocks ahead of the publication, the publishing loop only takes the next one
+        self.signal = signal if isinstance(signal, SignalGenerator) else SignalGenerator.from_spec(number_of_values_per_second, signal)
+        self.publishing_function_mode = self.signal.next_value
+        if batch is None:
+            self.batcher = self.ask_for_batching(number_of_values_per_second)
+        else:
+            self.batcher = SampleBatcher.from_spec(number_of_values_per_second, str(batch))
         # end of interaction with user
         # sensor attribute
-        self.time_sleep_beetween_two_values = 1/number_of_values_per_second
-        self._allow_to_publish = False
+        self.scheduler = RateScheduler(number_of_values_per_second, policy=late_policy)
+        if window:
+            # A publisher blocked when the connection is lost gives up, its next values go to the offline buffer
+            self.publish_window = PublishWindow(self.mqtt_service.client, self.qos, window, window_policy, scheduler=self.scheduler,
+                                                is_active=lambda: self.allow_to_publish and (self.offline_buffer is None or self.mqtt_service.is_connected()))
+        if load_profile is not None and window and window_policy == PublishWindow.ADAPTIVE:
+            raise ValueError("A load profile sets the rate itself, it cannot be combined with the adaptive window policy")
+        # One driver for the whole run: the profile starts again on each START command, the phases of every publication are logged
+        self.profile_driver = ProfileDriver(load_profile, self.scheduler) if load_profile is not None else None
+        if offline_buffer is not None:
+            self.offline_buffer = offline_buffer
+            offline_buffer.attach(self.mqtt_service, self.qos)
+        self.next_seq = 0 # sequence number of the next value, never reset so that each value of a run is unique
+        self.finished = False # the replayed recording has no more value (see ReplaySignal)
+        # Set while the sensor is allowed to publish: the publishing loop blocks on it (no busy-wait) when idle
+        self._publishing = threading.Event()
+        # Set on every start/stop so that a sleeping publishing loop wakes up immediately
+        self._state_changed = threading.Event()
 
     ### Getter and setter for publishing
 
     @property
     def allow_to_publish(self):
-        return self._allow_to_publish
+        return self._publishing.is_set()
 
     @allow_to_publish.setter
     def allow_to_publish(self, value):
-        self._allow_to_publish = value
+        if value:
+            self._publishing.set()
+        else:
+            self._publishing.clear()
+        self._state_changed.set()
+
+    def wait_until_publishing(self, timeout=None):
+        # True once the sensor is allowed to publish (START received), False after timeout seconds
+        return self._publishing.wait(timeout)
 
     def ask_for_integer(self, prompt):
         while True:
@@ -37,67 +87,164 @@ class SensorMode(Mode):
                 print("{} is not a valid number.".format(value))
 
     
-    def ask_for_value_mode(self):
-        mode = input("Do you want to send ordered values? [y] otherwise random: ").strip().lower()
-        if mode == 'y':
-            return self.publish_ordered_value
-        else:
-            return self.publish_random_value
+    def ask_for_signal(self):
+        while True:
+            mode = input("Do you want to send ordered values? [y], a signal ({}), otherwise random: ".format(
+                ", ".join([MqttAppConstants.SIGNAL_ECG, MqttAppConstants.SIGNAL_SINE, MqttAppConstants.SIGNAL_NOISE]))).strip().lower()
+            if mode == 'y':
+                return MqttAppConstants.SIGNAL_ORDERED
+            if mode.partition(":")[0] not in MqttAppConstants.get_signals():
+                return MqttAppConstants.SIGNAL_RANDOM
+            try:
+                SignalGenerator.from_spec(1, mode) # checks the options
+                return mode
+            except (ValueError, TypeError) as error:
+                print("{} is not a valid signal: {}".format(mode, error))
 
+    def ask_for_batching(self, number_of_values_per_second):
+        while True:
+            spec = input("Values per message? a number (ex: 25) or a duration (ex: 40ms), nothing for one value per message: ")
+            try:
+                return SampleBatcher.from_spec(number_of_values_per_second, spec)
+            except ValueError:
+                print("{} is not a valid batch size.".format(spec))
+
+
+    def set_payload_size(self, payload_size):
+        # Pads the value messages so that a single value message weighs payload_size bytes (bench mode)
+        sample = self.codec.encode({MqttAppConstants.MSG_TIMESTAMP: time.time_ns() // 1000,
+                                    MqttAppConstants.MSG_VALUE: 100, MqttAppConstants.MSG_SEQ: 0,
+                                    MqttAppConstants.MSG_PADDING: ""})
+        self.padding = "x" * max(0, payload_size - len(sample))
+
+    def register_metrics(self, metrics):
+        super().register_metrics(metrics)
+        metrics.gauge("achieved_rate", "values per second achieved by the scheduler since the last start", self.scheduler.achieved_rate)
+        metrics.counter("skipped_values_total", "deadlines dropped by the scheduler (late publication)", lambda: self.scheduler.skipped)
+        metrics.gauge("publishing", "1 while the sensor publishes", lambda: int(self.allow_to_publish))
+        if self.publish_window is not None:
+            window = self.publish_window
+            metrics.gauge("publish_window_in_flight", "values handed to paho and not written/acknowledged yet", lambda: len(window.pending))
+            metrics.gauge("publish_window_backlog", "values waiting for room in the publish window", lambda: len(window.backlog))
+            metrics.counter("publish_window_dropped_total", "values dropped by the publish window", lambda: window.dropped)
+            metrics.gauge("publish_rate", "current publication rate (lowered by the adaptive policy)", lambda: self.scheduler.rate)
 
     def run(self):
-        self.mqtt_service.subscribe_topic(self.topic_for_hearing_from_server) # As the sensor, I want to listen to my servor, sub here
+        self.listen()
+        while True:
+            self.publish_until_stopped()
+
+    def listen(self):
+        self.mqtt_service.subscribe_topic(self.topic_for_hearing_from_server, self.qos) # As the sensor, I want to listen to my servor, sub here
+        # and to the commands sent to all the sensors of a ward (see MqttAppConstants.get_broadcast_topics)
+        for topic in MqttAppConstants.get_broadcast_topics(self.topic_for_hearing_from_server[:-len(MqttAppConstants.HEARING_FROM_SERVER)]):
+            self.mqtt_service.subscribe_topic(topic, self.qos)
         print("Sensor mode activated. Waiting for user commands.")
         self.mqtt_service.client.loop_start()
+
+    def publish_until_stopped(self):
+        self._publishing.wait() # sleeps until the server sends START
+        self.publish_values(self.topic_for_hearing_from_sensor) # speak on the another one (You can also send non ordered value)
+        print("Publication stopped: {}".format(self.scheduler.describe()))
+        if self.publish_window is not None:
+            print("Publish {}".format(self.publish_window.describe()))
+        self.save_load_profile()
+
+    def save_load_profile(self):
+        # The phases run so far, next to the streamed results (the report mode tags each value with its phase)
+        if self.profile_driver is not None and self.profile_driver.log and self.writer is not None:
+            print("Load profile phases saved in {}".format(self.profile_driver.save(ProfileDriver.get_file_path(self.writer.path))))
+
+    def close(self):
+        if self.profile_driver is not None and self.profile_driver.log and self.profile_driver.log[-1]["end_seq"] is None:
+            # Interrupted while publishing: the running phase ends with the last value drawn
+            self.profile_driver.close_phase(self.next_seq)
+            self.save_load_profile()
+        super().close()
+
+    def publish_values(self, topic):
+        # Publish on absolute deadlines until the server sends STOP (or until the end of a replayed recording)
+        self.scheduler.start()
+        if self.profile_driver is not None:
+            self.profile_driver.start(self.next_seq)
         while True:
-            if self.allow_to_publish:
-                self.publishing_function_mode(self.topic_for_hearing_from_sensor) #  # speak on the another one (You can also send non ordered value)
-    
+            self._state_changed.clear() # cleared BEFORE checking the state, so that a STOP can never be missed
+            if self.profile_driver is not None and self.allow_to_publish and not self.profile_driver.update(self.next_seq):
+                print("Load profile finished.")
+                self.allow_to_publish = False
+            if not self.allow_to_publish:
+                self.flush_batch(topic)
+                if self.publish_window is not None:
+                    self.publish_window.flush()
+                if self.profile_driver is not None:
+                    self.profile_driver.finish(self.next_seq)
+                return
+            try:
+                for _ in range(self.scheduler.wait(self._state_changed)):
+                    if self.batcher:
+                        # The load profile or the adaptive window may have changed the rate since the last sample
+                        batch = self.batcher.follow_rate(self.scheduler.rate)
+                        if batch:
+                            self.publish_batch(topic, batch)
+                        batch = self.batcher.add(self.publishing_function_mode(), self.next_seq)
+                        self.next_seq += 1
+                        if batch:
+                            self.publish_batch(topic, batch)
+                    else:
+                        self.publish_value(topic, self.publishing_function_mode())
+            except EOFError as end:
+                print("{}, publication stopped.".format(end))
+                self.finished = True
+                self.allow_to_publish = False
+
+    def flush_batch(self, topic):
+        # Values waiting in an incomplete batch are sent when the publication stops
+        if self.batcher:
+            batch = self.batcher.flush()
+            if batch:
+                self.publish_batch(topic, batch)
+
     def publish_value(self, topic, value):
-        self.publish_message(topic, MqttAppConstants.MSG_VALUE, value)
+        self.publish_message(topic, MqttAppConstants.MSG_VALUE, value, seq=self.next_seq)
+        self.next_seq += 1
+
+    def publish_answer_to_server_command(self, topic, answer, request_id=None):
+        self.publish_message(topic, MqttAppConstants.MSG_ANS, answer, request_id=request_id)
 
-    def publish_answer_to_server_command(self, topic, answer):
-        self.publish_message(topic, MqttAppConstants.MSG_ANS, answer)
+    def publish_sync_answer(self, topic, request_id, received_ns):
+        # Answer to the clock synchronization of the server (see clockSync.py): not recorded, not printed. The timestamp
+        # of the answer is taken as late as possible, just before encoding.
+        message = {MqttAppConstants.MSG_ANS: MqttAppConstants.SYNC_RESPONSE, MqttAppConstants.MSG_ID: request_id,
+                   MqttAppConstants.MSG_RECEIVED: received_ns // 1000, MqttAppConstants.MSG_TIMESTAMP: time.time_ns() // 1000}
+        self.mqtt_service.client.publish(topic, self.codec.encode(message), self.qos)
 
-    def interact_with_received_command(self, message):
+    def interact_with_received_command(self, message, received_ns=None):
 
-        received_message = message.payload.decode()
-        received_json = json.loads(received_message)
+        received_json = MessageCodec.decode(message.payload)
         received_value = received_json[MqttAppConstants.MSG_CMD] # command received from the server
+        request_id = received_json.get(MqttAppConstants.MSG_ID) # copied in the answer (ping mode)
 
         if received_value == MqttAppConstants.COMMAND_PING:
             if self.allow_to_publish:
                 # the sensor is already publishing
-                self.publish_answer_to_server_command(self.topic_for_hearing_from_sensor,MqttAppConstants.PING_RESPONSE_WHEN_ALREADY_PUBLISHING)
+                self.publish_answer_to_server_command(self.topic_for_hearing_from_sensor,MqttAppConstants.PING_RESPONSE_WHEN_ALREADY_PUBLISHING, request_id)
     
             else:
-                self.publish_answer_to_server_command(self.topic_for_hearing_from_sensor, MqttAppConstants.PING_RESPONSE)
+                self.publish_answer_to_server_command(self.topic_for_hearing_from_sensor, MqttAppConstants.PING_RESPONSE, request_id)
         elif received_value == MqttAppConstants.COMMAND_START:
-                self.publish_answer_to_server_command(self.topic_for_hearing_from_sensor, MqttAppConstants.START_RESPONSE)
+                self.publish_answer_to_server_command(self.topic_for_hearing_from_sensor, MqttAppConstants.START_RESPONSE, request_id)
                 self.allow_to_publish = True
                 # We set allow_to_publish to True after answering to the server, because otherwise we would start sending values
                 # before answering to the server command (the sensor would start publishing whenever the attribute is True)
         elif received_value == MqttAppConstants.COMMAND_STOP:
             self.allow_to_publish = False
-            self.publish_answer_to_server_command(self.topic_for_hearing_from_sensor, MqttAppConstants.STOP_RESPONSE)
+            self.publish_answer_to_server_command(self.topic_for_hearing_from_sensor, MqttAppConstants.STOP_RESPONSE, request_id)
+        elif received_value == MqttAppConstants.COMMAND_SYNC:
+            self.publish_sync_answer(self.topic_for_hearing_from_sensor, request_id, received_ns or time.time_ns())
 
     def on_message_for_sensor(self, client, userdata, message):
-        super().on_message_for_mode
-        self.interact_with_received_command(message)
-
+        received_ns = time.time_ns() # t2 of the clock synchronization, taken first
+        # The commands are handled here, not by Mode.on_message_for_mode (no receive pipeline): counted here too
+        self.messages_received += 1
+        self.interact_with_received_command(message, received_ns)
 
-    def publish_random_value(self, topic):
-        while True:
-            if self.allow_to_publish:
-                value = random.randint(1, 100)
-                self.publish_value(topic, value)
-            time.sleep(self.time_sleep_beetween_two_values)
-
-
-    def publish_ordered_value(self, topic):
-        value = 1
-        while True:
-            if self.allow_to_publish:
-                self.publish_value(topic, value)
-                value += 1
-            time.sleep(self.time_sleep_beetween_two_values)
@@ -1,19 +1,72 @@
+import time
+from clockSync import ClockSync
 from constants import MqttAppConstants
+from dashboard import LiveDashboard
+from topicStats import TopicStatsTable
 from mode.mode import Mode
 
 class ServerMode(Mode):
-    
-    def run(self):
-        self.mqtt_service.subscribe_topic(self.topic_for_hearing_from_sensor) # As the servor, I want to listen to my sensor, sub here
-        print("Server mode activated.")
-        self.mqtt_service.client.loop_start()
 
+    LOCAL_COMMANDS = ("stats",) # handled by the server itself, nothing is sent
+
+    def __init__(self, mqtt_service, sync_interval=ClockSync.DEFAULT_INTERVAL_S, topic_stats=True, dashboard=False, **mode_options):
+        # mode_options: see Mode.__init__
+        # sync_interval: seconds between two clock synchronizations with the sensor, 0 = none (same machine)
+        # topic_stats: running statistics per topic (see topicStats.py), shown live by the dashboard (see dashboard.py)
+        super().__init__(mqtt_service, **mode_options)
+        if sync_interval:
+            self.clock_sync = ClockSync(self.send_sync_request, sync_interval)
+        if topic_stats or dashboard:
+            self.topic_stats = TopicStatsTable(self.clock_sync)
+        self.dashboard = LiveDashboard(self.topic_stats, "Server {}".format(self.topic_for_hearing_from_sensor)) if dashboard else None
+
+    def run(self):
+        self.listen()
+        if self.dashboard is not None:
+            self.dashboard.run(self.send_command)
+        commands = MqttAppConstants.get_commands() + list(ServerMode.LOCAL_COMMANDS)
         while True:
-            command = input("Enter command among: {}\n".format(MqttAppConstants.get_commands())).strip().lower()
-            if command in MqttAppConstants.get_commands():
+            command = input("Enter command among: {}\n".format(commands)).strip().lower()
+            if command == "stats" and self.topic_stats is not None:
+                print("\n".join(TopicStatsTable.format_rows(self.topic_stats.get_rows())))
+            elif command in MqttAppConstants.get_commands():
                 self.publish_message_according_to_mode(self.topic_for_hearing_from_server, command) # speak on the another one, always send commands
             else:
                 print("Invalid command.")
 
+    def listen(self):
+        self.mqtt_service.subscribe_topic(self.topic_for_hearing_from_sensor, self.qos) # As the servor, I want to listen to my sensor, sub here
+        print("Server mode activated.")
+        self.mqtt_service.client.loop_start()
+        if self.clock_sync is not None:
+            self.clock_sync.start()
+
+    def send_command(self, command):
+        # Without the prompt (bench mode)
+        self.publish_message_according_to_mode(self.topic_for_hearing_from_server, command)
+
+    def send_sync_request(self, request_id):
+        # Background clock synchronization (see clockSync.py): not recorded, not printed
+        message = {MqttAppConstants.MSG_TIMESTAMP: time.time_ns() // 1000, MqttAppConstants.MSG_CMD: MqttAppConstants.COMMAND_SYNC,
+                   MqttAppConstants.MSG_ID: request_id}
+        self.mqtt_service.client.publish(self.topic_for_hearing_from_server, self.codec.encode(message), self.qos)
+
     def publish_message_according_to_mode(self, topic, command):
         self.publish_message(topic, MqttAppConstants.MSG_CMD, command)
+
+    def close(self):
+        if self.clock_sync is not None:
+            self.clock_sync.stop()
+        if self.dashboard is not None:
+            self.dashboard.close()
+        super().close()
+        rows = self.topic_stats.get_rows() if self.topic_stats is not None else None
+        if rows:
+            print("\n".join(TopicStatsTable.format_rows(rows)))
+            if self.writer is not None:
+                print("Topic statistics saved in {}".format(self.topic_stats.save(TopicStatsTable.get_file_path(self.writer.path))))
+        if self.clock_sync is not None:
+            print("Clock: {}".format(self.clock_sync.describe()))
+            # Next to the streamed results, so that the report mode applies the same correction
+            if self.writer is not None and self.clock_sync.samples:
+                print("Clock synchronization saved in {}".format(self.clock_sync.save(ClockSync.get_file_path(self.writer.path))))
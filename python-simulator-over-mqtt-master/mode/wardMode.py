@@ -0,0 +1,214 @@
+import csv
+import datetime
+import fnmatch
+import os
+import sys
+import threading
+import time
+from constants import MqttAppConstants
+from consoleEcho import ReadableTime
+from messageCodec import MessageCodec
+from recordStore import RecordStore
+from resultReporter import ResultReporter
+from sequenceTracker import SequenceTracker
+from mode.mode import Mode
+
+# Ward mode: ONE server process, ONE connection, for a whole ward of sensors.
+# The server subscribes with an MQTT wildcard ("+" gives "+/sensor", "ward1/+" gives "ward1/+/sensor") and discovers the
+# sensors from the messages it receives. Each sensor gets a SensorState in a dict keyed by its interned topic:
+# sequence tracking (lost / late / duplicated values, see sequenceTracker.py), statistics and a bounded record buffer (ring buffer, see recordStore.py).
+# Commands are either broadcast (MqttAppConstants.get_broadcast_topic() of the pattern, "ward1/broadcast/server" for
+# "ward1/+": every sensor under the pattern listens to it) or sent to the known sensors whose topic matches one of the
+# given patterns:
+#   ping                    -> all the sensors (the answers make the silent sensors known)
+#   start ward1/bed*        -> the known sensors matching ward1/bed*
+#   stats                   -> table of the known sensors
+
+class SensorState:
+    # Everything the ward server knows about one sensor. __slots__: thousands of them are kept in memory.
+    __slots__ = ("topic", "command_topic", "records", "lock", "values", "sequence", "first_ns", "last_ns",
+                 "transit_sum_ns", "transit_count", "last_answer")
+
+    def __init__(self, topic, records_per_sensor):
+        self.topic = topic # base topic of the sensor ("ward1/bed3")
+        self.command_topic = sys.intern(MqttAppConstants.get_full_topic_name(topic, MqttAppConstants.HEARING_FROM_SERVER))
+        self.records = RecordStore(max_records=records_per_sensor)
+        # Several receive workers can process messages of the same sensor
+        self.lock = threading.Lock()
+        self.values = 0
+        self.sequence = SequenceTracker()
+        self.first_ns = None
+        self.last_ns = None
+        # Sender timestamp -> reception: only meaningful when the clocks of both machines are synchronized
+        self.transit_sum_ns = 0
+        self.transit_count = 0
+        self.last_answer = None
+
+    def record(self, timestamp_ns, message):
+        if self.first_ns is None:
+            self.first_ns = timestamp_ns
+        self.last_ns = timestamp_ns
+        seq = message.get(MqttAppConstants.MSG_SEQ, -1)
+        if MqttAppConstants.MSG_VALUES in message:
+            values = message[MqttAppConstants.MSG_VALUES]
+        elif MqttAppConstants.MSG_VALUE in message:
+            values = (message[MqttAppConstants.MSG_VALUE],)
+        else:
+            self.last_answer = message.get(MqttAppConstants.MSG_ANS)
+            if self.last_answer is not None:
+                self.records.append(timestamp_ns, self.last_answer)
+            return
+        for index, value in enumerate(values):
+            self.records.append(timestamp_ns, value, seq + index if seq >= 0 else -1)
+        self.values += len(values)
+        self.transit_sum_ns += timestamp_ns - message[MqttAppConstants.MSG_TIMESTAMP] * 1000
+        self.transit_count += 1
+        if seq >= 0:
+            self.sequence.track(seq, len(values))
+
+    def get_stats(self):
+        duration_s = (self.last_ns - self.first_ns) / 1e9 if self.first_ns is not None else 0
+        return {
+            "sensor": self.topic,
+            "values": self.values,
+            "lost": self.sequence.lost,
+            "late": self.sequence.late,
+            "duplicates": self.sequence.duplicates,
+            "rate_per_s": self.values / duration_s if duration_s else None,
+            "mean_transit_ms": self.transit_sum_ns / self.transit_count / 1e6 if self.transit_count else None,
+            "last_seen_s": (time.time_ns() - self.last_ns) / 1e9 if self.last_ns is not None else None,
+            "last_answer": self.last_answer,
+        }
+
+
+class WardMode(Mode):
+
+    DEFAULT_RECORDS_PER_SENSOR = 1000 # ring buffer of each sensor, 25 bytes per record
+    LOCAL_COMMANDS = ("stats",)      # handled by the server itself, nothing is sent
+
+    def __init__(self, mqtt_service, topic=None, records_per_sensor=DEFAULT_RECORDS_PER_SENSOR, **mode_options):
+        # mode_options: see Mode.__init__. topic is a pattern here: "+" or "ward1/+" (the "/sensor" part is added)
+        if topic is None:
+            topic = input("Enter the topic pattern of the sensors (ex: + or ward1/+): \n")
+        super().__init__(mqtt_service, topic=topic, **mode_options)
+        self.broadcast_topic = MqttAppConstants.get_broadcast_topic(topic)
+        self.records_per_sensor = records_per_sensor
+        # received topic ("ward1/bed3/sensor", interned) -> SensorState
+        self.sensors = {}
+        self.sensors_lock = threading.Lock()
+        self.suffix_length = len(MqttAppConstants.HEARING_FROM_SENSOR)
+
+    def run(self):
+        self.listen()
+        commands = MqttAppConstants.get_commands() + list(WardMode.LOCAL_COMMANDS)
+        while True:
+            words = input("Enter command among: {} [sensor pattern ...]\n".format(commands)).split()
+            if not words or words[0].lower() not in commands:
+                print("Invalid command.")
+            elif words[0].lower() == "stats":
+                self.print_stats(words[1:])
+            else:
+                self.send_command(words[0].lower(), words[1:])
+
+    def listen(self):
+        self.mqtt_service.subscribe_topic(self.topic_for_hearing_from_sensor, self.qos) # one wildcard subscription for all the sensors
+        print("Ward mode activated.")
+        self.mqtt_service.client.loop_start()
+
+    def register_metrics(self, metrics):
+        super().register_metrics(metrics)
+        metrics.gauge("sensors", "sensors known by the ward server", lambda: len(self.sensors))
+
+    # ---------------------------------------------------- RECEPTION ----------------------------------------------------
+
+    def process_received_message(self, timestamp_ns, payload, topic=None):
+        # paho builds a new topic string for each message: the interned copy is found by identity in the dict
+        topic = sys.intern(topic)
+        state = self.sensors.get(topic)
+        if state is None:
+            state = self.add_sensor(topic)
+        message = MessageCodec.decode(payload)
+        with state.lock:
+            state.record(timestamp_ns, message)
+        if self.transit_histogram is not None:
+            self.record_transit(timestamp_ns, message)
+        # Answers too are rate limited: a broadcast ping is answered by every sensor (see "stats" for the last answers)
+        if MqttAppConstants.MSG_ANS in message:
+            self.echo.show("[{}] answered {} at {}", state.topic, message[MqttAppConstants.MSG_ANS], ReadableTime(timestamp_ns))
+        else:
+            self.echo.show("[{}] received: {} at {}", state.topic, message, ReadableTime(timestamp_ns))
+
+    def add_sensor(self, topic):
+        with self.sensors_lock:
+            # Another worker may have added it in the meantime
+            state = self.sensors.get(topic)
+            if state is None:
+                state = SensorState(sys.intern(topic[:-self.suffix_length]), self.records_per_sensor)
+                self.sensors[topic] = state
+                self.echo.show("New sensor {} ({} sensors)", state.topic, len(self.sensors))
+        return state
+
+    # ---------------------------------------------------- COMMANDS ----------------------------------------------------
+
+    def select_sensors(self, patterns):
+        # Known sensors whose base topic matches one of the patterns (fnmatch: *, ?, [...])
+        states = list(self.sensors.values())
+        return [state for state in states if any(fnmatch.fnmatchcase(state.topic, pattern) for pattern in patterns)]
+
+    def send_command(self, command, patterns=()):
+        # No pattern: one message on the broadcast topic, whatever the number of sensors
+        # The message is encoded once and published as is to every selected sensor
+        message = self.codec.encode({MqttAppConstants.MSG_TIMESTAMP: time.time_ns() // 1000, MqttAppConstants.MSG_CMD: command})
+        if not patterns:
+            self.mqtt_service.client.publish(self.broadcast_topic, message, self.qos)
+            print(">>>>[{}]: sending {} to all the sensors".format(self.broadcast_topic, command))
+            return
+        selected = self.select_sensors(patterns)
+        for state in selected:
+            self.mqtt_service.client.publish(state.command_topic, message, self.qos)
+        print(">>>>sending {} to {} of {} known sensors".format(command, len(selected), len(self.sensors)))
+
+    # ---------------------------------------------------- STATS ----------------------------------------------------
+
+    def get_stats(self, patterns=()):
+        states = self.select_sensors(patterns) if patterns else list(self.sensors.values())
+        stats = []
+        for state in states:
+            with state.lock:
+                stats.append(state.get_stats())
+        return sorted(stats, key=lambda row: row["sensor"])
+
+    def print_stats(self, patterns=()):
+        stats = self.get_stats(patterns)
+        print("{:<30}{:>10}{:>8}{:>8}{:>8}{:>10}{:>12}{:>11}  {}".format("sensor", "values", "lost", "late", "dup", "rate/s",
+                                                                        "transit ms", "last seen", "last answer"))
+        for row in stats:
+            print("{:<30}{:>10}{:>8}{:>8}{:>8}{:>10}{:>12}{:>11}  {}".format(
+                row["sensor"], row["values"], row["lost"], row["late"], row["duplicates"],
+                "-" if row["rate_per_s"] is None else "{:.1f}".format(row["rate_per_s"]),
+                "-" if row["mean_transit_ms"] is None else "{:.3f}".format(row["mean_transit_ms"]),
+                "-" if row["last_seen_s"] is None else "{:.1f} s".format(row["last_seen_s"]),
+                row["last_answer"] or "-"))
+        print("{} sensors, {} values, {} lost, {} late, {} duplicates".format(
+            len(stats), sum(row["values"] for row in stats), sum(row["lost"] for row in stats),
+            sum(row["late"] for row in stats), sum(row["duplicates"] for row in stats)))
+
+    def save_stats(self):
+        # results/ward-<date>.csv, one row per sensor
+        stats = self.get_stats()
+        if not stats:
+            return None
+        os.makedirs(ResultReporter.results_folder, exist_ok=True)
+        path = os.path.join(ResultReporter.results_folder, "ward-{}.csv".format(datetime.datetime.now().strftime("%Y%m%d-%H%M%S")))
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(stats[0]))
+            writer.writeheader()
+            writer.writerows(stats)
+        print("Statistics of {} sensors saved in {}".format(len(stats), path))
+        return path
+
+    def close(self):
+        super().close()
+        self.save_stats()
+        for state in self.sensors.values():
+            state.records.close()
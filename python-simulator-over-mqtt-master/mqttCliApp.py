@@ -1,11 +1,29 @@
+import argparse
 import sys
 from brokerInformator import BrokerInformator
 from resultReporter import ResultReporter
+from latencyReport import LatencyReport
+from metrics import MetricsRegistry
+from profiler import HotPathProfiler, PhaseTimers
+from clockSync import ClockSync
 from mqttConnector import MqttConnector
 from constants import MqttAppConstants
+from consoleEcho import ConsoleEcho
+from recordStore import RecordStore
+from receivePipeline import ReceivePipeline
+from resultWriter import StreamingResultWriter
+from publishWindow import PublishWindow
+from offlineBuffer import OfflineBuffer
+from loadProfile import LoadProfile
+from rateScheduler import RateScheduler
 from mode.sensorMode import SensorMode
 from mode.serverMode import ServerMode
 from mode.clientMode import WebClientModeOverHivemq
+from mode.fleetMode import FleetMode
+from mode.benchMode import BenchMode
+from mode.wardMode import WardMode
+from mode.pingMode import PingMode
+from mode.replayMode import ReplayMode
 
 class MqttCliApp:
 
@@ -16,8 +34,14 @@ class MqttCliApp:
               1) Simuler un capteur
               2) Simuler un serveur
               3) Simuler les deux
-              4) Dans une moindre mesure simuler un client sur websockets over mqtt""")
-        print("\n===> Utilisation dans le terminal: ./run_mqttCliApp.sh [mode] [broker] <===")
+              4) Dans une moindre mesure simuler un client sur websockets over mqtt
+              5) Simuler une flotte de capteurs (test de charge)
+              6) Générer le rapport Excel à partir des résultats enregistrés (mode report)
+              7) Comparer des brokers sans interaction (mode bench)
+              8) Simuler un serveur pour toute une salle de capteurs (mode ward)
+              9) Mesurer le temps aller-retour des commandes (mode ping)
+              10) Rejouer des enregistrements de capteurs réels (mode replay)""")
+        print("\n===> Utilisation dans le terminal: ./run_mqttCliApp.sh [mode] [broker] [options] <===")
         print("|=> [mode]: {}".format(MqttAppConstants.get_modes()))
         print("|=> [broker]: {}".format(MqttAppConstants.get_brokers()))
 
@@ -31,6 +55,145 @@ class MqttCliApp:
         specified_broker = sys.argv[2]
         return mode, specified_broker
 
+    @staticmethod
+    # Get the optional arguments given after the mode and the broker (only used by some modes, e.g. fleet)
+    def get_extra_arguments():
+        return sys.argv[3:]
+
+    @staticmethod
+    # Parse the options shared by the sensor, server and client modes (the fleet mode has its own options)
+    def get_options(mode):
+        parser = argparse.ArgumentParser(prog="mqttCliApp.py {} [broker]".format(mode))
+        parser.add_argument("--codec", choices=MqttAppConstants.get_codecs(), default=MqttAppConstants.CODEC_JSON,
+                            help="codec used to send messages (received messages are decoded whatever their codec)")
+        parser.add_argument("--echo", default=ConsoleEcho.DEFAULT,
+                            help="printed value lines: 'all', 'none' or a maximum number of lines per second (default %(default)s)")
+        parser.add_argument("--max-records", type=int,
+                            help="only keep the last N records in memory (ring buffer), per sensor in ward mode (default {})".format(WardMode.DEFAULT_RECORDS_PER_SENSOR))
+        parser.add_argument("--spill-chunk", type=int,
+                            help="write the records to disk every N records instead of keeping them in memory")
+        parser.add_argument("--no-stream", action="store_true",
+                            help="do not save the records in results/ during the run")
+        parser.add_argument("--receive-queue", type=int, default=ReceivePipeline.DEFAULT_SIZE,
+                            help="received messages waiting to be processed, beyond that they are dropped (default %(default)s)")
+        parser.add_argument("--signal",
+                            help="sensor: published values, {} with options (ex: ecg:heart_rate=80,amplitude=1000,dtype=int16), see signalGenerator.py".format(MqttAppConstants.get_signals()))
+        parser.add_argument("--dashboard", action="store_true",
+                            help="server: live statistics per topic refreshed in the terminal, keys instead of the command prompt (see dashboard.py)")
+        parser.add_argument("--sync-interval", type=float, default=ClockSync.DEFAULT_INTERVAL_S,
+                            help="server: seconds between two clock synchronizations with the sensor, 0 = none (default %(default)s)")
+        parser.add_argument("--receive-workers", type=int, default=ReceivePipeline.DEFAULT_WORKERS,
+                            help="threads processing the received messages, 0 = in the MQTT network thread (default %(default)s)")
+        parser.add_argument("--qos", type=int, choices=(0, 1, 2), default=0, help="QoS of the publications and subscriptions (default %(default)s)")
+        parser.add_argument("--max-inflight", type=int,
+                            help="paho's QoS 1/2 messages not acknowledged yet, 0 = no limit (default: {})".format(PublishWindow.DEFAULT_MAX_INFLIGHT))
+        parser.add_argument("--window", type=int, default=PublishWindow.DEFAULT_SIZE,
+                            help="sensor: values in flight at most (handed to paho, not sent/acknowledged yet), 0 = no bound (default %(default)s)")
+        parser.add_argument("--window-policy", choices=PublishWindow.get_policies(), default=PublishWindow.BLOCK,
+                            help="sensor: what to do with a value when the window is full (default %(default)s), see publishWindow.py")
+        parser.add_argument("--late-policy", choices=RateScheduler.get_policies(), default=RateScheduler.CATCH_UP,
+                            help="sensor: values due while the publisher is late, sent in a burst or skipped (default %(default)s), see rateScheduler.py")
+        parser.add_argument("--load-profile",
+                            help="sensor: rate changing over time, ex: 'ramp:from=10,to=1000,duration=60;soak:rate=500,duration=600' or a JSON file, see loadProfile.py")
+        parser.add_argument("--offline-buffer", type=int, default=0,
+                            help="sensor: value messages kept in memory while the broker is unreachable, 0 = lost (default %(default)s), "
+                                 "ex: {}".format(OfflineBuffer.DEFAULT_CAPACITY))
+        parser.add_argument("--offline-spill", type=int, default=0,
+                            help="sensor: value messages written to disk once the offline buffer is full (default %(default)s)")
+        parser.add_argument("--catch-up-rate", type=float, default=OfflineBuffer.DEFAULT_CATCH_UP_RATE,
+                            help="sensor: buffered messages published per second at most after a reconnection (default %(default)s)")
+        parser.add_argument("--metrics-port", type=int,
+                            help="serve live metrics in the Prometheus text format on http://127.0.0.1:PORT/metrics (see metrics.py)")
+        parser.add_argument("--metrics-interval", type=float, default=0,
+                            help="print a one-line metrics summary every N seconds, 0 = never (default %(default)s)")
+        parser.add_argument("--profile", choices=(HotPathProfiler.CPROFILE, HotPathProfiler.SAMPLING),
+                            help="profile the publish and receive hot paths, reports saved next to the results (see profiler.py)")
+        parser.add_argument("--profile-memory", action="store_true", help="also trace the memory allocated during the profiling window")
+        parser.add_argument("--profile-start", type=float, default=0, help="seconds before the profiling window opens (default %(default)s)")
+        parser.add_argument("--profile-duration", type=float, help="seconds of profiling (default: until the end of the run)")
+        parser.add_argument("--profile-interval", type=float, default=HotPathProfiler.DEFAULT_INTERVAL_MS,
+                            help="sampling profiler: milliseconds between two samples (default %(default)s)")
+        parser.add_argument("--phase-timers", action="store_true",
+                            help="time the serialize, publish, record, deliver and process phases of the hot paths")
+        return parser.parse_args(MqttCliApp.get_extra_arguments())
+
+    @staticmethod
+    # Profiling hooks of the hot paths (see profiler.py), (None, None) when not asked for
+    def start_profiling(mode, specified_broker, options, user_mode):
+        profiler, timers = None, None
+        if options.profile or options.profile_memory or options.phase_timers:
+            # Next to the results: results/<broker>-<mode>-<date>-cprofile.txt ...
+            path = user_mode.writer.path if user_mode.writer is not None else \
+                StreamingResultWriter.build_path(ResultReporter.results_folder, specified_broker, mode)
+            prefix = path[:-len(".csv")]
+        if options.profile or options.profile_memory:
+            profiler = HotPathProfiler(options.profile, prefix, options.profile_start, options.profile_duration,
+                                       options.profile_memory, options.profile_interval)
+            profiler.attach(user_mode)
+            profiler.start()
+        if options.phase_timers:
+            timers = PhaseTimers(prefix)
+            timers.attach(user_mode)
+        return profiler, timers
+
+    @staticmethod
+    # Offline buffer of the sensor (see offlineBuffer.py), None when disabled
+    def build_offline_buffer(options):
+        if not options.offline_buffer:
+            return None
+        return OfflineBuffer(options.offline_buffer, options.offline_spill, ResultReporter.results_folder, options.catch_up_rate)
+
+    @staticmethod
+    # Live metrics of the mode, None when neither the endpoint nor the summary line is asked for
+    def start_metrics(mode, specified_broker, options, user_mode):
+        if options.metrics_port is None and not options.metrics_interval:
+            return None
+        metrics = MetricsRegistry({"mode": mode, "broker": specified_broker})
+        user_mode.register_metrics(metrics)
+        if options.metrics_port is not None:
+            metrics.start_http_server(options.metrics_port)
+        if options.metrics_interval:
+            metrics.start_summary(options.metrics_interval)
+        return metrics
+
+    @staticmethod
+    # Options given to the constructor of the modes (see Mode.__init__)
+    def get_mode_options(mode, specified_broker, options):
+        writer = None
+        # The ward mode keeps its records per sensor and saves per sensor statistics (see mode/wardMode.py)
+        if not options.no_stream and mode != MqttAppConstants.MODE_WARD:
+            writer = StreamingResultWriter(StreamingResultWriter.build_path(ResultReporter.results_folder, specified_broker, mode))
+        return {
+            "codec_name": options.codec,
+            "echo": options.echo,
+            "records": RecordStore(max_records=options.max_records, spill_chunk=options.spill_chunk, spill_dir=ResultReporter.results_folder),
+            "writer": writer,
+            "receive_queue": options.receive_queue,
+            "receive_workers": options.receive_workers,
+            "qos": options.qos,
+            "max_inflight": options.max_inflight,
+        }
+
+    @staticmethod
+    # Report mode: ./mqttCliApp.py report [broker] [--sensor-file file] [--server-file file] [--window s] [--xlsx] [--plot]
+    #         or: ./mqttCliApp.py report [broker] --merge report.json report.json...
+    def generate_report(specified_broker):
+        parser = argparse.ArgumentParser(prog="mqttCliApp.py report [broker]")
+        parser.add_argument("--sensor-file", help="results file of the sensor (default: the latest one of the broker)")
+        parser.add_argument("--server-file", help="results file of the server (default: the latest one of the broker)")
+        parser.add_argument("--window", type=float, default=LatencyReport.DEFAULT_WINDOW_S,
+                            help="duration of the time windows of the report, in seconds (default %(default)s)")
+        parser.add_argument("--xlsx", action="store_true", help="also build the Excel file (small runs)")
+        parser.add_argument("--plot", action="store_true", help="also draw the latencies in a PNG file (needs matplotlib)")
+        parser.add_argument("--merge", nargs="+", metavar="REPORT",
+                            help="merge latency reports (JSON) of several runs or sensors instead")
+        options = parser.parse_args(MqttCliApp.get_extra_arguments())
+        if options.merge:
+            ResultReporter.merge_latency_reports(options.merge)
+            return
+        ResultReporter.generate_report_from_files(specified_broker, options.sensor_file, options.server_file,
+                                                  options.window, options.xlsx, options.plot)
+
     @staticmethod
     # Set up the MQTT service based on the specified broker.
     def setup_mqtt_service(specified_broker):
@@ -42,33 +205,93 @@ class MqttCliApp:
     @staticmethod
     def start():
         # Main method to start the application.
+        mqtt_service = None
+        current_user_mode = None
+        metrics = None
+        profiler, timers = None, None
         try:
             mode, specified_broker = MqttCliApp.get_user_mode_and_broker()
+            if mode not in MqttAppConstants.get_modes():
+                print("Invalid mode. Please use a mode in {}.".format(MqttAppConstants.get_modes()))
+                sys.exit(1)
+
+            if mode == MqttAppConstants.MODE_FLEET:
+                # The fleet opens one connection per virtual sensor, it does not use the shared mqtt_service
+                current_user_mode = FleetMode(BrokerInformator.get_broker(specified_broker), MqttCliApp.get_extra_arguments())
+                current_user_mode.run()
+                return
+
+            if mode == MqttAppConstants.MODE_BENCH:
+                # Several brokers can be compared: "local,mosquitto"
+                BenchMode(specified_broker.split(","), MqttCliApp.get_extra_arguments()).run()
+                return
+
+            if mode == MqttAppConstants.MODE_PING:
+                # Headless: the pinged sensors are given as options
+                PingMode(BrokerInformator.get_broker(specified_broker), MqttCliApp.get_extra_arguments()).run()
+                return
+
+            if mode == MqttAppConstants.MODE_REPLAY:
+                # One connection per replayed sensor, the recording and the sensors are given as options
+                ReplayMode(specified_broker, MqttCliApp.get_extra_arguments()).run()
+                return
+
+            if mode == MqttAppConstants.MODE_REPORT:
+                MqttCliApp.generate_report(specified_broker)
+                return
+
+            options = MqttCliApp.get_options(mode)
+            mode_options = MqttCliApp.get_mode_options(mode, specified_broker, options)
             mqtt_service = MqttCliApp.setup_mqtt_service(specified_broker)
-            current_user_mode = None
 
             # Determine the mode and start the corresponding simulation.
 
             if mode == MqttAppConstants.MODE_SENSOR:
-                current_user_mode = SensorMode(mqtt_service)
-                current_user_mode.run()
+                current_user_mode = SensorMode(mqtt_service, signal=options.signal, window=options.window,
+                                               window_policy=options.window_policy, late_policy=options.late_policy,
+                                               offline_buffer=MqttCliApp.build_offline_buffer(options),
+                                               load_profile=LoadProfile.from_spec(options.load_profile) if options.load_profile else None,
+                                               **mode_options)
             elif mode == MqttAppConstants.MODE_SERVER:
-                current_user_mode = ServerMode(mqtt_service)
-                current_user_mode.run()
+                if options.dashboard:
+                    mode_options["echo"] = ConsoleEcho.NONE # the dashboard replaces the echo of the values
+                current_user_mode = ServerMode(mqtt_service, sync_interval=options.sync_interval, dashboard=options.dashboard,
+                                               **mode_options)
+            elif mode == MqttAppConstants.MODE_WARD:
+                mode_options.pop("records")
+                current_user_mode = WardMode(mqtt_service, records_per_sensor=options.max_records or WardMode.DEFAULT_RECORDS_PER_SENSOR,
+                                             **mode_options)
             elif mode == MqttAppConstants.MODE_WSS_CLIENT_OVER_MQTT:
                 # This mode is mainly to test if connection to the broker over WebSockets is fine.
-                current_user_mode = WebClientModeOverHivemq(mqtt_service)
-                current_user_mode.run()
+                current_user_mode = WebClientModeOverHivemq(mqtt_service, **mode_options)
             else:
                 print("Invalid mode. Please use a mode in {}.".format(MqttAppConstants.get_modes()))
                 sys.exit(1)
+            metrics = MqttCliApp.start_metrics(mode, specified_broker, options, current_user_mode)
+            profiler, timers = MqttCliApp.start_profiling(mode, specified_broker, options, current_user_mode)
+            current_user_mode.run()
 
         except KeyboardInterrupt:
-            # Handle keyboard interruption and offer to save results.
-            save = input("Do you want to save: (y/n) ")
-            if save == "y" and current_user_mode:
-                ResultReporter.generate_excel(specified_broker, mode, current_user_mode.get_all_times_values_interactions())
+            if mqtt_service is None:
+                # Fleet mode: the connections are closed by the fleet itself, nothing to save
+                print('Interrupted')
+                return
+            # Handle keyboard interruption: the records are already streamed to results/ (unless --no-stream), the Excel
+            # file is optional (it can also be built later with the report mode).
             mqtt_service.disconnect_broker()
+            if metrics is not None:
+                print(metrics.summary_line())
+                metrics.close()
+            if profiler is not None:
+                profiler.stop()
+            if timers is not None:
+                print(timers.describe())
+                print("Phase timers saved in {}".format(timers.save()))
+            if current_user_mode:
+                if mode != MqttAppConstants.MODE_WARD and sys.stdin.isatty() and input("Do you want to save in the Excel file: (y/n) ") == "y":
+                    ResultReporter.generate_excel(specified_broker, mode, current_user_mode.get_all_times_values_interactions(),
+                                                  current_user_mode.clock_sync)
+                current_user_mode.close()
             print('Interrupted')
 
 if __name__ == "__main__":
@@ -1,21 +1,44 @@
 import paho.mqtt.client as mqtt
 import random
 import ssl
+import threading
+import time
 from brokerInformator import BrokerInformator
+from embeddedBroker import EmbeddedBroker
 from datetime import datetime
 import certifi
 
 ssl.create_default_context(cafile=certifi.where())
 
+# MqttConnector survives broker blips: once connected, paho's network thread (loop_start) reconnects by itself after an
+# unexpected disconnection, waiting between two attempts a delay drawn at random in [0, min(RECONNECT_MAX_S,
+# RECONNECT_BASE_S * 2^attempt)] (exponential backoff with full jitter: a ward of sensors cut at once does not come back
+# at once). The subscriptions are replayed on every reconnection, the time each outage took to recover is measured
+# (see describe_availability). The first connection is retried the same way, CONNECT_ATTEMPTS times.
 class MqttConnector:
 
-    def __init__(self, broker_info):
+    RECONNECT_BASE_S = 0.5
+    RECONNECT_MAX_S = 30.0
+    CONNECT_ATTEMPTS = 5
+
+    def __init__(self, broker_info, client_id=None):
         # Gather All broker information from BrokerInformator
         self.broker_address = BrokerInformator.get_url(broker_info)
         self.port = BrokerInformator.get_port(broker_info)
         self.username = BrokerInformator.get_username(broker_info)
         self.password = BrokerInformator.get_password(broker_info)
-        self.client_id = "python-client-{}".format(random.randint(1, 10**10))
+        self.embedded_broker_options = BrokerInformator.get_embedded(broker_info)
+        # A client id can be imposed (e.g. fleet mode, where each virtual sensor needs a stable and unique id)
+        self.client_id = client_id or "python-client-{}".format(random.randint(1, 10**10))
+        self.connections = 0 # successful connections, the first one included (see get_reconnects)
+        self.subscriptions = {} # topic -> qos, subscribed again after a reconnection
+        self.online = threading.Event() # set while connected
+        self.stopping = threading.Event() # set by disconnect_broker: no more reconnection
+        self.reconnect_attempt = 0
+        # Availability: time of the first connection, start of the current outage, duration of the recovered outages
+        self.first_connected_at = None
+        self.disconnected_at = None
+        self.outages = []
 
         # Check if the connection should be over WebSockets        
         if BrokerInformator.get_ws(broker_info):
@@ -27,6 +50,8 @@ class MqttConnector:
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
+        # paho's own wait between two reconnection attempts doubles the delay without jitter, see schedule_reconnect
+        self.client.on_connect_fail = self.on_connect_fail
 
         # Set username and password if provided
         if self.username and self.password:
@@ -44,13 +69,38 @@ class MqttConnector:
     def on_connect(self, client, userdata, flags, rc):
         # Tell you if you are connected or not
         if rc == 0:
-            print("Connected to MQTT Broker at {}! ".format(self.broker_address))
+            self.connections += 1
+            self.reconnect_attempt = 0
+            if self.first_connected_at is None:
+                self.first_connected_at = time.monotonic()
+            if self.disconnected_at is not None:
+                self.outages.append(time.monotonic() - self.disconnected_at)
+                self.disconnected_at = None
+                print("Reconnected to MQTT Broker at {} after {:.2f} s".format(self.broker_address, self.outages[-1]))
+            else:
+                print("Connected to MQTT Broker at {}! ".format(self.broker_address))
+            if self.connections > 1:
+                # The broker forgot the subscriptions of the lost session (clean session)
+                for topic, qos in self.subscriptions.items():
+                    self.client.subscribe(topic, qos)
+            self.online.set()
         else:
-            print("Failed to connect, return code %d\n", rc)
+            print("Failed to connect, return code {}".format(rc))
 
     def on_disconnect(self, client, userdata, rc):
-        # Tell you when you are disconnected
-        print("Disconnected from MQTT Broker")
+        # Tell you when you are disconnected (rc != 0: unexpected, paho's network thread reconnects)
+        self.online.clear()
+        if rc != 0 and not self.stopping.is_set():
+            if self.disconnected_at is None:
+                self.disconnected_at = time.monotonic()
+            print("Connection to MQTT Broker lost (rc {}), reconnecting".format(rc))
+            self.schedule_reconnect()
+        else:
+            print("Disconnected from MQTT Broker")
+
+    def on_connect_fail(self, client, userdata):
+        # A reconnection attempt of paho's network thread failed (broker still unreachable)
+        self.schedule_reconnect()
 
     def on_message(self, client, userdata, message):
         # A
@@ -62,18 +112,79 @@ class MqttConnector:
 
     # -------------------------------------------------- ALL MQTT METHODS --------------------------------------------------
     
+    def get_reconnects(self):
+        return max(0, self.connections - 1)
+
+    def is_connected(self):
+        return self.online.is_set()
+
+    def get_out_queue(self):
+        # Packets not written on the socket yet. paho keeps them in a private deque, _out_packet in the pinned paho-mqtt
+        # 1.6.1 (see requirements.txt): 0 rather than an error if another version renames it
+        return len(getattr(self.client, "_out_packet", ()))
+
+    def backoff_delay(self):
+        # Exponential backoff with full jitter, see the class comment
+        self.reconnect_attempt += 1
+        return random.uniform(0, min(MqttConnector.RECONNECT_MAX_S, MqttConnector.RECONNECT_BASE_S * 2 ** self.reconnect_attempt))
+
+    def schedule_reconnect(self):
+        # Called before each wait of paho's network thread (on_disconnect, on_connect_fail): paho waits min_delay before its
+        # next attempt, min_delay = max_delay = a new draw of the backoff, so that its own doubling never applies
+        if not self.stopping.is_set():
+            delay = self.backoff_delay()
+            self.client.reconnect_delay_set(delay, delay)
+
+    # Availability of the connection since the first connection: outages, time to recover
+    def get_availability(self):
+        if self.first_connected_at is None:
+            return None
+        current_outage = time.monotonic() - self.disconnected_at if self.disconnected_at is not None else 0.0
+        elapsed = time.monotonic() - self.first_connected_at
+        down = sum(self.outages) + current_outage
+        return {
+            "outages": len(self.outages) + (1 if self.disconnected_at is not None else 0),
+            "down_s": down,
+            "max_recover_s": max(self.outages, default=0.0),
+            "mean_recover_s": sum(self.outages) / len(self.outages) if self.outages else 0.0,
+            "availability": 1 - down / elapsed if elapsed > 0 else 1.0,
+        }
+
+    def describe_availability(self):
+        availability = self.get_availability()
+        if availability is None:
+            return "never connected to {}".format(self.broker_address)
+        return ("{outages} outage(s), down {down_s:.2f} s, time to recover mean {mean_recover_s:.2f} s max {max_recover_s:.2f} s, "
+                "availability {percent:.3f} %").format(percent=availability["availability"] * 100, **availability)
+
     # connect and disconnect
     def connect_broker(self):
-        self.client.connect(self.broker_address, self.port)
+        if self.embedded_broker_options is not None:
+            # The embedded broker is started by the first connection of the process (see embeddedBroker.py)
+            EmbeddedBroker.ensure_running(self.broker_address, self.port, **self.embedded_broker_options)
+        while True:
+            try:
+                self.client.connect(self.broker_address, self.port)
+                return
+            except OSError as error:
+                if self.reconnect_attempt + 1 >= MqttConnector.CONNECT_ATTEMPTS:
+                    raise
+                delay = self.backoff_delay()
+                print("Cannot connect to {}:{} ({}), new attempt in {:.1f} s".format(self.broker_address, self.port, error, delay))
+                time.sleep(delay)
 
     def disconnect_broker(self):
+        self.stopping.set()
         self.client.disconnect()
+        self.client.loop_stop() # no more callbacks after this point (no-op if loop_start() was not called)
 
     # subcribe and unsubscribe
-    def subscribe_topic(self, topic):
-        self.client.subscribe(topic)
+    def subscribe_topic(self, topic, qos=0):
+        self.subscriptions[topic] = qos
+        self.client.subscribe(topic, qos)
         print("Subscribed to topic:", topic)
 
     def unsubscribe_topic(self, topic):
+        self.subscriptions.pop(topic, None)
         self.client.unsubscribe(topic)
         print("Unsubscribed from topic:", topic)
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+# MqttEventLoopBridge plugs many paho clients into ONE asyncio event loop.
+# Instead of calling loop_start() (which spawns one network thread per client), paho tells us when its socket
+# opens/closes and when it has something to write; we register the socket on the event loop selector (epoll on Linux)
+# and call loop_read()/loop_write() only when the socket is ready. loop_misc() (keepalive) is called for every client
+# by a single shared task.
+# paho only reconnects by itself in loop_forever()/loop_start(): here the owner of a client that lost its connection asks
+# for a reconnection after its own backoff delay (schedule_reconnect), the blocking reconnect() runs in a thread.
+class MqttEventLoopBridge:
+
+    MISC_INTERVAL = 1 # seconds between two loop_misc() rounds (keepalive handling)
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.clients = set()
+        self.misc_task = None
+        self.reconnect_timers = {} # client -> TimerHandle of its next reconnection
+
+    def attach(self, client):
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+        self.clients.add(client)
+        if self.misc_task is None:
+            self.misc_task = self.loop.create_task(self.misc_loop())
+
+    def detach(self, client):
+        self.clients.discard(client)
+        timer = self.reconnect_timers.pop(client, None)
+        if timer is not None:
+            timer.cancel()
+
+    def call_in_loop(self, callback, *args):
+        # paho can call us from the thread that runs connect() (see FleetMode), selectors must only be touched
+        # from the event loop thread.
+        if threading.get_ident() == self.loop_thread_id:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    # ---------------------------------------------------- PAHO SOCKET EVENTS ----------------------------------------------------
+
+    def on_socket_open(self, client, userdata, sock):
+        self.call_in_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.call_in_loop(self.remove_socket, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.call_in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.call_in_loop(self.loop.remove_writer, sock)
+
+    def remove_socket(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    # ---------------------------------------------------- RECONNECTION ----------------------------------------------------
+
+    def schedule_reconnect(self, client, delay_s, on_failure):
+        # Calls client.reconnect() in delay_s seconds, on_failure(error) when the attempt fails (broker still unreachable).
+        # The new socket is registered by on_socket_open, on_connect tells the owner the connection is back.
+        self.call_in_loop(self.start_reconnect_timer, client, delay_s, on_failure)
+
+    def start_reconnect_timer(self, client, delay_s, on_failure):
+        if client not in self.clients:
+            return
+        previous = self.reconnect_timers.pop(client, None)
+        if previous is not None:
+            previous.cancel()
+        self.reconnect_timers[client] = self.loop.call_later(delay_s, self.reconnect, client, on_failure)
+
+    def reconnect(self, client, on_failure):
+        self.reconnect_timers.pop(client, None)
+        # TCP (and TLS) handshakes are blocking, as in FleetMode.connect_all
+        attempt = self.loop.run_in_executor(None, client.reconnect)
+        attempt.add_done_callback(lambda done: self.on_reconnect_done(client, done, on_failure))
+
+    def on_reconnect_done(self, client, done, on_failure):
+        if done.cancelled() or client not in self.clients:
+            return
+        error = done.exception()
+        if error is not None:
+            on_failure(error)
+
+    # ---------------------------------------------------- KEEPALIVE ----------------------------------------------------
+
+    async def misc_loop(self):
+        while True:
+            await asyncio.sleep(MqttEventLoopBridge.MISC_INTERVAL)
+            for client in list(self.clients):
+                # Returns MQTT_ERR_NO_CONN for clients that are not connected (yet), nothing to do for them here
+                client.loop_misc()
+
+    def stop(self):
+        for timer in self.reconnect_timers.values():
+            timer.cancel()
+        self.reconnect_timers.clear()
+        if self.misc_task is not None:
+            self.misc_task.cancel()
+            self.misc_task = None
@@ -0,0 +1,177 @@
+import collections
+import os
+import struct
+import tempfile
+import threading
+import time
+import paho.mqtt.client as mqtt
+from rateScheduler import RateScheduler
+
+# OfflineBuffer keeps the value messages produced while the connection to the broker is lost (see MqttConnector: paho
+# reconnects by itself, with backoff), instead of losing them (QoS 0) or letting paho queue them without bound (QoS 1
+# and 2). Once the connection is back, they are replayed by a background thread at a CAPPED catch-up rate, next to the
+# live values: a long outage is not dumped at once on a broker that just came back.
+#   - the first `capacity` messages stay in memory
+#   - the next ones are written to a spill file (at most spill_capacity of them, 0 = no spill file)
+#   - beyond that, the new messages are dropped and counted: the gap is at the END of the outage, the values kept are
+#     contiguous
+# The messages are already encoded, they carry their original timestamp and sequence number: the server records them
+# late (the report shows the outage as latency), not as lost values.
+class OfflineBuffer:
+
+    DEFAULT_CAPACITY = 10000
+    DEFAULT_CATCH_UP_RATE = 1000 # messages per second
+    CHECK_S = 0.1 # the catch-up thread checks the connection this often
+    RECORD_HEADER = struct.Struct("<HI") # spill file: topic length, payload length, then the topic and the payload
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, spill_capacity=0, spill_dir=None, catch_up_rate=DEFAULT_CATCH_UP_RATE):
+        if capacity <= 0 or catch_up_rate <= 0:
+            raise ValueError("The offline buffer capacity and catch-up rate must be positive")
+        self.capacity = capacity
+        self.spill_capacity = spill_capacity
+        self.spill_dir = spill_dir
+        self.catch_up_rate = catch_up_rate
+        self.memory = collections.deque()
+        self.spill_file = None # created on the first spilled message
+        self.spill_path = None
+        self.spill_read_offset = 0
+        self.spilled = 0 # messages in the spill file, not replayed yet
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.connector = None
+        self.qos = 0
+        # counters
+        self.buffered = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.catch_ups = 0
+        self.max_catch_up_s = 0.0
+
+    def __len__(self):
+        return len(self.memory) + self.spilled
+
+    # ---------------------------------------------------- PUBLISHER THREAD ----------------------------------------------------
+
+    def append(self, topic, payload):
+        with self.lock:
+            if not self.spilled and len(self.memory) < self.capacity:
+                self.memory.append((topic, payload))
+            elif self.spilled < self.spill_capacity:
+                # Once a message is spilled, the following ones are spilled too (the order is kept)
+                self.spill(topic, payload)
+            else:
+                self.dropped += 1
+                return
+            self.buffered += 1
+            depth = len(self.memory) + self.spilled
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    def spill(self, topic, payload):
+        if self.spill_file is None:
+            if self.spill_dir is not None:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            descriptor, self.spill_path = tempfile.mkstemp(prefix="offline-", suffix=".bin", dir=self.spill_dir)
+            self.spill_file = os.fdopen(descriptor, "w+b")
+        encoded_topic = topic.encode("utf-8")
+        self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(OfflineBuffer.RECORD_HEADER.pack(len(encoded_topic), len(payload)))
+        self.spill_file.write(encoded_topic)
+        self.spill_file.write(payload)
+        self.spilled += 1
+
+    # ---------------------------------------------------- CATCH-UP THREAD ----------------------------------------------------
+
+    def take(self):
+        # Oldest message, None when empty
+        with self.lock:
+            if self.memory:
+                return self.memory.popleft()
+            if not self.spilled:
+                return None
+            self.spill_file.seek(self.spill_read_offset)
+            topic_length, payload_length = OfflineBuffer.RECORD_HEADER.unpack(self.spill_file.read(OfflineBuffer.RECORD_HEADER.size))
+            topic = self.spill_file.read(topic_length).decode("utf-8")
+            payload = self.spill_file.read(payload_length)
+            self.spill_read_offset = self.spill_file.tell()
+            self.spilled -= 1
+            if not self.spilled:
+                # Everything was replayed: the file starts again from the beginning
+                self.spill_file.truncate(0)
+                self.spill_read_offset = 0
+            return topic, payload
+
+    def put_back(self, message):
+        # A message refused by paho (the connection was lost again) is replayed first next time
+        with self.lock:
+            self.memory.appendleft(message)
+
+    def attach(self, connector, qos=0):
+        # Starts the catch-up thread, which publishes through connector.client
+        self.connector = connector
+        self.qos = qos
+        self.thread = threading.Thread(target=self.run, name="offline-buffer", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(OfflineBuffer.CHECK_S):
+            if len(self) and self.connector.is_connected():
+                self.catch_up()
+
+    def catch_up(self):
+        start = time.monotonic()
+        replayed = self.replayed
+        scheduler = RateScheduler(self.catch_up_rate)
+        while len(self) and self.connector.is_connected():
+            for _ in range(scheduler.wait(self.stopped)):
+                message = self.take()
+                if message is None:
+                    break
+                info = self.connector.client.publish(message[0], message[1], self.qos)
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    self.put_back(message)
+                    break
+                self.replayed += 1
+            if self.stopped.is_set():
+                break
+        if self.replayed > replayed:
+            self.catch_ups += 1
+            self.max_catch_up_s = max(self.max_catch_up_s, time.monotonic() - start)
+            print("Offline buffer: {} values replayed in {:.1f} s, {} left".format(self.replayed - replayed, time.monotonic() - start, len(self)))
+
+    # ---------------------------------------------------- END ----------------------------------------------------
+
+    def close(self):
+        # The messages not replayed yet are counted as dropped
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(1.0)
+        with self.lock:
+            self.dropped += len(self.memory) + self.spilled
+            self.memory.clear()
+            self.spilled = 0
+            if self.spill_file is not None:
+                self.spill_file.close()
+                os.remove(self.spill_path)
+                self.spill_file = None
+
+    def get_counters(self):
+        return {
+            "capacity": self.capacity,
+            "spill_capacity": self.spill_capacity,
+            "buffered": self.buffered,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "depth": len(self),
+            "max_depth": self.max_depth,
+            "catch_up_rate": self.catch_up_rate,
+            "catch_ups": self.catch_ups,
+            "max_catch_up_s": self.max_catch_up_s,
+        }
+
+    def describe(self):
+        return ("buffer {capacity} (+{spill_capacity} on disk): {buffered} buffered while disconnected, {replayed} replayed "
+                "at {catch_up_rate:g}/s at most ({catch_ups} catch-ups, longest {max_catch_up_s:.1f} s), {dropped} dropped, "
+                "max depth {max_depth}").format(**self.get_counters())
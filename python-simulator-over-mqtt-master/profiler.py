@@ -0,0 +1,260 @@
+import cProfile
+import collections
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from latencyHistogram import LatencyHistogram
+
+# Profiling hooks for the publish and receive hot paths of the modes (see Mode.HOT_PATHS): when the throughput drops,
+# they tell whether the time goes to the codec, to paho, to the records or to the terminal.
+# - cprofile: the hot path methods of the mode are wrapped, each call is profiled (one cProfile.Profile per thread: the
+#   sensor publishes from its own thread, the server processes in the receive workers), the profiles are merged at the
+#   end. Deterministic but slow: the measured rates are lower than without profiling.
+# - sampling: a thread samples the stacks of all the threads every interval_ms, only the stacks going through a hot
+#   path are kept. Nearly free, statistical.
+# - memory: tracemalloc snapshots at the beginning and at the end of the window, the growth is reported per line.
+# Only during a window of the run (start_s seconds after the start, for duration_s seconds, or until the end). Files,
+# next to the results: <prefix>-cprofile.txt (+ .pstats), <prefix>-sampling.txt, <prefix>-sampling.folded (collapsed
+# stacks for flamegraph.pl or speedscope), <prefix>-memory.txt
+class HotPathProfiler:
+
+    CPROFILE = "cprofile"
+    SAMPLING = "sampling"
+    DEFAULT_INTERVAL_MS = 5.0
+    # A thread only gives the GIL away every switch interval (5 ms by default): a message processed in 100 µs would rarely
+    # be seen by the sampler, which mostly observes the threads waiting. Shortened to 0.1 ms during a sampling window:
+    # shorter, the GIL would change hands so often between the publishing, network and receive threads that the
+    # measured run would no longer be the one without profiler. The report gives the interval used.
+    SAMPLING_SWITCH_INTERVAL_S = 0.0001
+    REPORT_LINES = 40
+
+    def __init__(self, kind, prefix, start_s=0.0, duration_s=None, memory=False, interval_ms=DEFAULT_INTERVAL_MS):
+        if kind not in (None, HotPathProfiler.CPROFILE, HotPathProfiler.SAMPLING):
+            raise ValueError("Unknown profiler {}, use {} or {}".format(kind, HotPathProfiler.CPROFILE, HotPathProfiler.SAMPLING))
+        self.kind = kind
+        self.prefix = prefix
+        self.start_s = start_s
+        self.duration_s = duration_s
+        self.memory = memory
+        self.interval_s = interval_ms / 1000
+        self.hot_paths = set() # names of the wrapped functions, the sampler keeps the stacks going through them
+        self.active = False
+        self.stopped = threading.Event()
+        self.finished = False
+        self.lock = threading.Lock()
+        # cProfile
+        self.thread_profiles = threading.local()
+        self.profiles = []
+        # sampling: collapsed stack -> count
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.switch_intervals_s = None # (interval of the run, interval during the window)
+        # tracemalloc
+        self.first_snapshot = None
+
+    # ---------------------------------------------------- HOT PATHS ----------------------------------------------------
+
+    def attach(self, mode):
+        # Wraps the hot path methods of the mode (instance attributes, the class is untouched). The receive pipeline is
+        # created on the first message and takes the wrapped process_received_message.
+        for name in mode.HOT_PATHS:
+            self.hot_paths.add(name)
+            if self.kind == HotPathProfiler.CPROFILE:
+                setattr(mode, name, self.wrap(getattr(mode, name)))
+
+    def wrap(self, function):
+        def profiled(*arguments, **keywords):
+            if not self.active:
+                return function(*arguments, **keywords)
+            profile = getattr(self.thread_profiles, "profile", None)
+            if profile is None:
+                profile = self.thread_profiles.profile = cProfile.Profile()
+                with self.lock:
+                    self.profiles.append(profile)
+            return profile.runcall(function, *arguments, **keywords)
+        return profiled
+
+    # ---------------------------------------------------- WINDOW ----------------------------------------------------
+
+    def start(self):
+        threading.Thread(target=self.run, name="profiler", daemon=True).start()
+
+    def run(self):
+        if self.stopped.wait(self.start_s):
+            return
+        if self.memory:
+            tracemalloc.start(25)
+            self.first_snapshot = tracemalloc.take_snapshot()
+        print("Profiling the hot paths{}.".format(" for {} s".format(self.duration_s) if self.duration_s else ""))
+        self.active = True
+        switch_interval = sys.getswitchinterval()
+        if self.kind == HotPathProfiler.SAMPLING:
+            sys.setswitchinterval(min(switch_interval, HotPathProfiler.SAMPLING_SWITCH_INTERVAL_S))
+            self.switch_intervals_s = (switch_interval, sys.getswitchinterval())
+        end = time.monotonic() + self.duration_s if self.duration_s else None
+        while not self.stopped.is_set() and (end is None or time.monotonic() < end):
+            if self.kind == HotPathProfiler.SAMPLING:
+                self.sample()
+            self.stopped.wait(self.interval_s if end is None else min(self.interval_s, max(0, end - time.monotonic())))
+        sys.setswitchinterval(switch_interval)
+        self.finish()
+
+    def stop(self):
+        # End of the run: the reports are written if the window was open
+        self.stopped.set()
+        if self.active:
+            self.finish()
+
+    def finish(self):
+        with self.lock:
+            if self.finished or not self.active:
+                return
+            self.finished = True
+            self.active = False
+        for path in self.save():
+            print("Profile saved in {}".format(path))
+
+    # ---------------------------------------------------- SAMPLING ----------------------------------------------------
+
+    def sample(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            functions = []
+            in_hot_path = False
+            while frame is not None:
+                code = frame.f_code
+                functions.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                in_hot_path = in_hot_path or code.co_name in self.hot_paths
+                frame = frame.f_back
+            self.samples += 1
+            if in_hot_path:
+                # Collapsed stack: root first, frames separated by ";"
+                functions.append(names.get(thread_id, "thread"))
+                self.stacks[";".join(reversed(functions))] += 1
+
+    # ---------------------------------------------------- REPORTS ----------------------------------------------------
+
+    def save(self):
+        paths = []
+        if self.kind == HotPathProfiler.CPROFILE and self.profiles:
+            # No new call is profiled (not active), each profile is only enabled during the call it profiles
+            stats = pstats.Stats(*self.profiles)
+            stats.dump_stats(self.prefix + "-cprofile.pstats")
+            report = io.StringIO()
+            stats.stream = report
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(HotPathProfiler.REPORT_LINES)
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(HotPathProfiler.REPORT_LINES)
+            paths += [self.write(self.prefix + "-cprofile.txt", report.getvalue()), self.prefix + "-cprofile.pstats"]
+        if self.kind == HotPathProfiler.SAMPLING:
+            paths.append(self.write(self.prefix + "-sampling.folded",
+                                    "".join("{} {}\n".format(stack, count) for stack, count in self.stacks.most_common())))
+            paths.append(self.write(self.prefix + "-sampling.txt", self.sampling_report()))
+        if self.memory and self.first_snapshot is not None:
+            growth = tracemalloc.take_snapshot().compare_to(self.first_snapshot, "lineno")
+            tracemalloc.stop()
+            lines = ["Memory allocated during the window, by line (tracemalloc):"]
+            lines += [str(statistic) for statistic in growth[:HotPathProfiler.REPORT_LINES]]
+            paths.append(self.write(self.prefix + "-memory.txt", "\n".join(lines) + "\n"))
+        return paths
+
+    def sampling_report(self):
+        # Self time (the function on top of the stack) and total time (anywhere in the stack) of each function
+        kept = sum(self.stacks.values())
+        self_counts, total_counts = collections.Counter(), collections.Counter()
+        for stack, count in self.stacks.items():
+            functions = stack.split(";")
+            self_counts[functions[-1]] += count
+            for function in set(functions[1:]):
+                total_counts[function] += count
+        lines = ["{} samples in the hot paths out of {} thread samples (every {:g} ms)".format(kept, self.samples, self.interval_s * 1000)]
+        if self.switch_intervals_s is not None:
+            lines.append("GIL switch interval {:g} ms during the window ({:g} ms otherwise, see sys.setswitchinterval)".format(
+                self.switch_intervals_s[1] * 1000, self.switch_intervals_s[0] * 1000))
+        for title, counts in (("Self", self_counts), ("Total", total_counts)):
+            lines.append("\n{:>7} {:>7}  function".format(title, "%"))
+            lines += ["{:>7} {:>6.1f}%  {}".format(count, 100 * count / kept, function)
+                      for function, count in counts.most_common(HotPathProfiler.REPORT_LINES)]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def write(path, text):
+        with open(path, "w") as file:
+            file.write(text)
+        return path
+
+
+class PhaseTimers:
+    # Time spent in each phase of the hot paths, without the cost of a profiler: the codec, the MQTT client and the
+    # methods of the mode are wrapped with two perf_counter_ns() calls (only when asked, nothing otherwise).
+    #   serialize   codec.encode              publish   client.publish (paho: packet building and queueing)
+    #   record      add_time_value_pairs      deliver   reception in paho's thread -> start of the processing (queue wait)
+    #   process     process_received_message (decoding and recording of a received message)
+
+    PHASES = ("serialize", "publish", "record", "deliver", "process")
+
+    def __init__(self, prefix):
+        self.prefix = prefix # the table is saved in <prefix>-phases.txt
+        self.histograms = {phase: LatencyHistogram(lowest_ns=10) for phase in PhaseTimers.PHASES}
+
+    def attach(self, mode):
+        mode.codec = TimedCodec(mode.codec, self.histograms["serialize"])
+        mode.mqtt_service.client.publish = self.timed(mode.mqtt_service.client.publish, self.histograms["publish"])
+        mode.add_time_value_pairs = self.timed(mode.add_time_value_pairs, self.histograms["record"])
+        mode.process_received_message = self.timed_reception(mode.process_received_message)
+
+    @staticmethod
+    def timed(function, histogram):
+        def timed_function(*arguments, **keywords):
+            start_ns = time.perf_counter_ns()
+            try:
+                return function(*arguments, **keywords)
+            finally:
+                histogram.record(time.perf_counter_ns() - start_ns)
+        return timed_function
+
+    def timed_reception(self, process_received_message):
+        deliver, process = self.histograms["deliver"], self.histograms["process"]
+        def timed_process(timestamp_ns, *arguments):
+            deliver.record(time.time_ns() - timestamp_ns)
+            start_ns = time.perf_counter_ns()
+            try:
+                return process_received_message(timestamp_ns, *arguments)
+            finally:
+                process.record(time.perf_counter_ns() - start_ns)
+        return timed_process
+
+    def get_rows(self):
+        rows = []
+        for phase, histogram in self.histograms.items():
+            if histogram.total:
+                rows.append({"phase": phase, "count": histogram.total, "mean_us": histogram.mean() / 1e3,
+                             "p50_us": histogram.value_at_percentile(50) / 1e3, "p99_us": histogram.value_at_percentile(99) / 1e3,
+                             "max_us": histogram.max_ns / 1e3, "total_ms": histogram.sum_ns / 1e6})
+        return rows
+
+    def describe(self):
+        lines = ["{:<10} {:>10} {:>10} {:>10} {:>10} {:>12} {:>12}".format("phase", "count", "mean_us", "p50_us", "p99_us", "max_us", "total_ms")]
+        lines += ["{phase:<10} {count:>10} {mean_us:>10.2f} {p50_us:>10.2f} {p99_us:>10.2f} {max_us:>12.2f} {total_ms:>12.1f}".format(**row)
+                  for row in self.get_rows()]
+        return "\n".join(lines)
+
+    def save(self):
+        return HotPathProfiler.write(self.prefix + "-phases.txt", self.describe() + "\n")
+
+
+class TimedCodec:
+    # Codec whose encode() is timed (PhaseTimers), decode() is untouched
+
+    def __init__(self, codec, histogram):
+        self.codec = codec
+        self.encode = PhaseTimers.timed(codec.encode, histogram)
+
+    def __getattr__(self, name):
+        return getattr(self.codec, name)
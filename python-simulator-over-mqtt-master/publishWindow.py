@@ -0,0 +1,216 @@
+import collections
+import threading
+import time
+import paho.mqtt.client as mqtt
+
+# PublishWindow bounds what the sensor hands over to paho. client.publish() never refuses a message: when the broker or
+# the link is slower than the requested rate, paho's outgoing queue grows without limit (memory, then latency). Here at
+# most `size` values are IN FLIGHT (handed to paho, and not written on the socket yet for QoS 0, not acknowledged yet for
+# QoS 1 and 2: paho's on_publish tells when a message is done). When the window is full:
+#   block         the publisher waits for room (the scheduler then catches up or skips, see RateScheduler)
+#   drop-newest   the value waits in a bounded backlog, dropped if the backlog is full too
+#   drop-oldest   same, but the oldest value of the backlog is dropped to make room (the freshest values are sent)
+#   adaptive      as drop-newest, and the publication rate is lowered while the window stays filled (to 0.8 x the rate
+#                 paho actually took during the last ADAPT_INTERVAL_S), then raised again by 5 % steps up to the requested
+#                 rate once it has drained. The SampleBatcher of the sensor follows each new rate (see
+#                 SampleBatcher.follow_rate): the batches keep their duration and the right period.
+# Only the values go through the window: commands and answers are rare and are never delayed or dropped.
+# The dropped values stay in the sensor records: the report counts them as lost, the window counts them as dropped.
+class PublishWindow:
+
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    DROP_NEWEST = "drop-newest"
+    ADAPTIVE = "adaptive"
+    DEFAULT_SIZE = 1000
+    # paho's max_inflight_messages (QoS 1 and 2 messages sent and not acknowledged yet), 20 by default: too few for a
+    # stream of values at QoS 1, while each QoS 2 message keeps a 4 step handshake open
+    DEFAULT_MAX_INFLIGHT = {0: 0, 1: 100, 2: 20}
+    ADAPT_INTERVAL_S = 0.1
+    ADAPT_DECREASE = 0.8
+    ADAPT_INCREASE = 0.05
+    MIN_RATE_RATIO = 0.01 # the adaptive rate never goes below 1 % of the requested rate
+    BLOCK_CHECK_S = 0.1 # a blocked publisher checks is_active this often
+    MAX_EARLY = 1000
+
+    def __init__(self, client, qos=0, size=DEFAULT_SIZE, policy=BLOCK, backlog=None, scheduler=None, is_active=None):
+        # scheduler: RateScheduler of the publisher (adaptive policy), is_active(): False when a blocked publisher must give up
+        if policy not in PublishWindow.get_policies():
+            raise ValueError("Unknown publish policy {}, use one of {}".format(policy, PublishWindow.get_policies()))
+        if size <= 0:
+            raise ValueError("The publish window must be positive")
+        self.client = client
+        self.qos = qos
+        self.size = size
+        self.policy = policy
+        self.backlog = collections.deque()
+        self.backlog_size = 0 if policy == PublishWindow.BLOCK else (size if backlog is None else backlog)
+        # A blocked publisher is woken up once a quarter of the window is free, not for every message (one thread switch
+        # per message would halve the throughput)
+        self.low_water = size * 3 // 4
+        self.scheduler = scheduler
+        self.target_rate = scheduler.rate if scheduler is not None else None
+        self.is_active = is_active or (lambda: True)
+        # mids handed to paho and not done yet. The on_publish of a message can run before publish() returns its mid
+        # (network thread): it is then kept in `early` until the publisher registers the mid.
+        self.pending = set()
+        self.early = collections.OrderedDict()
+        self.condition = threading.Condition()
+        self.next_adapt_s = time.monotonic() + PublishWindow.ADAPT_INTERVAL_S
+        self.adapt_sent = 0 # sent at the previous adaptation
+        # counters
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0 # QoS 0 messages refused by paho (not connected)
+        self.blocked_ns = 0
+        self.max_in_flight = 0
+        self.max_backlog = 0
+        self.rate_changes = 0
+        self.min_rate = self.target_rate
+        self.previous_on_publish = client.on_publish
+        self.previous_on_disconnect = client.on_disconnect
+        client.on_publish = self.on_publish
+        client.on_disconnect = self.on_disconnect
+
+    @staticmethod
+    def get_policies():
+        return [PublishWindow.BLOCK, PublishWindow.DROP_OLDEST, PublishWindow.DROP_NEWEST, PublishWindow.ADAPTIVE]
+
+    @staticmethod
+    def configure_qos(client, qos, max_inflight=None):
+        # max_inflight: None = tuned for the QoS (DEFAULT_MAX_INFLIGHT), 0 = no limit (see paho's max_inflight_messages_set)
+        if qos > 0:
+            client.max_inflight_messages_set(PublishWindow.DEFAULT_MAX_INFLIGHT[qos] if max_inflight is None else max_inflight)
+
+    # ---------------------------------------------------- PUBLISHER THREAD ----------------------------------------------------
+
+    def publish(self, topic, payload):
+        self.drain()
+        if not self.backlog and len(self.pending) < self.size:
+            self.hand_over(topic, payload)
+        elif self.policy == PublishWindow.BLOCK:
+            self.wait_for_room()
+            if len(self.pending) < self.size:
+                self.hand_over(topic, payload)
+            else:
+                self.dropped += 1 # stopped while blocked
+        else:
+            if len(self.backlog) >= self.backlog_size:
+                self.dropped += 1
+                if self.policy != PublishWindow.DROP_OLDEST or not self.backlog:
+                    self.adapt()
+                    return
+                self.backlog.popleft()
+            self.backlog.append((topic, payload))
+            if len(self.backlog) > self.max_backlog:
+                self.max_backlog = len(self.backlog)
+        self.adapt()
+
+    def hand_over(self, topic, payload):
+        info = self.client.publish(topic, payload, self.qos)
+        if self.qos == 0 and info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.errors += 1 # never written, no on_publish will come
+            return
+        with self.condition:
+            if self.early.pop(info.mid, None) is None:
+                self.pending.add(info.mid)
+            in_flight = len(self.pending)
+        self.sent += 1
+        if in_flight > self.max_in_flight:
+            self.max_in_flight = in_flight
+
+    def drain(self):
+        # The backlog is handed over by the publisher itself, never from paho's callbacks (its locks are held there)
+        while self.backlog and len(self.pending) < self.size:
+            self.hand_over(*self.backlog.popleft())
+
+    def wait_for_room(self):
+        start_ns = time.perf_counter_ns()
+        with self.condition:
+            while len(self.pending) >= self.size and self.is_active():
+                self.condition.wait(PublishWindow.BLOCK_CHECK_S)
+        self.blocked_ns += time.perf_counter_ns() - start_ns
+
+    def flush(self, timeout_s=5.0):
+        # When the publication stops: the backlog is sent as the window frees up, for at most timeout_s
+        deadline = time.monotonic() + timeout_s
+        while self.backlog and time.monotonic() < deadline:
+            self.drain()
+            with self.condition:
+                if len(self.pending) >= self.size:
+                    self.condition.wait(PublishWindow.BLOCK_CHECK_S)
+        self.dropped += len(self.backlog)
+        self.backlog.clear()
+
+    def adapt(self):
+        if self.policy != PublishWindow.ADAPTIVE or self.scheduler is None:
+            return
+        now = time.monotonic()
+        if now < self.next_adapt_s:
+            return
+        elapsed_s = now - self.next_adapt_s + PublishWindow.ADAPT_INTERVAL_S
+        taken_rate = (self.sent - self.adapt_sent) / elapsed_s
+        self.next_adapt_s = now + PublishWindow.ADAPT_INTERVAL_S
+        self.adapt_sent = self.sent
+        filled = (len(self.pending) + len(self.backlog)) / (self.size + self.backlog_size)
+        rate = self.scheduler.rate
+        if filled > 0.5:
+            rate = max(self.target_rate * PublishWindow.MIN_RATE_RATIO, min(rate, taken_rate) * PublishWindow.ADAPT_DECREASE)
+        elif filled < 0.1 and rate < self.target_rate:
+            rate = min(self.target_rate, rate * (1 + PublishWindow.ADAPT_INCREASE))
+        if rate != self.scheduler.rate:
+            self.scheduler.set_rate(rate, drop_late=rate < self.scheduler.rate)
+            self.rate_changes += 1
+            self.min_rate = min(self.min_rate, rate)
+
+    # ---------------------------------------------------- NETWORK THREAD ----------------------------------------------------
+
+    def on_publish(self, client, userdata, mid):
+        with self.condition:
+            if mid in self.pending:
+                self.pending.remove(mid)
+                if len(self.pending) <= self.low_water:
+                    self.condition.notify()
+            else:
+                # Not registered yet, or not a value (answers): forgotten after MAX_EARLY other ones
+                self.early[mid] = True
+                if len(self.early) > PublishWindow.MAX_EARLY:
+                    self.early.popitem(last=False)
+        if self.previous_on_publish is not None:
+            self.previous_on_publish(client, userdata, mid)
+
+    def on_disconnect(self, client, userdata, rc):
+        if self.qos == 0:
+            # paho drops its unsent QoS 0 packets on disconnection, without on_publish
+            with self.condition:
+                self.pending.clear()
+                self.condition.notify_all()
+        if self.previous_on_disconnect is not None:
+            self.previous_on_disconnect(client, userdata, rc)
+
+    # ---------------------------------------------------- COUNTERS ----------------------------------------------------
+
+    def get_counters(self):
+        return {
+            "policy": self.policy,
+            "size": self.size,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "in_flight": len(self.pending),
+            "max_in_flight": self.max_in_flight,
+            "backlog": len(self.backlog),
+            "max_backlog": self.max_backlog,
+            "blocked_s": self.blocked_ns / 1e9,
+            "rate": self.scheduler.rate if self.scheduler is not None else None,
+            "min_rate": self.min_rate,
+            "rate_changes": self.rate_changes,
+        }
+
+    def describe(self):
+        counters = self.get_counters()
+        text = ("window {policy} {size}: {sent} handed to paho, {dropped} dropped, {errors} refused, max in flight {max_in_flight}, "
+                "max backlog {max_backlog}, blocked {blocked_s:.3f} s").format(**counters)
+        if self.policy == PublishWindow.ADAPTIVE and counters["rate"] is not None:
+            text += ", rate {rate:g}/s (min {min_rate:g}, {rate_changes} changes)".format(**counters)
+        return text
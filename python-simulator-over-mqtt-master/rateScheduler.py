@@ -0,0 +1,122 @@
+import random
+import time
+
+# RateScheduler paces a publication at a fixed rate using ABSOLUTE deadlines on the monotonic clock.
+# With time.sleep(1/rate) after each value, the time spent to build and publish the value is added to every period,
+# so the real rate is always below the requested one (a 250 Hz ECG stream ends up well under 250 Hz). Here the n-th
+# value is due at start + n * period, whatever the time spent between two values.
+#
+# When we are late (slow publish, GC pause, overloaded machine...), two policies are available:
+# - CATCH_UP: the missed values are sent in a burst (at most max_burst at once), the average rate is preserved
+# - SKIP: the missed values are dropped and counted, the following values keep their original time slots
+# The deadlines are regular by default, or Poisson arrivals (exponential gaps of mean 1/rate, see set_arrivals).
+class RateScheduler:
+
+    CATCH_UP = "catch-up"
+    SKIP = "skip"
+
+    # Sleeping longer than this is done on the interrupt event (if any) so that a stop is handled quickly
+    INTERRUPTIBLE_SLEEP_NS = 50_000_000
+
+    def __init__(self, rate, policy=CATCH_UP, max_burst=100):
+        if rate <= 0:
+            raise ValueError("The rate must be positive")
+        if policy not in RateScheduler.get_policies():
+            raise ValueError("Unknown scheduling policy {}, use one of {}".format(policy, RateScheduler.get_policies()))
+        self.rate = rate
+        self.period_ns = int(1e9 / rate)
+        self.policy = policy
+        self.max_burst = max_burst
+        self.arrivals = None # random.Random drawing the gaps of Poisson arrivals, None = regular deadlines
+        self.start()
+
+    @staticmethod
+    def get_policies():
+        return [RateScheduler.CATCH_UP, RateScheduler.SKIP]
+
+    def start(self, offset=0):
+        # (Re)start the schedule now, the first value is due after offset seconds (immediately by default)
+        self.start_ns = time.monotonic_ns() + int(offset * 1e9)
+        self.next_deadline_ns = self.start_ns
+        self.fired = 0   # number of values that were due and handed over to the caller
+        self.skipped = 0 # number of deadlines dropped (SKIP policy or burst larger than max_burst)
+        self.last_fire_ns = self.start_ns
+
+    def set_rate(self, rate, drop_late=False):
+        # Change the rate without restarting the statistics, the next deadline is rescheduled from now.
+        # drop_late: the values already due are dropped (counted as skipped) instead of being caught up, used when the
+        # rate is lowered because the publication cannot follow (see PublishWindow)
+        if rate <= 0:
+            raise ValueError("The rate must be positive")
+        now = time.monotonic_ns()
+        if drop_late and self.next_deadline_ns < now:
+            self.skipped += (now - self.next_deadline_ns) // self.period_ns
+            self.next_deadline_ns = now
+        self.rate = rate
+        self.period_ns = int(1e9 / rate)
+        self.next_deadline_ns = min(self.next_deadline_ns, now + self.period_ns)
+
+    def set_arrivals(self, poisson_seed=None):
+        # Poisson arrivals drawn from poisson_seed (the same seed gives the same gaps), None = back to regular deadlines
+        self.arrivals = random.Random(poisson_seed) if poisson_seed is not None else None
+
+    def delay(self):
+        # Seconds to wait before the next deadline (0 if it is already due)
+        return max(0, self.next_deadline_ns - time.monotonic_ns()) / 1e9
+
+    def collect_due(self):
+        # Non-blocking: returns the number of values due now and moves the deadline accordingly
+        now = time.monotonic_ns()
+        if now < self.next_deadline_ns:
+            return 0
+        if self.arrivals is None:
+            due = 1 + (now - self.next_deadline_ns) // self.period_ns
+            self.next_deadline_ns += due * self.period_ns
+        else:
+            due = 0
+            while self.next_deadline_ns <= now:
+                due += 1
+                self.next_deadline_ns += int(self.arrivals.expovariate(self.rate) * 1e9)
+        if self.policy == RateScheduler.CATCH_UP:
+            sent = min(due, self.max_burst)
+        else:
+            sent = 1
+        self.skipped += due - sent
+        self.fired += sent
+        self.last_fire_ns = now
+        return sent
+
+    def wait(self, interrupt_event=None):
+        # Blocking: sleeps until the next deadline and returns the number of values due.
+        # Returns 0 if interrupt_event has been set while waiting (e.g. the server asked to stop).
+        remaining_ns = self.next_deadline_ns - time.monotonic_ns()
+        if remaining_ns > 0:
+            if interrupt_event is not None and remaining_ns > RateScheduler.INTERRUPTIBLE_SLEEP_NS:
+                if interrupt_event.wait(remaining_ns / 1e9):
+                    return 0
+            else:
+                time.sleep(remaining_ns / 1e9)
+        return self.collect_due()
+
+    # ---------------------------------------------------- REPORTING ----------------------------------------------------
+
+    def achieved_rate(self):
+        elapsed_ns = self.last_fire_ns - self.start_ns
+        if self.fired < 2 or elapsed_ns <= 0:
+            return 0.0
+        # The first value is sent at t=0, so fired values span (fired - 1) periods
+        return (self.fired - 1) * 1e9 / elapsed_ns
+
+    def get_report(self):
+        return {
+            "target_rate": self.rate,
+            "achieved_rate": self.achieved_rate(),
+            "sent": self.fired,
+            "skipped": self.skipped,
+            "policy": self.policy,
+        }
+
+    def describe(self):
+        report = self.get_report()
+        return "achieved {:.2f}/{} values per second ({} sent, {} skipped, policy {})".format(
+            report["achieved_rate"], report["target_rate"], report["sent"], report["skipped"], report["policy"])
@@ -0,0 +1,89 @@
+import queue
+import threading
+
+# ReceivePipeline decouples paho's network thread from the processing of the received messages.
+# paho reads the socket and calls on_message in ONE thread: everything done in the callback (decoding, recording,
+# printing) delays the reading of the next messages, and that delay is then measured as "mqtt_transit" latency.
+# Here the callback only takes the reception time and puts the raw payload in a BOUNDED queue; worker threads decode
+# and record. When the workers cannot follow and the queue is full, the message is dropped and counted rather than
+# blocking the network thread (same choice as StreamingResultWriter).
+class ReceivePipeline:
+
+    DEFAULT_SIZE = 10000
+    DEFAULT_WORKERS = 1
+
+    def __init__(self, handler, size=DEFAULT_SIZE, workers=DEFAULT_WORKERS):
+        # handler(*item) is called by the workers for each submitted item (Mode: timestamp_ns, payload, topic)
+        self.handler = handler
+        self.size = size
+        self.queue = queue.Queue(maxsize=size)
+        self.received = 0
+        self.dropped = 0
+        self.max_depth = 0
+        # One counter per worker: no lock shared by the workers
+        self.processed = [0] * workers
+        self.errors = [0] * workers
+        self.workers = [threading.Thread(target=self.work, args=(index,), name="receive-worker-{}".format(index), daemon=True)
+                        for index in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    # ---------------------------------------------------- NETWORK THREAD ----------------------------------------------------
+
+    def submit(self, *item):
+        self.received += 1
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return
+        depth = len(self.queue.queue) # no lock, approximate is enough
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    # ---------------------------------------------------- WORKERS ----------------------------------------------------
+
+    def work(self, index):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                try:
+                    self.handler(*item)
+                    self.processed[index] += 1
+                except Exception as error:
+                    # A malformed message must not stop the worker
+                    self.errors[index] += 1
+                    if self.errors[index] == 1:
+                        print("Could not process a received message: {!r}".format(error))
+            finally:
+                self.queue.task_done()
+
+    def drain(self):
+        # Waits until every queued message has been processed
+        self.queue.join()
+
+    def close(self):
+        self.drain()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    # ---------------------------------------------------- COUNTERS ----------------------------------------------------
+
+    def get_counters(self):
+        return {
+            "received": self.received,
+            "processed": sum(self.processed),
+            "dropped": self.dropped,
+            "errors": sum(self.errors),
+            "depth": len(self.queue.queue),
+            "max_depth": self.max_depth,
+            "size": self.size,
+        }
+
+    def describe(self):
+        return ("{received} received, {processed} processed, {dropped} dropped (queue full), {errors} errors, "
+                "queue depth {depth}/{size} (max {max_depth})").format(**self.get_counters())
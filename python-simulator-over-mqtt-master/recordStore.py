@@ -0,0 +1,162 @@
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from constants import MqttAppConstants
+
+# RecordStore keeps the (time, value) records of a mode in COLUMNS of machine numbers instead of a list of tuples:
+# - timestamp: int64, nanoseconds since epoch (time.time_ns())
+# - seq: int64, sequence number of the message (-1 when unknown)
+# - value: float64, the value, or the index of the answer in MqttAppConstants.get_response() for answers
+# - kind: int8, KIND_VALUE or KIND_ANSWER
+# That is 25 bytes per record instead of ~150 bytes of Python objects (tuple + string + int).
+#
+# Two optional policies bound the memory of very long sessions (by default everything stays in memory):
+# - max_records: ring buffer, only the last max_records records are kept (the older ones are counted in dropped)
+# - spill_chunk: every spill_chunk records, the columns are written to a binary chunk file and the memory is freed
+class RecordStore:
+
+    KIND_VALUE = 0
+    KIND_ANSWER = 1
+
+    COLUMNS = ("timestamp", "seq", "value", "kind")
+    TYPECODES = ("q", "q", "d", "b")
+    CHUNK_HEADER = struct.Struct("<Q") # number of records of the chunk, followed by each column
+
+    ANSWERS = MqttAppConstants.get_response()
+    ANSWER_INDEX = {answer: index for index, answer in enumerate(ANSWERS)}
+
+    def __init__(self, max_records=None, spill_chunk=None, spill_dir=None):
+        if max_records is not None and spill_chunk is not None:
+            raise ValueError("Choose either a ring buffer (max_records) or spilling to disk (spill_chunk)")
+        if max_records is not None and max_records <= 0:
+            raise ValueError("max_records must be positive (None keeps every record)")
+        if spill_chunk is not None and spill_chunk <= 0:
+            raise ValueError("spill_chunk must be positive (None keeps every record in memory)")
+        self.max_records = max_records
+        self.spill_chunk = spill_chunk
+        self.spill_dir = None
+        self.spilled_files = []
+        self.spilled_count = 0
+        self.dropped = 0
+        self.next_slot = 0 # ring buffer only: next slot to overwrite once the buffer is full
+        if spill_chunk is not None:
+            if spill_dir is not None:
+                os.makedirs(spill_dir, exist_ok=True)
+            self.spill_dir = tempfile.mkdtemp(prefix="records-", dir=spill_dir)
+        self.reset_columns()
+
+    def reset_columns(self):
+        self.timestamps, self.seqs, self.values, self.kinds = (array(typecode) for typecode in RecordStore.TYPECODES)
+        if self.max_records is not None:
+            # The ring buffer is preallocated once
+            for column in (self.timestamps, self.seqs, self.values, self.kinds):
+                column.frombytes(bytes(self.max_records * column.itemsize))
+            self.size = 0
+        else:
+            self.size = None
+
+    def __len__(self):
+        if self.max_records is not None:
+            return self.size
+        return self.spilled_count + len(self.timestamps)
+
+    def append(self, timestamp_ns, value, seq=-1):
+        if isinstance(value, str):
+            kind = RecordStore.KIND_ANSWER
+            value = RecordStore.ANSWER_INDEX.get(value)
+            if value is None:
+                return # unknown text, nothing to measure
+        else:
+            kind = RecordStore.KIND_VALUE
+
+        if self.max_records is not None:
+            slot = self.next_slot
+            self.timestamps[slot] = timestamp_ns
+            self.seqs[slot] = seq
+            self.values[slot] = value
+            self.kinds[slot] = kind
+            self.next_slot = (slot + 1) % self.max_records
+            if self.size < self.max_records:
+                self.size += 1
+            else:
+                self.dropped += 1
+            return
+
+        self.timestamps.append(timestamp_ns)
+        self.seqs.append(seq)
+        self.values.append(value)
+        self.kinds.append(kind)
+        if self.spill_chunk is not None and len(self.timestamps) >= self.spill_chunk:
+            self.spill()
+
+    # ---------------------------------------------------- DISK ----------------------------------------------------
+
+    def spill(self):
+        count = len(self.timestamps)
+        if count == 0:
+            return
+        path = os.path.join(self.spill_dir, "chunk-{:06d}.bin".format(len(self.spilled_files)))
+        with open(path, "wb") as file:
+            file.write(RecordStore.CHUNK_HEADER.pack(count))
+            for column in (self.timestamps, self.seqs, self.values, self.kinds):
+                column.tofile(file)
+        self.spilled_files.append(path)
+        self.spilled_count += count
+        self.reset_columns()
+
+    @staticmethod
+    def read_chunk(path):
+        with open(path, "rb") as file:
+            (count,) = RecordStore.CHUNK_HEADER.unpack(file.read(RecordStore.CHUNK_HEADER.size))
+            columns = []
+            for typecode in RecordStore.TYPECODES:
+                column = array(typecode)
+                column.fromfile(file, count)
+                columns.append(column)
+        return columns
+
+    def close(self):
+        # Removes the spilled chunk files
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spilled_files = []
+
+    # ---------------------------------------------------- READING ----------------------------------------------------
+
+    def iter_chunks(self):
+        # Yields (timestamps, seqs, values, kinds) columns in chronological order, one chunk at a time
+        for path in self.spilled_files:
+            yield RecordStore.read_chunk(path)
+        if self.max_records is not None and self.size == self.max_records and self.next_slot:
+            # The ring buffer has wrapped: the oldest record is at next_slot
+            slot = self.next_slot
+            yield [column[slot:] + column[:slot] for column in (self.timestamps, self.seqs, self.values, self.kinds)]
+        elif self.max_records is not None:
+            yield [column[:self.size] for column in (self.timestamps, self.seqs, self.values, self.kinds)]
+        else:
+            yield [self.timestamps, self.seqs, self.values, self.kinds]
+
+    def to_columns(self):
+        # All the records as one array per column (see COLUMNS)
+        merged = [array(typecode) for typecode in RecordStore.TYPECODES]
+        for chunk in self.iter_chunks():
+            for column, part in zip(merged, chunk):
+                column.extend(part)
+        return dict(zip(RecordStore.COLUMNS, merged))
+
+    @staticmethod
+    def decode_value(value, kind):
+        # Back to the original value (answers are stored as their index in get_response())
+        if kind == RecordStore.KIND_ANSWER:
+            return RecordStore.ANSWERS[int(value)]
+        if value.is_integer():
+            return int(value)
+        return value
+
+    def __iter__(self):
+        # (timestamp_ns, value) pairs, like the historical list of tuples
+        for timestamps, _, values, kinds in self.iter_chunks():
+            for timestamp_ns, value, kind in zip(timestamps, values, kinds):
+                yield timestamp_ns, RecordStore.decode_value(value, kind)
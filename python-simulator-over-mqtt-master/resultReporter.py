@@ -1,24 +1,38 @@
+import datetime
+import glob
 import os
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.chart import ScatterChart, Series, Reference
+import xlsxwriter
+from clockSync import ClockSync
 from constants import MqttAppConstants
+from latencyHistogram import LatencyHistogram
+from latencyReport import LatencyReport
+from loadProfile import ProfileDriver
+from recordStore import RecordStore
 
 class ExcelGeneratorConstant:
+    SEQ = "seq"
     SENDER_TIME = "sender_time"
     SENDER_VALUE = "sender_value"
     MQTT_TRANSIT = "mqtt_transit"
     RECEIVER_TIME = "receiver_time"
     RECEIVER_VALUE = "receiver_value"
+    # Exact times (time.time_ns()), the matching and the deltas are computed from them, never from the readable times
+    SENDER_TIME_NS = "sender_time_ns"
+    RECEIVER_TIME_NS = "receiver_time_ns"
 
     @staticmethod
     def get_all_rows():
         return [
+            ExcelGeneratorConstant.SEQ,
             ExcelGeneratorConstant.SENDER_TIME,
             ExcelGeneratorConstant.SENDER_VALUE,
             ExcelGeneratorConstant.MQTT_TRANSIT,
             ExcelGeneratorConstant.RECEIVER_TIME,
-            ExcelGeneratorConstant.RECEIVER_VALUE
+            ExcelGeneratorConstant.RECEIVER_VALUE,
+            ExcelGeneratorConstant.SENDER_TIME_NS,
+            ExcelGeneratorConstant.RECEIVER_TIME_NS
         ]
 
     @staticmethod
@@ -31,104 +45,382 @@ class ExcelGeneratorConstant:
             raise ValueError(f"The column name '{rowName}' does not exist in the defined columns.")
 
 
+# The sensor stamps a sequence number on each value (see MqttAppConstants.MSG_SEQ), the sent and received values are
+# matched on it (one vectorized join) instead of row by row: a lost, duplicated or reordered message no longer shifts
+# every later delta, and the exact nanosecond times are used (no parsing of '%H:%M:%S.%f', which broke at midnight).
 class ResultReporter:
     excel_row_names = ExcelGeneratorConstant.get_all_rows()
+    results_folder = './results'
+    sheet_name = 'Data'
+    summary_sheet_name = 'Summary'
 
     @staticmethod
-    def generate_excel(broker_name, mode, received_values):
-        # Create a folder to store the results if it doesn't exist
-        results_folder = './results'
-        if not os.path.exists(results_folder):
-            os.makedirs(results_folder)
-
-        # Convert the data into a DataFrame
-        df = None
-        start_col = None
-
-        if mode == MqttAppConstants.MODE_SENSOR:
-            # HERE, only sender_time and sender_value belongs to df
-            df = pd.DataFrame(received_values, columns=[ExcelGeneratorConstant.SENDER_TIME, ExcelGeneratorConstant.SENDER_VALUE])
-            start_col = ExcelGeneratorConstant.get_col_position_on_excel(ExcelGeneratorConstant.SENDER_TIME)
-        elif mode == MqttAppConstants.MODE_SERVER:
-            # HERE, only receiver_time and receiver_value belongs to df
-            df = pd.DataFrame(received_values, columns=[ExcelGeneratorConstant.RECEIVER_TIME, ExcelGeneratorConstant.RECEIVER_VALUE])
-            start_col = ExcelGeneratorConstant.get_col_position_on_excel(ExcelGeneratorConstant.RECEIVER_TIME)
-
-        # Path to the Excel file
-        excel_file_path = os.path.join(results_folder, f"{broker_name}.xlsx")
-
-        if os.path.exists(excel_file_path) and mode == MqttAppConstants.MODE_SERVER:
-            # If the file exists and the mode is SERVOR, do not overwrite but append data
-            book = load_workbook(excel_file_path)
-            with pd.ExcelWriter(excel_file_path, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
-                df.to_excel(writer, index=False, sheet_name='Data', startrow=1, startcol=start_col, header=False)            
-            ResultReporter.calculate_deltas(broker_name, df, excel_file_path)
+    def find_latest_results_file(broker_name, mode):
+        # Most recent file streamed by StreamingResultWriter for this broker and mode, None if there is none
+        files = glob.glob(os.path.join(ResultReporter.results_folder, "{}-{}-*.csv".format(broker_name, mode)))
+        return max(files, key=os.path.getmtime) if files else None
+
+    # Above this number of values, the Excel report has no chart (Excel cannot draw a scatter chart of millions of
+    # points): use the latency report (percentiles, histogram, optional plot) instead
+    chart_max_points = 10000
+    excel_max_rows = 1048575 # Excel limit, minus the header
+    excel_time_format = 'hh:mm:ss.000'
+    EXCEL_EPOCH_DAYS = 25569 # 1970-01-01 as an Excel date number
+
+    @staticmethod
+    def generate_report_from_files(broker_name, sensor_file=None, server_file=None, window_s=LatencyReport.DEFAULT_WINDOW_S,
+                                   xlsx=False, plot=False):
+        # Post-processing of the files streamed during the runs (by default the latest ones): latency report, and the
+        # Excel report if asked (small runs)
+        sensor_file = sensor_file or ResultReporter.find_latest_results_file(broker_name, MqttAppConstants.MODE_SENSOR)
+        server_file = server_file or ResultReporter.find_latest_results_file(broker_name, MqttAppConstants.MODE_SERVER)
+        if not sensor_file or not server_file:
+            raise FileNotFoundError("Both a sensor and a server results file are needed for broker {}".format(broker_name))
+        print("Sensor results: {}\nServer results: {}".format(sensor_file, server_file))
+        # Clock synchronization of the server run, if any (see clockSync.py)
+        clock = None
+        clock_file = ClockSync.get_file_path(server_file)
+        if os.path.exists(clock_file):
+            clock = ClockSync.load(clock_file)
+            print("Clock: {} ({})".format(clock.describe(), clock_file))
+        sent = ResultReporter.read_results_file(sensor_file)
+        received = ResultReporter.read_results_file(server_file)
+        report, stats = ResultReporter.match_by_sequence(sent, received, clock)
+        ResultReporter.generate_latency_report(broker_name, report, stats, window_s, plot)
+        # Phases of the load profile of the sensor run, if any (see loadProfile.py)
+        profile_file = ProfileDriver.get_file_path(sensor_file)
+        if os.path.exists(profile_file):
+            ResultReporter.generate_load_report(broker_name, report, profile_file)
+        if xlsx:
+            ResultReporter.write_report(broker_name, report, stats)
+
+    @staticmethod
+    def generate_latency_report(broker_name, report, stats, window_s=LatencyReport.DEFAULT_WINDOW_S, plot=False):
+        latency = ResultReporter.build_latency_report(broker_name, report, stats, window_s)
+        return latency.save(ResultReporter.results_folder, plot)
 
+    @staticmethod
+    def build_latency_report(broker_name, report, stats, window_s=LatencyReport.DEFAULT_WINDOW_S):
+        # report, stats: output of match_by_sequence
+        matched = report.dropna(subset=[ExcelGeneratorConstant.SENDER_TIME_NS, ExcelGeneratorConstant.RECEIVER_TIME_NS])
+        return LatencyReport.from_matched(broker_name,
+                                          matched[ExcelGeneratorConstant.SENDER_TIME_NS].to_numpy(dtype=np.int64),
+                                          matched[ExcelGeneratorConstant.RECEIVER_TIME_NS].to_numpy(dtype=np.int64),
+                                          stats, window_s)
+
+    # The knee of a load profile: the first phase losing more than KNEE_LOSS_PERCENT of its values, or whose p99 latency
+    # is above KNEE_LATENCY_FACTOR times the p99 of the first phase, or which sent less than KNEE_RATE_RATIO of its offered load
+    KNEE_LOSS_PERCENT = 1.0
+    KNEE_LATENCY_FACTOR = 3.0
+    KNEE_RATE_RATIO = 0.9
+
+    @staticmethod
+    def generate_load_report(broker_name, report, profile_file):
+        # One row per phase of the load profile: each value belongs to the phase that was running when its sequence
+        # number was drawn (first_seq <= seq < end_seq). Saved in results/<broker>-load-<date>.csv
+        phases = pd.DataFrame(ProfileDriver.load(profile_file), columns=ProfileDriver.COLUMNS).sort_values("first_seq").reset_index(drop=True)
+        if phases.empty:
+            print("No load profile phase in {}".format(profile_file))
+            return None
+        seq = report[ExcelGeneratorConstant.SEQ].to_numpy(dtype=np.int64)
+        sent = report[ExcelGeneratorConstant.SENDER_TIME_NS].notna().to_numpy()
+        received = report[ExcelGeneratorConstant.RECEIVER_TIME_NS].notna().to_numpy()
+        matched = sent & received
+        # Integer subtraction, see match_by_sequence
+        transit_ns = (report[ExcelGeneratorConstant.RECEIVER_TIME_NS] - report[ExcelGeneratorConstant.SENDER_TIME_NS])[matched].to_numpy(dtype=np.int64)
+        matched_phase = np.searchsorted(phases["first_seq"].to_numpy(dtype=np.int64), seq, side="right") - 1
+        end_seq = phases["end_seq"].fillna(np.iinfo(np.int64).max).to_numpy(dtype=np.int64)
+        # Values drawn between two publications (no phase running) belong to no phase
+        in_phase = (matched_phase >= 0) & (seq < end_seq[np.maximum(matched_phase, 0)])
+        transit_phase = matched_phase[matched]
+        transit_in_phase = in_phase[matched]
+        rows = []
+        for position, phase in phases.iterrows():
+            values = in_phase & (matched_phase == position)
+            histogram = LatencyHistogram()
+            histogram.record_many(transit_ns[transit_in_phase & (transit_phase == position)])
+            duration_s = (phase["end_ns"] - phase["start_ns"]) / 1e9 if pd.notna(phase["end_ns"]) else float("nan")
+            phase_sent = int((values & sent).sum())
+            phase_lost = int((values & sent & ~received).sum())
+            rows.append({
+                "phase": int(phase["phase"]),
+                "name": phase["name"],
+                "offered_rate": float(phase["offered_rate"]),
+                "duration_s": duration_s,
+                "sent": phase_sent,
+                "received": int((values & matched).sum()),
+                "lost": phase_lost,
+                "loss_percent": 100.0 * phase_lost / phase_sent if phase_sent else 0.0,
+                "sent_rate": phase_sent / duration_s if duration_s > 0 else float("nan"),
+                "p50_ms": LatencyReport.to_ms(histogram.value_at_percentile(50)),
+                "p99_ms": LatencyReport.to_ms(histogram.value_at_percentile(99)),
+                "max_ms": LatencyReport.to_ms(histogram.max_ns),
+            })
+        load = pd.DataFrame(rows)
+        knee = ResultReporter.find_knee(load)
+        load["knee"] = load.index == knee
+        print("Load profile ({} phases, {}):".format(len(load), profile_file))
+        for position, row in load.iterrows():
+            print("  {mark} {phase:>3} {name:<22} offered {offered_rate:>9.1f}/s sent {sent_rate:>9.1f}/s  {sent:>8} sent "
+                  "{lost:>7} lost ({loss_percent:5.1f} %)  p50 {p50} p99 {p99} max {max} ms".format(
+                      mark=">" if row["knee"] else " ", p50=ResultReporter.format_ms(row["p50_ms"]),
+                      p99=ResultReporter.format_ms(row["p99_ms"]), max=ResultReporter.format_ms(row["max_ms"]), **row))
+        if knee is None:
+            print("No knee: every phase kept up with its offered load")
         else:
-            # Otherwise, create a new file or overwrite the existing one if mode is SENSOR
-            with pd.ExcelWriter(excel_file_path, engine='xlsxwriter') as writer:
-                # Add time and value
-                df.to_excel(writer, index=False, sheet_name='Data', startrow=1, startcol=start_col, header=False)
-                # Display the colmun name
-                workbook = writer.book
-                worksheet = writer.sheets['Data']
-                for col_num, value in enumerate(ResultReporter.excel_row_names):
-                    worksheet.write(0, col_num, value)
-    
+            print("Knee at phase {} ({}, offered {:g}/s)".format(load["phase"][knee], load["name"][knee], load["offered_rate"][knee]))
+        os.makedirs(ResultReporter.results_folder, exist_ok=True)
+        date = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(ResultReporter.results_folder, "{}-load-{}.csv".format(broker_name, date))
+        load.to_csv(path, index=False, float_format="%.6f")
+        print("Load report saved in {}".format(path))
+        return path
 
     @staticmethod
-    def calculate_deltas(broker_name, df, excel_file_path):
-        # As, mentionned earlier, here df only have acces to receiver_time and receiver_value
-        # However, in order to calculate the delta, i need to get sender_time => let's read it from the file
-        book = load_workbook(excel_file_path)
-        sheet = book['Data']
+    def find_knee(load):
+        # Index of the first saturated phase of a load report (see KNEE_LOSS_PERCENT...), None if there is none
+        baseline_ms = load["p99_ms"].dropna()
+        baseline_ms = baseline_ms.iloc[0] if len(baseline_ms) else None
+        for position, row in load.iterrows():
+            if row["loss_percent"] > ResultReporter.KNEE_LOSS_PERCENT:
+                return position
+            if baseline_ms and pd.notna(row["p99_ms"]) and row["p99_ms"] > ResultReporter.KNEE_LATENCY_FACTOR * baseline_ms:
+                return position
+            if pd.notna(row["sent_rate"]) and row["sent_rate"] < ResultReporter.KNEE_RATE_RATIO * row["offered_rate"]:
+                return position
+        return None
 
-        sender_time_col = ExcelGeneratorConstant.get_col_position_on_excel(ExcelGeneratorConstant.SENDER_TIME)+1
-        sender_times = [sheet.cell(row=i, column=sender_time_col).value for i in range(2, sheet.max_row + 1)]
+    @staticmethod
+    def format_ms(value_ms):
+        return "{:8.3f}".format(value_ms) if value_ms is not None and pd.notna(value_ms) else "       -"
 
-        # Convert to datetime
-        sender_times = pd.to_datetime(sender_times, format='%H:%M:%S.%f')
-        receiver_times = pd.to_datetime(df[ExcelGeneratorConstant.RECEIVER_TIME], format='%H:%M:%S.%f')
+    @staticmethod
+    def merge_latency_reports(paths):
+        # Merges the latency reports (JSON) of several runs or sensors into one
+        merged = LatencyReport.merge_files(paths)
+        return merged.save(ResultReporter.results_folder)
 
-        # Calculate the time differences and add the mqtt_transit column
-        mqtt_transit_times = (receiver_times - sender_times).dt.total_seconds()
-        mqtt_transit_col = ExcelGeneratorConstant.get_col_position_on_excel(ExcelGeneratorConstant.MQTT_TRANSIT)+1
+    # ---------------------------------------------------- RECORDS ----------------------------------------------------
 
-        for i, mqtt_transit in enumerate(mqtt_transit_times, start=2):
-            sheet.cell(row=i, column=mqtt_transit_col, value=mqtt_transit)
+    @staticmethod
+    def read_results_file(path):
+        # Values of a file streamed by StreamingResultWriter (timestamp_ns, seq, value), answers (seq -1) are left out
+        df = pd.read_csv(path, dtype={"timestamp_ns": "int64", "seq": "int64", "value": "string"})
+        df = df[df["seq"] >= 0]
+        return pd.DataFrame({"timestamp_ns": df["timestamp_ns"], "seq": df["seq"],
+                             "value": pd.to_numeric(df["value"], errors="coerce")})
+
+    @staticmethod
+    def records_to_frame(records):
+        # Values of a mode, answers left out: a RecordStore, or (timestamp_ns, value) pairs without sequence numbers
+        # (numbered in order, which falls back to the historical row alignment)
+        if isinstance(records, RecordStore):
+            columns = records.to_columns()
+            df = pd.DataFrame({"timestamp_ns": np.frombuffer(columns["timestamp"], dtype=np.int64),
+                               "seq": np.frombuffer(columns["seq"], dtype=np.int64),
+                               "value": np.frombuffer(columns["value"], dtype=np.float64)})
+            df = df[(np.frombuffer(columns["kind"], dtype=np.int8) == RecordStore.KIND_VALUE) & (df["seq"] >= 0)]
+            return df.reset_index(drop=True)
+        return pd.DataFrame([(timestamp_ns, seq, value) for seq, (timestamp_ns, value) in enumerate(records)
+                             if not isinstance(value, str)], columns=["timestamp_ns", "seq", "value"])
 
-        book.save(excel_file_path)
-        ResultReporter.add_chart_to_excel(broker_name, df, excel_file_path)
+    @staticmethod
+    def match_by_sequence(sent, received, clock=None):
+        # sent, received: DataFrames (timestamp_ns, seq, value). Returns the report (one row per sequence number, the
+        # first reception of each value) and the statistics of the run.
+        # clock: optional ClockSync of the run, the sender times are then moved to the receiver clock
+        received_seq = received["seq"]
+        duplicated = received_seq.duplicated()
+        # A value is reordered when it arrives after a value with a greater sequence number
+        reordered = (received_seq < received_seq.cummax().shift(fill_value=-1)) & ~duplicated
+
+        sent = sent.drop_duplicates("seq").astype({"timestamp_ns": "Int64"})
+        received = received[~duplicated].astype({"timestamp_ns": "Int64"})
+        report = sent.merge(received, on="seq", how="outer", suffixes=("_sender", "_receiver"), sort=True)
+        report = report.rename(columns={
+            "timestamp_ns_sender": ExcelGeneratorConstant.SENDER_TIME_NS,
+            "value_sender": ExcelGeneratorConstant.SENDER_VALUE,
+            "timestamp_ns_receiver": ExcelGeneratorConstant.RECEIVER_TIME_NS,
+            "value_receiver": ExcelGeneratorConstant.RECEIVER_VALUE,
+        })
+        clock_stats = ResultReporter.apply_clock_correction(report, clock)
+        # Integer subtraction first: epoch nanoseconds do not fit in a float64 without losing precision
+        transit_ns = report[ExcelGeneratorConstant.RECEIVER_TIME_NS] - report[ExcelGeneratorConstant.SENDER_TIME_NS]
+        report[ExcelGeneratorConstant.MQTT_TRANSIT] = transit_ns.astype("Float64") / 1e9
+        report[ExcelGeneratorConstant.SENDER_TIME] = ResultReporter.excel_times(report[ExcelGeneratorConstant.SENDER_TIME_NS])
+        report[ExcelGeneratorConstant.RECEIVER_TIME] = ResultReporter.excel_times(report[ExcelGeneratorConstant.RECEIVER_TIME_NS])
 
+        matched = transit_ns.notna()
+        transit = report[ExcelGeneratorConstant.MQTT_TRANSIT][matched]
+        stats = {
+            "sent": len(sent),
+            "received": int(len(received_seq)),
+            "matched": int(matched.sum()),
+            "lost": int((report[ExcelGeneratorConstant.SENDER_TIME_NS].notna() & report[ExcelGeneratorConstant.RECEIVER_TIME_NS].isna()).sum()),
+            "duplicates": int(duplicated.sum()),
+            "reordered": int(reordered.sum()),
+            # Received values the sensor has no record of (e.g. dropped by its ring buffer)
+            "unknown": int((report[ExcelGeneratorConstant.SENDER_TIME_NS].isna()).sum()),
+            "transit_min_s": float(transit.min()) if len(transit) else None,
+            "transit_mean_s": float(transit.mean()) if len(transit) else None,
+            "transit_max_s": float(transit.max()) if len(transit) else None,
+        }
+        stats.update(clock_stats)
+        return report[ResultReporter.excel_row_names], stats
 
     @staticmethod
-    def add_chart_to_excel(broker_name, df, excel_file_path):
-        # Load the existing file
-        book = load_workbook(excel_file_path)
-        sheet = book['Data']
-        
-        # Create a scatter chart
-        chart = ScatterChart()
-        chart.title = "Transmission time of the nth data sent through the broker {}".format(broker_name)
-        chart.x_axis.title = 'nth data sending'
-        chart.y_axis.title = 'transmission time (seconds)'
+    def apply_clock_correction(report, clock):
+        # Sender and receiver on different machines: each sender time is corrected by the offset of the sender clock at
+        # that time (offset and drift estimated by ClockSync). The transit times are then only known within
+        # +/- clock_error_ms, reported with them. Returns the statistics of the correction (none without estimate).
+        estimate = clock.estimate() if clock is not None else None
+        if estimate is None:
+            return {}
+        sender = report[ExcelGeneratorConstant.SENDER_TIME_NS]
+        known = sender.notna()
+        corrected = sender.copy()
+        corrected[known] = sender[known].to_numpy(dtype=np.int64) - clock.offset_at(sender[known].to_numpy(dtype=np.int64))
+        report[ExcelGeneratorConstant.SENDER_TIME_NS] = corrected
+        return {
+            "clock_offset_ms": estimate["offset_ns"] / 1e6,
+            "clock_drift_ppm": estimate["drift_ppm"],
+            "clock_error_ms": estimate["error_bound_ns"] / 1e6,
+            "clock_exchanges": estimate["exchanges"],
+        }
 
-        # Configure the chart series from the DataFrame data
-        sender_time_col = ExcelGeneratorConstant.get_col_position_on_excel(ExcelGeneratorConstant.SENDER_TIME) + 1
-        mqtt_transit_col = ExcelGeneratorConstant.get_col_position_on_excel(ExcelGeneratorConstant.MQTT_TRANSIT) + 1
+    @staticmethod
+    def excel_times(times_ns):
+        # Local times as Excel date numbers (days since 1899-12-30), vectorized: much cheaper to compute and to write
+        # than formatted strings, displayed with excel_time_format
+        utc_offset_ns = int(datetime.datetime.now().astimezone().utcoffset().total_seconds() * 1e9)
+        return (times_ns + utc_offset_ns).astype("Float64") / (86400 * 1e9) + ResultReporter.EXCEL_EPOCH_DAYS
 
-        x_values = Reference(sheet, min_col=sender_time_col, min_row=2, max_row=sheet.max_row)
-        y_values = Reference(sheet, min_col=mqtt_transit_col, min_row=2, max_row=sheet.max_row)
+    @staticmethod
+    def print_stats(broker_name, stats):
+        print("Broker {}: {sent} sent, {received} received, {matched} matched, {lost} lost, {duplicates} duplicates, "
+              "{reordered} reordered, {unknown} unknown".format(broker_name, **stats))
+        if stats["matched"]:
+            print("Transit time (seconds): min {transit_min_s:.6f}, mean {transit_mean_s:.6f}, max {transit_max_s:.6f}".format(**stats))
+        if "clock_error_ms" in stats:
+            print("Sender clock corrected: offset {clock_offset_ms:+.3f} ms, drift {clock_drift_ppm:+.2f} ppm, "
+                  "transit times within +/- {clock_error_ms:.3f} ms ({clock_exchanges} exchanges)".format(**stats))
 
-        series = Series(y_values, x_values, title_from_data=False)
-        chart.series.append(series)
+    # ---------------------------------------------------- EXCEL ----------------------------------------------------
 
-        chart.width = 30  # Largeur en pouces
-        chart.height = 20  # Hauteur en pouces
+    @staticmethod
+    def generate_excel(broker_name, mode, received_values, clock=None):
+        # Called at the end of a run (Ctrl+C, save): each side saves its values in an intermediate columnar file, the
+        # server (which runs last) matches them with the sensor ones and writes the whole workbook in one pass.
+        # clock: ClockSync of the server, if any (the sensor ran on another machine)
+        df = ResultReporter.records_to_frame(received_values)
+        columns_file_path = ResultReporter.save_columns(broker_name, mode, df)
+        if mode != MqttAppConstants.MODE_SERVER:
+            print("{} values saved in {}, the Excel file is written by the server".format(len(df), columns_file_path))
+            return
+        sensor_columns_file_path = ResultReporter.get_columns_file_path(broker_name, MqttAppConstants.MODE_SENSOR)
+        if not os.path.exists(sensor_columns_file_path):
+            print("No sensor values in {}, save the sensor first (or use the report mode)".format(sensor_columns_file_path))
+            return
+        report, stats = ResultReporter.match_by_sequence(ResultReporter.load_columns(sensor_columns_file_path), df, clock)
+        ResultReporter.write_report(broker_name, report, stats)
+        ResultReporter.generate_latency_report(broker_name, report, stats)
 
-        # Add the chart to the sheet
-        sheet.add_chart(chart, "G6")
+    # ---------------------------------------------------- INTERMEDIATE FILES ----------------------------------------------------
 
-        # Sauvegarder les modifications
-        book.save(excel_file_path)
-        print(f"Le graphique a été ajouté à {excel_file_path}")
\ No newline at end of file
+    @staticmethod
+    def get_columns_file_path(broker_name, mode):
+        return os.path.join(ResultReporter.results_folder, "{}-{}-values.npz".format(broker_name, mode))
+
+    @staticmethod
+    def save_columns(broker_name, mode, df):
+        # One binary array per column (timestamp_ns, seq, value): written and read back without any parsing
+        os.makedirs(ResultReporter.results_folder, exist_ok=True)
+        path = ResultReporter.get_columns_file_path(broker_name, mode)
+        np.savez(path, **{column: df[column].to_numpy() for column in ("timestamp_ns", "seq", "value")})
+        return path
+
+    @staticmethod
+    def load_columns(path):
+        with np.load(path) as columns:
+            return pd.DataFrame({column: columns[column] for column in ("timestamp_ns", "seq", "value")})
+
+    # ---------------------------------------------------- EXCEL ----------------------------------------------------
+
+    @staticmethod
+    def get_excel_file_path(broker_name):
+        # Create a folder to store the results if it doesn't exist
+        if not os.path.exists(ResultReporter.results_folder):
+            os.makedirs(ResultReporter.results_folder)
+        return os.path.join(ResultReporter.results_folder, f"{broker_name}.xlsx")
+
+    @staticmethod
+    def write_report(broker_name, report, stats):
+        # The workbook is written ONCE, row after row, in xlsxwriter's constant memory mode (each row is flushed to
+        # disk as soon as the next one starts): the time and memory grow linearly with the number of values and the
+        # file is never read back.
+        excel_file_path = ResultReporter.get_excel_file_path(broker_name)
+        if len(report) > ResultReporter.excel_max_rows:
+            print("Warning: {} values, only the first {} fit in the Excel file (see the latency report for all of them)"
+                  .format(len(report), ResultReporter.excel_max_rows))
+            report = report.iloc[:ResultReporter.excel_max_rows]
+
+        # Excel numbers are float64: the nanosecond times are written as text to stay exact. Missing values (lost,
+        # unknown) become empty cells.
+        report = report.astype({ExcelGeneratorConstant.SENDER_TIME_NS: "string", ExcelGeneratorConstant.RECEIVER_TIME_NS: "string"})
+        workbook = xlsxwriter.Workbook(excel_file_path, {'constant_memory': True})
+        sheet = workbook.add_worksheet(ResultReporter.sheet_name)
+        sheet.write_row(0, 0, ResultReporter.excel_row_names)
+        # Each column is written with its typed method (no type guessing per cell)
+        time_format = workbook.add_format({'num_format': ResultReporter.excel_time_format})
+        text_columns = {ExcelGeneratorConstant.SENDER_TIME_NS, ExcelGeneratorConstant.RECEIVER_TIME_NS}
+        time_columns = {ExcelGeneratorConstant.SENDER_TIME, ExcelGeneratorConstant.RECEIVER_TIME}
+        writers = []
+        for col, name in enumerate(ResultReporter.excel_row_names):
+            write = sheet.write_string if name in text_columns else sheet.write_number
+            writers.append((col, write, time_format if name in time_columns else None,
+                            report[name].astype(object).where(report[name].notna(), None).tolist()))
+        for row in range(len(report)):
+            for col, write, cell_format, values in writers:
+                value = values[row]
+                if value is not None:
+                    write(row + 1, col, value, cell_format)
+        sheet.set_column(ResultReporter.excel_row_names.index(ExcelGeneratorConstant.SENDER_TIME),
+                         ResultReporter.excel_row_names.index(ExcelGeneratorConstant.RECEIVER_TIME), 14)
+
+        summary = workbook.add_worksheet(ResultReporter.summary_sheet_name)
+        summary.write_row(0, 0, ["metric", "value"])
+        for row, (metric, value) in enumerate(stats.items(), start=1):
+            summary.write_row(row, 0, [metric, value])
+
+        if len(report) <= ResultReporter.chart_max_points:
+            ResultReporter.add_chart_to_excel(broker_name, len(report), workbook, sheet)
+        else:
+            print("{} values: no chart in the Excel file, see the latency report".format(len(report)))
+        workbook.close()
+        ResultReporter.print_stats(broker_name, stats)
+        print("{} rows saved in {}".format(len(report), excel_file_path))
+
+    @staticmethod
+    def add_chart_to_excel(broker_name, row_count, workbook, sheet):
+        # Create a scatter chart
+        chart = workbook.add_chart({'type': 'scatter'})
+        chart.set_title({'name': "Transmission time of the nth data sent through the broker {}".format(broker_name)})
+        chart.set_x_axis({'name': 'nth data sending (sequence number)'})
+        chart.set_y_axis({'name': 'transmission time (seconds)'})
+
+        # Configure the chart series from the DataFrame data
+        seq_col = ExcelGeneratorConstant.get_col_position_on_excel(ExcelGeneratorConstant.SEQ)
+        mqtt_transit_col = ExcelGeneratorConstant.get_col_position_on_excel(ExcelGeneratorConstant.MQTT_TRANSIT)
+        last_row = row_count
+        chart.add_series({
+            'name': ExcelGeneratorConstant.MQTT_TRANSIT,
+            'categories': [ResultReporter.sheet_name, 1, seq_col, last_row, seq_col],
+            'values': [ResultReporter.sheet_name, 1, mqtt_transit_col, last_row, mqtt_transit_col],
+            'marker': {'type': 'circle', 'size': 3},
+        })
+        chart.set_legend({'none': True})
+        chart.set_size({'width': 1400, 'height': 900})
+
+        # Add the chart to the sheet
+        sheet.insert_chart("J6", chart)
+        print(f"Le graphique a été ajouté à {workbook.filename}")
@@ -0,0 +1,119 @@
+import csv
+import datetime
+import os
+import queue
+import threading
+import time
+
+# StreamingResultWriter saves the records WHILE the run is in progress, in an append-friendly CSV file
+# (timestamp_ns, seq, value), instead of keeping them in memory until Ctrl+C. A crash loses at most the last chunk.
+#
+# The hot path (Mode.add_time_value_pairs) only appends a tuple to a local chunk; full chunks are handed over to a
+# background thread through a BOUNDED queue (one lock operation per chunk, not per record). If the disk cannot follow
+# and the queue is full, the chunk is dropped and counted rather than blocking the MQTT thread (which would skew the
+# measured latencies). The background thread also asks for a partial chunk every flush_interval seconds so that slow
+# streams reach the disk too.
+#
+# The Excel report is now an optional post-processing step over these files (see ResultReporter / report mode).
+class StreamingResultWriter:
+
+    HEADER = ("timestamp_ns", "seq", "value")
+
+    def __init__(self, path, chunk_size=1000, max_pending_chunks=100, flush_interval=1.0):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.chunk = []
+        self.flush_requested = False
+        self.chunks = queue.Queue(maxsize=max_pending_chunks)
+        self.written = 0
+        self.dropped = 0
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.file = open(path, "w", newline="")
+        self.csv_writer = csv.writer(self.file)
+        self.csv_writer.writerow(StreamingResultWriter.HEADER)
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self.write_chunks, name="result-writer", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def build_path(results_folder, broker_name, mode):
+        # One file per run: results/<broker>-<mode>-<date>.csv
+        date = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        return os.path.join(results_folder, "{}-{}-{}.csv".format(broker_name, mode, date))
+
+    # ---------------------------------------------------- PRODUCER SIDE (hot path) ----------------------------------------------------
+
+    def append(self, timestamp_ns, value, seq=-1):
+        self.chunk.append((timestamp_ns, seq, value))
+        if len(self.chunk) >= self.chunk_size or self.flush_requested:
+            self.hand_over()
+
+    def hand_over(self, block=False):
+        # block: wait for room in the queue instead of dropping the chunk (close(), off the hot path)
+        chunk, self.chunk = self.chunk, []
+        self.flush_requested = False
+        if not chunk:
+            return
+        try:
+            self.chunks.put(chunk, block=block)
+        except queue.Full:
+            self.dropped += len(chunk)
+
+    # ---------------------------------------------------- WRITER THREAD ----------------------------------------------------
+
+    def write_chunks(self):
+        last_flush_request = time.monotonic()
+        while True:
+            try:
+                chunk = self.chunks.get(timeout=self.flush_interval)
+            except queue.Empty:
+                chunk = None
+            if chunk is None:
+                # Timeout or wake-up sent by close()
+                if self.closed.is_set() and self.chunks.empty():
+                    break
+            else:
+                self.csv_writer.writerows(chunk)
+                self.file.flush()
+                self.written += len(chunk)
+            if time.monotonic() - last_flush_request >= self.flush_interval:
+                # The producer hands its partial chunk over on its next record
+                self.flush_requested = True
+                last_flush_request = time.monotonic()
+        self.file.close()
+
+    def close(self):
+        # Writes everything that is pending and waits for the writer thread
+        if self.closed.is_set():
+            return
+        self.hand_over(block=True)
+        self.closed.set()
+        self.chunks.put(None) # wakes the writer thread up
+        self.thread.join()
+        if self.dropped:
+            print("Warning: {} records could not be written (writer queue full)".format(self.dropped))
+        print("{} records saved in {}".format(self.written, self.path))
+
+    @staticmethod
+    def read_records(path):
+        # (timestamp_ns, seq, value) rows of a file written by this class, values converted back to numbers when possible
+        records = []
+        with open(path, newline="") as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for timestamp_ns, seq, value in reader:
+                records.append((int(timestamp_ns), int(seq), StreamingResultWriter.parse_value(value)))
+        return records
+
+    @staticmethod
+    def parse_value(value):
+        for convert in (int, float):
+            try:
+                return convert(value)
+            except ValueError:
+                pass
+        return value
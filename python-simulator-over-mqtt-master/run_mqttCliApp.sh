@@ -1,8 +1,8 @@
 #!/bin/bash
 
-# Check arguments number (we can deal with 0, 2 or "tandem" with a broker)
-if [ "$#" -ne 0 ] && [ "$#" -ne 2 ] && ([ "$#" -ne 2 ] || [ "$1" != "duo" ]); then
-    echo "Usage: ./mqttCliApp.sh [mode] [broker] | duo [broker]"
+# Check arguments number (we can deal with 0, 2 (+ options for some modes like fleet) or "tandem" with a broker)
+if [ "$#" -eq 1 ] || ([ "$1" == "duo" ] && [ "$#" -ne 2 ]); then
+    echo "Usage: ./mqttCliApp.sh [mode] [broker] [options] | duo [broker]"
     exit 1
 fi
 
@@ -34,7 +34,5 @@ elif [ "$1" == "duo" ]; then
     open_terminal_and_run "python3 mqttCliApp.py sensor $BROKER"
     open_terminal_and_run "python3 mqttCliApp.py server $BROKER"
 else
-    MODE=$1
-    BROKER=$2
-    python3 mqttCliApp.py $MODE $BROKER
+    python3 mqttCliApp.py "$@"
 fi
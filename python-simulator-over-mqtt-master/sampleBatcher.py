@@ -0,0 +1,75 @@
+import time
+
+# SampleBatcher packs several consecutive samples into ONE message (opt-in).
+# At ECG rates (250 Hz and more) one MQTT message per sample means that the broker and TCP overheads dominate, a batch
+# only costs one message: {"timestamp": base, "period": period, "values": [v0, v1, ...]}
+# - base: timestamp (microseconds) of the first sample of the batch
+# - period: nominal time beetween two samples (microseconds), the i-th sample was produced at base + i * period
+# - seq: sequence number of the first sample, the i-th sample has the sequence number seq + i
+# A batch is either K samples or T milliseconds of samples (converted into K thanks to the rate).
+# When the rate of the publisher changes (load profile, adaptive publish window), follow_rate() closes the pending batch
+# (its samples were produced at the old period) and computes the period, and the size of a batch in milliseconds, again.
+class SampleBatcher:
+
+    def __init__(self, rate, size=None, window_ms=None):
+        if size is None and window_ms is None:
+            raise ValueError("A batch needs a size or a duration")
+        self.fixed_size = size
+        self.window_ms = window_ms
+        self.set_rate(rate)
+        self.values = []
+        self.base_timestamp = None
+        self.base_seq = None
+
+    @staticmethod
+    def from_spec(rate, spec):
+        # spec: "25" (25 values per message), "40ms" (40 milliseconds of values per message), "", "1" or "0ms" (no batching)
+        spec = spec.strip().lower()
+        if not spec:
+            return None
+        if spec.endswith("ms"):
+            window_ms = float(spec[:-2])
+            if window_ms <= 0:
+                return None
+            return SampleBatcher(rate, window_ms=window_ms)
+        size = int(spec)
+        if size <= 1:
+            return None
+        return SampleBatcher(rate, size=size)
+
+    def set_rate(self, rate):
+        self.rate = rate
+        self.period_us = int(1e6 / rate)
+        self.size = self.fixed_size if self.fixed_size is not None else max(1, round(self.window_ms * rate / 1000))
+
+    def follow_rate(self, rate):
+        # Called before each sample with the current rate of the scheduler (a comparison most of the time). Returns the
+        # pending batch, to be published, when the rate changed and None otherwise.
+        if rate == self.rate:
+            return None
+        batch = self.flush()
+        self.set_rate(rate)
+        return batch
+
+    def add(self, value, seq):
+        # Returns a full batch (base_timestamp, period_us, values, base_seq) or None if the batch is not full yet
+        if not self.values:
+            self.base_timestamp = time.time_ns() // 1000
+            self.base_seq = seq
+        self.values.append(value)
+        if len(self.values) >= self.size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        # Returns the pending (incomplete) batch, or None if it is empty. Called when the publication stops.
+        if not self.values:
+            return None
+        batch = (self.base_timestamp, self.period_us, self.values, self.base_seq)
+        self.values = []
+        return batch
+
+    @staticmethod
+    def sample_timestamps(base_timestamp, period_us, count):
+        # Timestamps (microseconds) of each sample of a batch
+        return [base_timestamp + i * period_us for i in range(count)]
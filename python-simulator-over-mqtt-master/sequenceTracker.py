@@ -0,0 +1,71 @@
+from bisect import bisect_right
+
+# SequenceTracker follows the sequence numbers of the values received from ONE sensor, online: the online version of
+# ResultReporter.match_by_sequence, used by the ward mode (SensorState) and the live statistics (TopicStats).
+#   - lost: values skipped in the sequence numbers and not received since
+#   - late: values received after a value with a higher sequence number, that filled a gap (reordered)
+#   - duplicates: values received twice (e.g. QoS 1 redelivery), they fill no gap and are not late
+#   - gaps, max_gap: number and largest size of the holes seen in the sequence numbers
+# The holes still open are kept as [start, end) ranges, so that only a value really missing is taken off lost. At most
+# MAX_OPEN_GAPS ranges are kept (a few KB per sensor): beyond, the oldest ones are forgotten and their values stay lost
+# for good, a value that arrives below them is counted as late (it cannot be told from a duplicate any more).
+class SequenceTracker:
+    __slots__ = ("max_seq", "lost", "late", "duplicates", "gaps", "max_gap", "gap_starts", "gap_ends", "horizon")
+
+    MAX_OPEN_GAPS = 1024
+
+    def __init__(self):
+        self.max_seq = -1
+        self.lost = 0
+        self.late = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.max_gap = 0
+        # Open holes, sorted and disjoint: gap_starts[i] <= missing sequence numbers < gap_ends[i]
+        self.gap_starts = []
+        self.gap_ends = []
+        self.horizon = 0 # sequence numbers below are not tracked any more (forgotten holes)
+
+    def track(self, seq, count):
+        # count values with the sequence numbers seq, seq + 1, ... (one message: a value or a batch)
+        end = seq + count
+        if end > self.max_seq + 1:
+            first_new = max(seq, self.max_seq + 1)
+            gap = first_new - self.max_seq - 1
+            if gap:
+                self.gaps += 1
+                self.max_gap = max(self.max_gap, gap)
+                self.lost += gap
+                self.gap_starts.append(self.max_seq + 1)
+                self.gap_ends.append(first_new)
+                if len(self.gap_starts) > SequenceTracker.MAX_OPEN_GAPS:
+                    self.horizon = self.gap_ends[0]
+                    del self.gap_starts[0], self.gap_ends[0]
+            self.max_seq = end - 1
+            end = first_new
+        if seq < end:
+            self.fill(seq, end)
+
+    def fill(self, start, end):
+        # [start, end) is at or below max_seq: the values of an open hole are late, the others are duplicates
+        if start < self.horizon:
+            forgotten = min(end, self.horizon) - start
+            self.late += forgotten
+            start += forgotten
+        filled = 0
+        index = max(0, bisect_right(self.gap_starts, start) - 1)
+        while index < len(self.gap_starts) and self.gap_starts[index] < end:
+            gap_start, gap_end = self.gap_starts[index], self.gap_ends[index]
+            low, high = max(start, gap_start), min(end, gap_end)
+            if low >= high:
+                index += 1
+                continue
+            filled += high - low
+            # What is left of the hole: nothing, its lower part, its upper part or both
+            pieces = [piece for piece in ((gap_start, low), (high, gap_end)) if piece[0] < piece[1]]
+            self.gap_starts[index:index + 1] = [piece_start for piece_start, _ in pieces]
+            self.gap_ends[index:index + 1] = [piece_end for _, piece_end in pieces]
+            index += len(pieces)
+        self.late += filled
+        self.lost -= filled
+        self.duplicates += max(0, end - start) - filled
@@ -0,0 +1,206 @@
+from abc import ABC, abstractmethod
+import numpy as np
+from constants import MqttAppConstants
+
+# Signal generators produce the values published by the sensors, in NumPy BLOCKS computed ahead of the publication:
+# one vectorized call computes block_size samples, converted once to Python numbers, and the publishing loop only takes
+# the next item of that list (no random.randint or model evaluation per sample).
+#
+# Spec (option --signal of the sensor, "signal" of the fleet): "<kind>" or "<kind>:<option>=<value>,..."
+#   random                         integers in [1, 100] (historical behaviour)
+#   ordered                        1, 2, 3...
+#   ecg:heart_rate=70,hrv=0.05     synthetic ECG (PQRST waves, heart rate variability), in mV
+#   sine:frequency=1,noise=0.1     sine wave plus gaussian noise
+#   noise                          gaussian noise
+# Options shared by every kind: amplitude, offset (value = offset + amplitude * signal), dtype (int16, int32, float32,
+# float64: integer types are rounded, e.g. ecg:amplitude=1000,offset=2048,dtype=int16 for ADC-like values), seed.
+class SignalGenerator(ABC):
+
+    DTYPES = ("int16", "int32", "int64", "float32", "float64")
+    MIN_BLOCK = 64
+    MAX_BLOCK = 8192
+
+    def __init__(self, rate, amplitude=1.0, offset=0.0, dtype="float64", seed=None, block_size=None):
+        if dtype not in SignalGenerator.DTYPES:
+            raise ValueError("Invalid dtype {}, use one of {}".format(dtype, SignalGenerator.DTYPES))
+        self.rate = rate
+        self.amplitude = amplitude
+        self.offset = offset
+        self.dtype = np.dtype(dtype)
+        self.random = np.random.default_rng(seed)
+        # About one second of samples: small enough for thousands of fleet sensors, large enough to amortize NumPy
+        self.block_size = block_size or int(min(max(rate, SignalGenerator.MIN_BLOCK), SignalGenerator.MAX_BLOCK))
+        self.sample_index = 0 # index of the first sample of the next block
+        self.block = []
+        self.position = 0
+
+    @staticmethod
+    def from_spec(rate, spec):
+        kind, _, options_text = spec.strip().lower().partition(":")
+        options = {}
+        for option in filter(None, options_text.split(",")):
+            key, _, value = option.partition("=")
+            options[key.strip()] = value.strip() if key.strip() == "dtype" else float(value)
+        if "seed" in options:
+            options["seed"] = int(options["seed"])
+        try:
+            generator_class = SignalGenerator.get_generator_classes()[kind]
+        except KeyError:
+            raise ValueError("Invalid signal {}, use one of {}".format(kind, MqttAppConstants.get_signals()))
+        return generator_class(rate, **options)
+
+    @staticmethod
+    def get_generator_classes():
+        return {
+            MqttAppConstants.SIGNAL_RANDOM: RandomSignal,
+            MqttAppConstants.SIGNAL_ORDERED: OrderedSignal,
+            MqttAppConstants.SIGNAL_ECG: EcgSignal,
+            MqttAppConstants.SIGNAL_SINE: SineSignal,
+            MqttAppConstants.SIGNAL_NOISE: NoiseSignal,
+        }
+
+    # ---------------------------------------------------- PUBLICATION (hot path) ----------------------------------------------------
+
+    def next_value(self):
+        if self.position == len(self.block):
+            self.refill()
+        value = self.block[self.position]
+        self.position += 1
+        return value
+
+    def refill(self):
+        times = (self.sample_index + np.arange(self.block_size)) / self.rate
+        values = self.offset + self.amplitude * self.compute(times)
+        if self.dtype.kind == "i":
+            values = np.round(values)
+        self.block = values.astype(self.dtype).tolist()
+        self.position = 0
+        self.sample_index += self.block_size
+
+    # ---------------------------------------------------- MODELS ----------------------------------------------------
+
+    @abstractmethod
+    def compute(self, times):
+        # times: float64 array, seconds since the first sample. Returns the signal (before amplitude and offset).
+        pass
+
+
+class RandomSignal(SignalGenerator):
+
+    def __init__(self, rate, dtype="int64", **options):
+        super().__init__(rate, dtype=dtype, **options)
+
+    def compute(self, times):
+        return self.random.integers(1, 101, size=len(times)).astype(np.float64)
+
+
+class OrderedSignal(SignalGenerator):
+
+    def __init__(self, rate, dtype="int64", **options):
+        super().__init__(rate, dtype=dtype, **options)
+
+    def compute(self, times):
+        return self.sample_index + 1 + np.arange(len(times), dtype=np.float64)
+
+
+class SineSignal(SignalGenerator):
+
+    def __init__(self, rate, frequency=1.0, noise=0.0, **options):
+        super().__init__(rate, **options)
+        self.frequency = frequency
+        self.noise = noise # standard deviation, relative to the amplitude of the sine
+
+    def compute(self, times):
+        values = np.sin(2 * np.pi * self.frequency * times)
+        if self.noise:
+            values += self.random.normal(0.0, self.noise, len(times))
+        return values
+
+
+class NoiseSignal(SignalGenerator):
+
+    def compute(self, times):
+        return self.random.standard_normal(len(times))
+
+
+class EcgSignal(SignalGenerator):
+    # Each heart beat is the sum of 5 gaussian waves around its R peak (time from the R peak and width in seconds at
+    # 60 bpm, amplitude in mV). P and T move away from the R peak when the beat is longer (Bazett: sqrt of the RR).
+    WAVES = (
+        # name, time, amplitude, width, scaled with the RR interval
+        ("P", -0.20, 0.15, 0.025, True),
+        ("Q", -0.05, -0.15, 0.010, False),
+        ("R", 0.00, 1.00, 0.012, False),
+        ("S", 0.05, -0.25, 0.010, False),
+        ("T", 0.30, 0.30, 0.060, True),
+    )
+    RESPIRATION_HZ = 0.25 # respiratory sinus arrhythmia
+
+    def __init__(self, rate, heart_rate=70.0, hrv=0.05, noise=0.0, **options):
+        super().__init__(rate, **options)
+        self.heart_rate = heart_rate
+        self.hrv = hrv       # standard deviation of the RR intervals, relative to their mean
+        self.noise = noise   # gaussian noise, in mV
+        # R peaks (seconds) and RR interval of each beat, extended block after block
+        self.beat_times = np.array([-60.0 / heart_rate, 0.3])
+        self.beat_rr = np.full(2, 60.0 / heart_rate)
+
+    def extend_beats(self, until):
+        # RR intervals: mean + random variability + respiratory modulation, drawn by groups of beats
+        mean_rr = 60.0 / self.heart_rate
+        while self.beat_times[-1] < until:
+            count = max(8, int((until - self.beat_times[-1]) / mean_rr) + 2)
+            rr = mean_rr * (1 + self.hrv * self.random.standard_normal(count))
+            # Phase of the respiration taken at the beat times before modulation (close enough)
+            times = self.beat_times[-1] + np.cumsum(np.clip(rr, 0.3, 2.0))
+            rr = np.clip(rr * (1 + 0.5 * self.hrv * np.sin(2 * np.pi * EcgSignal.RESPIRATION_HZ * times)), 0.3, 2.0)
+            times = self.beat_times[-1] + np.cumsum(rr)
+            self.beat_times = np.concatenate((self.beat_times, times))
+            self.beat_rr = np.concatenate((self.beat_rr, rr))
+
+    def compute(self, times):
+        self.extend_beats(times[-1] + 1.0)
+        # Only the beats around the block are kept
+        first = max(0, np.searchsorted(self.beat_times, times[0] - 2.0) - 1)
+        self.beat_times, self.beat_rr = self.beat_times[first:], self.beat_rr[first:]
+        # Every sample sums the waves of the previous and of the next R peak (the T wave of one, the P wave of the other)
+        next_beat = np.searchsorted(self.beat_times, times)
+        values = np.zeros(len(times))
+        for beat in (next_beat - 1, next_beat):
+            beat_time, scale = self.beat_times[beat], np.sqrt(self.beat_rr[beat])
+            for _, wave_time, amplitude, width, scaled in EcgSignal.WAVES:
+                if scaled:
+                    center, spread = beat_time + wave_time * scale, width * scale
+                else:
+                    center, spread = beat_time + wave_time, width
+                values += amplitude * np.exp(-((times - center) ** 2) / (2 * spread ** 2))
+        if self.noise:
+            values += self.random.normal(0.0, self.noise, len(times))
+        return values
+
+
+class ReplaySignal(SignalGenerator):
+    # Samples of a recording (see captureFile.py), read block after block from the memory-mapped capture file: only the
+    # pages being replayed are in memory. offset_s: where the replay starts in the recording (several sensors can
+    # replay the same file shifted in time), loop: start again from the beginning at the end, otherwise EOFError.
+
+    def __init__(self, capture, offset_s=0.0, loop=False, block_size=None):
+        super().__init__(capture.rate, block_size=block_size)
+        self.capture = capture
+        self.loop = loop
+        self.sample_index = int(offset_s * capture.rate) % capture.count
+
+    def refill(self):
+        if self.sample_index >= self.capture.count:
+            if not self.loop:
+                raise EOFError("End of {}".format(self.capture.path))
+            self.sample_index = 0
+        end = min(self.sample_index + self.block_size, self.capture.count)
+        self.block = self.capture.samples[self.sample_index:end].tolist()
+        self.position = 0
+        self.sample_index = end
+
+    def compute(self, times):
+        # The recorded samples at these times. refill() takes them straight from the capture file instead: the recording
+        # keeps its own type, without amplitude or offset.
+        return self.capture.samples[np.round(times * self.capture.rate).astype(np.int64) % self.capture.count].astype(np.float64)
@@ -0,0 +1,36 @@
+import os
+import sys
+import pytest
+
+# The modules of the simulator are imported by name (as mqttCliApp.py does), from the folder above
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    # Stands for the time module of the module under test: time only moves with advance() or sleep()
+
+    def __init__(self, start_s=1000.0):
+        self.now_ns = int(start_s * 1e9)
+
+    def advance(self, seconds):
+        self.now_ns += round(seconds * 1e9)
+
+    def monotonic_ns(self):
+        return self.now_ns
+
+    def monotonic(self):
+        return self.now_ns / 1e9
+
+    def time_ns(self):
+        return self.now_ns
+
+    def time(self):
+        return self.now_ns / 1e9
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
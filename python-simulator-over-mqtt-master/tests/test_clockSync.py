@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from clockSync import ClockSync
+
+BASE_NS = 1700000000 * 10**9
+
+
+def exchange(clock, request_id, sent_ns, offset_ns, delay_out_ns, delay_back_ns, drift_ppm=0.0):
+    # One request/answer, the sensor clock is offset_ns (+ drift) ahead of the server clock
+    def sensor_time_us(server_ns):
+        return round((server_ns + offset_ns + drift_ppm / 1e6 * (server_ns - BASE_NS)) / 1000)
+    clock.pending[request_id] = sent_ns
+    received_ns = sent_ns + delay_out_ns
+    answered_ns = received_ns + 200_000 # time spent in the sensor
+    clock.add_exchange(request_id, sensor_time_us(received_ns), sensor_time_us(answered_ns), answered_ns + delay_back_ns)
+
+
+def test_no_estimate_before_an_exchange():
+    clock = ClockSync()
+    assert clock.estimate() is None
+    assert (clock.offset_at([BASE_NS]) == 0).all()
+
+
+def test_unknown_answer_is_ignored():
+    clock = ClockSync()
+    clock.add_exchange(5, 1, 2, BASE_NS)
+    assert clock.estimate() is None
+
+
+def test_symmetric_delays_give_the_offset():
+    clock = ClockSync()
+    exchange(clock, 0, BASE_NS, offset_ns=-3_000_000, delay_out_ns=1_000_000, delay_back_ns=1_000_000)
+    estimate = clock.estimate()
+    assert estimate["offset_ns"] == -3_000_000
+    assert estimate["drift_ppm"] == 0.0
+    assert estimate["error_bound_ns"] == 1_000_000
+    assert estimate["exchanges"] == 1
+
+
+def test_keeps_the_lowest_delay_of_a_group():
+    clock = ClockSync()
+    # A delayed answer gives a wrong offset, the fastest exchange of the group wins
+    exchange(clock, 0, BASE_NS, offset_ns=5_000_000, delay_out_ns=1_000_000, delay_back_ns=9_000_000)
+    exchange(clock, 1, BASE_NS + 10**9, offset_ns=5_000_000, delay_out_ns=500_000, delay_back_ns=500_000)
+    exchange(clock, 2, BASE_NS + 2 * 10**9, offset_ns=5_000_000, delay_out_ns=4_000_000, delay_back_ns=1_000_000)
+    estimate = clock.estimate()
+    assert estimate["kept"] == 1
+    assert estimate["offset_ns"] == 5_000_000
+    assert estimate["min_delay_ns"] == 1_000_000
+
+
+def test_drift_over_a_long_span():
+    clock = ClockSync()
+    for request_id in range(4 * ClockSync.FILTER_SIZE):
+        sent_ns = BASE_NS + request_id * 10 * 10**9 # one exchange every 10 s, 320 s
+        exchange(clock, request_id, sent_ns, offset_ns=2_000_000, delay_out_ns=300_000, delay_back_ns=300_000, drift_ppm=20.0)
+    estimate = clock.estimate()
+    assert estimate["kept"] == 4
+    assert estimate["drift_ppm"] == pytest.approx(20.0, abs=0.1)
+    times_ns = np.array([BASE_NS, BASE_NS + 100 * 10**9])
+    expected_ns = 2_000_000 + 20.0 / 1e6 * (times_ns - BASE_NS)
+    assert clock.offset_at(times_ns) == pytest.approx(expected_ns, abs=2000)
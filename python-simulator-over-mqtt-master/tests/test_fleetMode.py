@@ -0,0 +1,44 @@
+import asyncio
+import socket
+import time
+from brokerInformator import BrokerInformator
+from embeddedBroker import EmbeddedBroker
+from mqttConnector import MqttConnector
+from mode.fleetMode import FleetConfig, FleetMode
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((EmbeddedBroker.DEFAULT_HOST, 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for(condition, timeout_s=10):
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.05)
+
+
+def test_virtual_sensor_reconnects_after_losing_its_connection(monkeypatch):
+    monkeypatch.setenv("EMBEDDED_BROKER_PORT", str(free_port()))
+    monkeypatch.setattr(MqttConnector, "RECONNECT_BASE_S", 0.05)
+    broker_info = BrokerInformator.embedded()
+    fleet = FleetMode(broker_info, config=FleetConfig(sensors=2, rate=10, autostart=True, duration=60, summary_interval=60))
+
+    async def scenario():
+        main = asyncio.get_running_loop().create_task(fleet.main())
+        try:
+            await wait_for(lambda: len(fleet.sensors) == 2 and all(sensor.connected for sensor in fleet.sensors))
+            broker = EmbeddedBroker._running[(broker_info["url"], broker_info["port"])]
+            # The broker drops every connection, as a broker restart would
+            for session in list(broker.sessions.values()):
+                broker.loop.call_soon_threadsafe(session.close)
+            await wait_for(lambda: fleet.get_counters()["reconnects"] == 2 and all(sensor.connected for sensor in fleet.sensors))
+            sent = fleet.get_counters()["values_sent"]
+            await wait_for(lambda: fleet.get_counters()["values_sent"] > sent)
+        finally:
+            main.cancel()
+            await asyncio.gather(main, return_exceptions=True)
+
+    asyncio.run(scenario())
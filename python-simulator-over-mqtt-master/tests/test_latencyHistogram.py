@@ -0,0 +1,69 @@
+import json
+import numpy as np
+import pytest
+from latencyHistogram import LatencyHistogram
+
+
+def test_empty():
+    histogram = LatencyHistogram()
+    assert histogram.value_at_percentile(50) is None
+    assert histogram.mean() is None
+
+
+def test_percentiles_within_precision():
+    values = np.arange(1, 10001) * 10**5 # 0.1 ms to 1 s
+    histogram = LatencyHistogram()
+    histogram.record_many(values)
+    for percentile in (1, 50, 90, 99, 99.9):
+        expected = np.percentile(values, percentile, method="inverted_cdf")
+        assert histogram.value_at_percentile(percentile) == pytest.approx(expected, rel=LatencyHistogram.PRECISION)
+    assert histogram.value_at_percentile(100) == values.max()
+    assert histogram.mean() == values.mean()
+
+
+def test_record_and_record_many_agree():
+    values = [1500, 2 * 10**6, 3 * 10**6, 7 * 10**9]
+    one_by_one = LatencyHistogram()
+    for value in values:
+        one_by_one.record(value)
+    column = LatencyHistogram()
+    column.record_many(values)
+    assert (one_by_one.counts == column.counts).all()
+    assert one_by_one.to_dict() == column.to_dict()
+
+
+def test_out_of_range_values():
+    histogram = LatencyHistogram()
+    histogram.record_many([-5000, 10**6, 200 * 10**9])
+    assert histogram.out_of_range == 2
+    assert (histogram.min_ns, histogram.max_ns) == (-5000, 200 * 10**9)
+    assert histogram.counts[0] == 1
+    assert histogram.counts[histogram.bucket_index(histogram.highest_ns)] == 1
+    assert histogram.value_at_percentile(100) == 200 * 10**9
+
+
+def test_merge_gives_the_percentiles_of_the_whole():
+    fast, slow = np.full(900, 10**6), np.full(100, 10**8)
+    first, second, whole = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    first.record_many(fast)
+    second.record_many(slow)
+    whole.record_many(np.concatenate([fast, slow]))
+    first.merge(second)
+    assert first.total == 1000
+    assert (first.counts == whole.counts).all()
+    assert first.value_at_percentile(50) == whole.value_at_percentile(50)
+    assert first.value_at_percentile(95) == pytest.approx(10**8, rel=LatencyHistogram.PRECISION)
+    assert (first.min_ns, first.max_ns) == (10**6, 10**8)
+
+
+def test_merge_needs_the_same_buckets():
+    with pytest.raises(ValueError):
+        LatencyHistogram().merge(LatencyHistogram(precision=0.02))
+
+
+def test_dict_round_trip():
+    histogram = LatencyHistogram()
+    histogram.record_many([10**4, 10**5, 10**6])
+    copy = LatencyHistogram.from_dict(json.loads(json.dumps(histogram.to_dict())))
+    assert (copy.counts == histogram.counts).all()
+    assert copy.value_at_percentile(50) == histogram.value_at_percentile(50)
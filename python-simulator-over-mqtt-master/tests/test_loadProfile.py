@@ -0,0 +1,82 @@
+import json
+import re
+import pytest
+import loadProfile
+import rateScheduler
+from loadProfile import LoadProfile, ProfileDriver
+from rateScheduler import RateScheduler
+
+
+def phases(spec):
+    return [(phase.name, phase.duration_s, phase.from_rate, phase.to_rate) for phase in LoadProfile.from_spec(spec).phases]
+
+
+def test_ramp():
+    assert phases("ramp:from=10,to=50,duration=8,steps=4") == [
+        ("ramp 10-20/s", 2, 10, 20), ("ramp 20-30/s", 2, 20, 30), ("ramp 30-40/s", 2, 30, 40), ("ramp 40-50/s", 2, 40, 50)]
+
+
+def test_step_includes_the_last_rate():
+    assert phases("step:from=100,to=300,step=100,hold=5") == [
+        ("step 100/s", 5, 100, 100), ("step 200/s", 5, 200, 200), ("step 300/s", 5, 300, 300)]
+
+
+def test_burst():
+    assert phases("burst:base=50,peak=1000,period=10,length=1,cycles=2") == [
+        ("burst 1000/s", 1, 1000, 1000), ("base 50/s", 9, 50, 50)] * 2
+
+
+def test_chained_stages_start_one_after_the_other():
+    profile = LoadProfile.from_spec("soak:rate=100,duration=10; poisson:rate=200,duration=5,seed=3")
+    assert [(phase.start_s, phase.poisson_seed) for phase in profile.phases] == [(0.0, None), (10.0, 3)]
+    assert profile.duration_s == 15
+
+
+def test_json_file(tmp_path):
+    path = tmp_path / "profile.json"
+    path.write_text(json.dumps([{"kind": "ramp", "from": 1, "to": 2, "duration": 4, "steps": 2}, {"kind": "soak", "rate": 2, "duration": 1}]))
+    assert [phase.name for phase in LoadProfile.from_spec(str(path)).phases] == ["ramp 1-1.5/s", "ramp 1.5-2/s", "soak 2/s"]
+
+
+@pytest.mark.parametrize("spec, message", [
+    ("wave:rate=1", "Invalid load profile stage wave"),
+    ("ramp:to=10,duration=5", "missing option(s) from"),
+    ("soak:rate=10,duration=5,jitter=1", "unknown option(s) jitter"),
+    ("step:from=1,to=5,step=0,hold=1", "step of a step ladder"),
+    ("burst:base=1,peak=5,period=1,length=2", "length of a burst"),
+    ("soak:rate=0,duration=5", "must be positive"),
+    ("", "at least one phase"),
+])
+def test_invalid_specs(spec, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        LoadProfile.from_spec(spec)
+
+
+def test_phase_at():
+    profile = LoadProfile.from_spec("step:from=1,to=3,step=1,hold=10")
+    assert [profile.phase_at(elapsed_s) for elapsed_s in (0, 9.99, 10, 25, 29.99, 30)] == [0, 0, 1, 2, 2, None]
+    assert profile.phase_at(5, hint=2) == 2 # the search starts at the current phase
+    assert profile.phases[0].rate_at(3) == 1
+
+
+def test_rate_inside_a_ramp_phase():
+    phase = LoadProfile.from_spec("ramp:from=0.5,to=10.5,duration=10,steps=1").phases[0]
+    assert [phase.rate_at(elapsed_s) for elapsed_s in (0, 5, 10, 20)] == [0.5, 5.5, 10.5, 10.5]
+    assert phase.offered_rate() == 5.5
+
+
+def test_driver_follows_the_phases(fake_clock, monkeypatch):
+    monkeypatch.setattr(loadProfile, "time", fake_clock)
+    monkeypatch.setattr(rateScheduler, "time", fake_clock)
+    profile = LoadProfile.from_spec("soak:rate=10,duration=1;poisson:rate=20,duration=1,seed=5")
+    scheduler = RateScheduler(10)
+    driver = ProfileDriver(profile, scheduler, announce=False)
+    assert driver.start(0)
+    fake_clock.advance(1.0)
+    assert driver.update(10)
+    assert (scheduler.rate, scheduler.arrivals is not None) == (20, True)
+    fake_clock.advance(0.01)
+    assert driver.update(11) # before UPDATE_INTERVAL_NS: nothing done
+    fake_clock.advance(1.0)
+    assert not driver.update(30)
+    assert [(row["phase"], row["first_seq"], row["end_seq"]) for row in driver.log] == [(0, 0, 10), (1, 10, 30)]
@@ -0,0 +1,77 @@
+import struct
+import numpy as np
+import pytest
+from constants import MqttAppConstants
+from messageCodec import BinaryCodec, JsonCodec, MessageCodec
+
+MESSAGES = [
+    {"timestamp": 1700000000000000, "value": 42},
+    {"timestamp": 1700000000000000, "value": -3.25, "seq": 7},
+    {"timestamp": 1700000000000000, "value": 2**40, "seq": 2**33},
+    {"timestamp": 1700000000000000, "values": [1, 2, 3, -4], "period": 5000, "seq": 100},
+    {"timestamp": 1700000000000000, "values": [0.5, 1.5, 2.5], "period": 1000},
+    {"timestamp": 1700000000000000, "values": [], "period": 1000, "seq": 3},
+    {"timestamp": 1700000000000000, "cmd": "sync", "id": 12},
+    {"timestamp": 1700000000000000, "ans": "sync.time", "id": 12, "received": 1699999999999000},
+    {"timestamp": 1700000000000000, "ans": "ok é", "seq": 1, "id": 2},
+    {"timestamp": 1700000000000000, "value": 1, "pad": "xxxx"},
+]
+
+
+@pytest.mark.parametrize("codec", [JsonCodec, BinaryCodec])
+@pytest.mark.parametrize("message", MESSAGES)
+def test_round_trip(codec, message):
+    payload = codec.encode(message)
+    assert codec.decode(payload) == message
+    # The receiver does not know the codec of the sender
+    assert MessageCodec.decode(payload) == message
+
+
+def test_binary_flags():
+    payload = BinaryCodec.encode({"timestamp": 1, "value": 1})
+    assert payload[0] == BinaryCodec.MAGIC
+    assert payload[3] == 0
+    payload = BinaryCodec.encode({"timestamp": 1, "value": 1, "seq": 5})
+    assert payload[3] == BinaryCodec.FLAG_SEQ
+    payload = BinaryCodec.encode({"timestamp": 1, "cmd": "ping", "id": 9})
+    assert payload[3] == BinaryCodec.FLAG_ID
+    payload = BinaryCodec.encode({"timestamp": 1, "ans": "pong", "seq": 5, "id": 9, "received": 2})
+    assert payload[3] == BinaryCodec.FLAG_SEQ | BinaryCodec.FLAG_ID | BinaryCodec.FLAG_EXTRA_FIELDS
+
+
+def test_binary_batch_value_types():
+    assert BinaryCodec.value_type([1, 2]) == BinaryCodec.TYPE_INT32
+    assert BinaryCodec.value_type([1, 2**31]) == BinaryCodec.TYPE_INT64
+    assert BinaryCodec.value_type([1, 2.0]) == BinaryCodec.TYPE_FLOAT64
+    batch = {"timestamp": 1, "values": [index / 3 for index in range(1000)], "period": 100}
+    assert len(BinaryCodec.encode(batch)) < len(JsonCodec.encode(batch))
+
+
+def test_unknown_codec():
+    assert MessageCodec.get_codec(MqttAppConstants.CODEC_BINARY) is BinaryCodec
+    with pytest.raises(ValueError):
+        MessageCodec.get_codec("xml")
+
+
+def test_batch_values_are_little_endian():
+    # The layout a firmware follows, whatever the byte order of the machine
+    payload = (BinaryCodec.HEADER.pack(BinaryCodec.MAGIC, BinaryCodec.KIND_BATCH, BinaryCodec.TYPE_FLOAT64, BinaryCodec.FLAG_SEQ, 1)
+               + BinaryCodec.SEQ.pack(4) + BinaryCodec.BATCH_HEADER.pack(100, 3) + struct.pack("<3d", 1.5, -2.0, 3.25))
+    batch = {"timestamp": 1, "seq": 4, "period": 100, "values": [1.5, -2.0, 3.25]}
+    assert BinaryCodec.decode(payload) == batch
+    assert BinaryCodec.encode(batch) == payload
+
+
+def test_numpy_scalars():
+    message = {"timestamp": 1, "values": [np.int64(1), np.int32(-2)], "period": 100}
+    assert BinaryCodec.value_type(message["values"]) == BinaryCodec.TYPE_INT32
+    assert BinaryCodec.decode(BinaryCodec.encode(message))["values"] == [1, -2]
+    assert BinaryCodec.value_type([np.int64(2**40)]) == BinaryCodec.TYPE_INT64
+    assert BinaryCodec.value_type([np.float32(0.5), 1]) == BinaryCodec.TYPE_FLOAT64
+    assert BinaryCodec.decode(BinaryCodec.encode({"timestamp": 1, "value": np.uint8(7)}))["value"] == 7
+
+
+@pytest.mark.parametrize("values", [["1"], [1, None], [1 + 2j]])
+def test_values_that_are_not_numbers(values):
+    with pytest.raises(ValueError):
+        BinaryCodec.encode({"timestamp": 1, "values": values, "period": 100})
@@ -0,0 +1,10 @@
+from brokerInformator import BrokerInformator
+from mqttConnector import MqttConnector
+
+
+def test_out_queue_without_the_private_queue_of_paho():
+    service = MqttConnector(BrokerInformator.embedded())
+    service.client._out_packet.append({}) # a packet not written yet
+    assert service.get_out_queue() == 1
+    del service.client._out_packet # as a paho version without it
+    assert service.get_out_queue() == 0
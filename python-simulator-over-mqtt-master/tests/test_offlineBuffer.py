@@ -0,0 +1,113 @@
+import os
+import paho.mqtt.client as mqtt
+import pytest
+import offlineBuffer
+import rateScheduler
+from offlineBuffer import OfflineBuffer
+
+
+class FakeConnector:
+    # connector.client.publish() and connector.is_connected(), as MqttConnector. refuse: mids refused by paho,
+    # disconnect_after: the connection is lost after this many publications
+
+    def __init__(self, clock, refuse=(), disconnect_after=None):
+        self.client = self
+        self.clock = clock
+        self.refuse = set(refuse)
+        self.disconnect_after = disconnect_after
+        self.published = [] # (time in s, topic, payload)
+        self.attempts = 0
+
+    def is_connected(self):
+        return self.disconnect_after is None or len(self.published) < self.disconnect_after
+
+    def publish(self, topic, payload, qos=0):
+        self.attempts += 1
+        info = mqtt.MQTTMessageInfo(self.attempts)
+        if self.attempts in self.refuse:
+            info.rc = mqtt.MQTT_ERR_NO_CONN
+        else:
+            self.published.append((self.clock.monotonic(), topic, payload))
+        return info
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr(offlineBuffer, "time", fake_clock)
+    monkeypatch.setattr(rateScheduler, "time", fake_clock)
+    return fake_clock
+
+
+def fill(buffer, count):
+    for index in range(count):
+        buffer.append("s/sensor", str(index).encode())
+
+
+def test_memory_then_spill_then_drop(tmp_path):
+    buffer = OfflineBuffer(capacity=3, spill_capacity=2, spill_dir=str(tmp_path))
+    fill(buffer, 7)
+    assert len(buffer) == 5
+    assert (buffer.buffered, buffer.dropped, buffer.max_depth) == (5, 2, 5)
+    assert os.path.exists(buffer.spill_path)
+    # The oldest first, the gap is at the end of the outage
+    assert [buffer.take()[1] for _ in range(5)] == [b"0", b"1", b"2", b"3", b"4"]
+    assert buffer.take() is None
+    buffer.close()
+    assert not os.path.exists(buffer.spill_path)
+
+
+def test_no_spill_file_by_default():
+    buffer = OfflineBuffer(capacity=2)
+    fill(buffer, 4)
+    assert (len(buffer), buffer.dropped, buffer.spill_file) == (2, 2, None)
+
+
+def test_spill_file_is_reused_once_replayed(tmp_path):
+    buffer = OfflineBuffer(capacity=1, spill_capacity=10, spill_dir=str(tmp_path))
+    fill(buffer, 3)
+    while buffer.take() is not None:
+        pass
+    assert buffer.spill_file.seek(0, os.SEEK_END) == 0
+    fill(buffer, 3)
+    assert [buffer.take()[1] for _ in range(3)] == [b"0", b"1", b"2"]
+    buffer.close()
+
+
+def test_catch_up_is_capped(clock):
+    buffer = OfflineBuffer(capacity=100, catch_up_rate=100)
+    fill(buffer, 50)
+    connector = FakeConnector(clock)
+    buffer.connector = connector
+    buffer.catch_up()
+    times = [published_s for published_s, _, _ in connector.published]
+    assert [payload for _, _, payload in connector.published] == [str(index).encode() for index in range(50)]
+    assert times[-1] - times[0] == pytest.approx(0.49) # 100 messages per second at most
+    assert (buffer.replayed, len(buffer), buffer.catch_ups) == (50, 0, 1)
+    assert buffer.max_catch_up_s == pytest.approx(0.49)
+
+
+def test_refused_message_is_replayed_first(clock):
+    buffer = OfflineBuffer(capacity=10, catch_up_rate=1000)
+    fill(buffer, 3)
+    connector = FakeConnector(clock, refuse={2})
+    buffer.connector = connector
+    buffer.catch_up()
+    assert [payload for _, _, payload in connector.published] == [b"0", b"1", b"2"]
+    assert buffer.replayed == 3
+
+
+def test_catch_up_stops_when_disconnected(clock):
+    buffer = OfflineBuffer(capacity=10, catch_up_rate=1000)
+    fill(buffer, 10)
+    buffer.connector = FakeConnector(clock, disconnect_after=4)
+    buffer.catch_up()
+    assert (buffer.replayed, len(buffer)) == (4, 6)
+    buffer.close()
+    assert buffer.dropped == 6
+
+
+def test_invalid_options():
+    with pytest.raises(ValueError):
+        OfflineBuffer(capacity=0)
+    with pytest.raises(ValueError):
+        OfflineBuffer(catch_up_rate=0)
@@ -0,0 +1,132 @@
+import threading
+import paho.mqtt.client as mqtt
+import pytest
+import publishWindow
+from publishWindow import PublishWindow
+from rateScheduler import RateScheduler
+
+
+class FakeClient:
+    # What PublishWindow uses of a paho client: publish() and the on_publish/on_disconnect callbacks
+
+    def __init__(self, rc=mqtt.MQTT_ERR_SUCCESS, done_at_once=False):
+        self.rc = rc
+        self.done_at_once = done_at_once # on_publish runs before publish() returns (QoS 0 written at once)
+        self.on_publish = None
+        self.on_disconnect = None
+        self.published = [] # (mid, payload)
+
+    def publish(self, topic, payload, qos=0):
+        mid = len(self.published) + 1
+        self.published.append((mid, payload))
+        if self.done_at_once:
+            self.on_publish(self, None, mid)
+        info = mqtt.MQTTMessageInfo(mid)
+        info.rc = self.rc
+        return info
+
+    def acknowledge(self, count=None):
+        for mid, _ in self.published[:count]:
+            self.on_publish(self, None, mid)
+
+    def payloads(self):
+        return [payload for _, payload in self.published]
+
+
+def publish_all(window, payloads):
+    for payload in payloads:
+        window.publish("t", payload)
+
+
+def test_block_waits_for_room():
+    client = FakeClient()
+    window = PublishWindow(client, size=2, policy=PublishWindow.BLOCK)
+    publish_all(window, ["v0", "v1"])
+    threading.Timer(0.05, client.acknowledge).start()
+    window.publish("t", "v2") # blocked until the acknowledgements
+    assert client.payloads() == ["v0", "v1", "v2"]
+    assert window.blocked_ns >= 40 * 10**6
+    assert window.dropped == 0
+
+
+def test_block_gives_up_when_stopped():
+    client = FakeClient()
+    window = PublishWindow(client, size=2, policy=PublishWindow.BLOCK, is_active=lambda: False)
+    publish_all(window, ["v0", "v1", "v2"])
+    assert client.payloads() == ["v0", "v1"]
+    assert window.dropped == 1
+
+
+def test_drop_newest_keeps_the_backlog():
+    client = FakeClient()
+    window = PublishWindow(client, size=2, policy=PublishWindow.DROP_NEWEST, backlog=2)
+    publish_all(window, ["v{}".format(index) for index in range(6)])
+    assert list(payload for _, payload in window.backlog) == ["v2", "v3"]
+    assert window.dropped == 2
+    client.acknowledge()
+    window.publish("t", "v6") # the backlog goes first, in order
+    assert client.payloads() == ["v0", "v1", "v2", "v3"]
+    assert list(payload for _, payload in window.backlog) == ["v6"]
+
+
+def test_drop_oldest_keeps_the_freshest_values():
+    client = FakeClient()
+    window = PublishWindow(client, size=2, policy=PublishWindow.DROP_OLDEST, backlog=2)
+    publish_all(window, ["v{}".format(index) for index in range(6)])
+    assert list(payload for _, payload in window.backlog) == ["v4", "v5"]
+    assert window.dropped == 2
+    assert window.max_backlog == 2
+
+
+def test_on_publish_before_publish_returns():
+    client = FakeClient(done_at_once=True)
+    window = PublishWindow(client, size=2)
+    publish_all(window, ["v{}".format(index) for index in range(10)])
+    assert window.sent == 10
+    assert not window.pending
+    assert not window.early
+    assert window.max_in_flight == 0
+
+
+def test_refused_qos0_messages_are_counted():
+    client = FakeClient(rc=mqtt.MQTT_ERR_NO_CONN)
+    window = PublishWindow(client, size=2)
+    publish_all(window, ["v0", "v1", "v2"])
+    assert (window.sent, window.errors, len(window.pending)) == (0, 3, 0)
+
+
+def test_disconnection_frees_the_qos0_window():
+    client = FakeClient()
+    window = PublishWindow(client, size=2, policy=PublishWindow.DROP_NEWEST)
+    publish_all(window, ["v0", "v1"])
+    client.on_disconnect(client, None, 1)
+    window.publish("t", "v2")
+    assert client.payloads() == ["v0", "v1", "v2"]
+
+
+def test_adaptive_lowers_then_raises_the_rate(fake_clock, monkeypatch):
+    monkeypatch.setattr(publishWindow, "time", fake_clock)
+    client = FakeClient()
+    scheduler = RateScheduler(1000)
+    window = PublishWindow(client, size=10, policy=PublishWindow.ADAPTIVE, backlog=10, scheduler=scheduler)
+    publish_all(window, range(20)) # window and backlog full
+    fake_clock.advance(PublishWindow.ADAPT_INTERVAL_S)
+    window.publish("t", 20)
+    # paho took 10 values in 0.1 s: 100/s, the rate goes to 80 % of that
+    assert scheduler.rate == pytest.approx(80)
+    assert window.rate_changes == 1
+    for _ in range(2): # the window drains
+        client.acknowledge()
+        window.drain()
+    client.acknowledge()
+    fake_clock.advance(PublishWindow.ADAPT_INTERVAL_S)
+    window.publish("t", 21)
+    assert scheduler.rate == pytest.approx(80 * 1.05)
+    assert window.min_rate == pytest.approx(80)
+
+
+def test_invalid_options():
+    with pytest.raises(ValueError):
+        PublishWindow(FakeClient(), policy="drop-all")
+    with pytest.raises(ValueError):
+        PublishWindow(FakeClient(), size=0)
@@ -0,0 +1,97 @@
+import pytest
+import rateScheduler
+from rateScheduler import RateScheduler
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr(rateScheduler, "time", fake_clock)
+    return fake_clock
+
+
+def test_first_value_due_at_start(clock):
+    scheduler = RateScheduler(100)
+    assert scheduler.delay() == 0
+    assert scheduler.collect_due() == 1
+    assert scheduler.collect_due() == 0
+    assert scheduler.delay() == pytest.approx(0.01)
+
+
+def test_deadlines_do_not_drift(clock):
+    scheduler = RateScheduler(100)
+    for _ in range(1000):
+        assert scheduler.wait() == 1
+        clock.advance(0.003) # time spent publishing, not added to the period
+    assert scheduler.fired == 1000
+    assert clock.monotonic_ns() - scheduler.start_ns == pytest.approx(999 * 10**7 + 3 * 10**6)
+    assert scheduler.achieved_rate() == pytest.approx(100)
+
+
+def test_catch_up_sends_the_missed_values(clock):
+    scheduler = RateScheduler(100)
+    scheduler.collect_due()
+    clock.advance(0.055) # 5 deadlines missed, the 6th one is due at 60 ms
+    assert scheduler.collect_due() == 5
+    assert scheduler.skipped == 0
+    assert scheduler.delay() == pytest.approx(0.005)
+
+
+def test_catch_up_burst_is_bounded(clock):
+    scheduler = RateScheduler(1000, max_burst=10)
+    scheduler.collect_due()
+    clock.advance(0.0505)
+    assert scheduler.collect_due() == 10
+    assert scheduler.skipped == 40
+    assert scheduler.fired == 11
+
+
+def test_skip_keeps_the_time_slots(clock):
+    scheduler = RateScheduler(100, policy=RateScheduler.SKIP)
+    scheduler.collect_due()
+    clock.advance(0.055)
+    assert scheduler.collect_due() == 1
+    assert scheduler.skipped == 4
+    assert scheduler.delay() == pytest.approx(0.005) # still on the 10 ms grid
+
+
+def test_set_rate_drop_late(clock):
+    scheduler = RateScheduler(100)
+    scheduler.collect_due()
+    clock.advance(0.05)
+    scheduler.set_rate(10, drop_late=True)
+    assert scheduler.skipped == 4
+    assert scheduler.collect_due() == 1
+    assert scheduler.delay() == pytest.approx(0.1)
+
+
+def test_poisson_arrivals_are_deterministic(clock):
+    def gaps():
+        scheduler = RateScheduler(200)
+        scheduler.set_arrivals(poisson_seed=7)
+        scheduler.collect_due()
+        deadlines = [scheduler.next_deadline_ns]
+        for _ in range(2000):
+            clock.advance(scheduler.delay())
+            assert scheduler.collect_due() >= 1
+            deadlines.append(scheduler.next_deadline_ns)
+        return [next_ns - previous_ns for previous_ns, next_ns in zip(deadlines, deadlines[1:])]
+    first = gaps()
+    assert gaps() == first # same seed, same load
+    assert len(set(first)) > 1000 # not a regular grid
+    assert sum(first) / len(first) == pytest.approx(1e9 / 200, rel=0.1)
+
+
+def test_wait_is_interrupted(clock):
+    class SetEvent:
+        def wait(self, timeout):
+            return True
+    scheduler = RateScheduler(1)
+    scheduler.collect_due()
+    assert scheduler.wait(SetEvent()) == 0
+
+
+def test_invalid_options():
+    with pytest.raises(ValueError):
+        RateScheduler(0)
+    with pytest.raises(ValueError):
+        RateScheduler(10, policy="later")
@@ -0,0 +1,62 @@
+import threading
+from receivePipeline import ReceivePipeline
+
+
+def test_processes_every_item():
+    handled = []
+    lock = threading.Lock()
+
+    def handler(timestamp_ns, payload, topic):
+        with lock:
+            handled.append((timestamp_ns, payload, topic))
+
+    pipeline = ReceivePipeline(handler, size=100, workers=3)
+    for index in range(50):
+        pipeline.submit(index, b"{}", "t")
+    pipeline.drain()
+    counters = pipeline.get_counters()
+    pipeline.close()
+    assert sorted(handled) == [(index, b"{}", "t") for index in range(50)]
+    assert counters["received"] == 50
+    assert counters["processed"] == 50
+    assert counters["dropped"] == 0
+    assert counters["depth"] == 0
+
+
+def test_drops_when_the_queue_is_full():
+    release = threading.Event()
+    started = threading.Event()
+
+    def handler(_):
+        started.set()
+        release.wait()
+
+    pipeline = ReceivePipeline(handler, size=2, workers=1)
+    pipeline.submit(0)
+    started.wait() # the worker holds the first item, the queue is empty
+    for index in range(1, 6):
+        pipeline.submit(index)
+    counters = pipeline.get_counters()
+    assert counters["dropped"] == 3
+    assert counters["max_depth"] == 2
+    release.set()
+    pipeline.close()
+    counters = pipeline.get_counters()
+    assert counters["received"] == 6
+    assert counters["processed"] == 3
+
+
+def test_counts_errors_and_keeps_working(capsys):
+    def handler(value):
+        if value % 2:
+            raise ValueError("malformed")
+
+    pipeline = ReceivePipeline(handler, size=10, workers=1)
+    for index in range(6):
+        pipeline.submit(index)
+    pipeline.close()
+    counters = pipeline.get_counters()
+    assert counters["errors"] == 3
+    assert counters["processed"] == 3
+    # Only the first error is printed
+    assert capsys.readouterr().out.count("Could not process") == 1
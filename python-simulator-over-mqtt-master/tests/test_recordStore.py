@@ -0,0 +1,64 @@
+import os
+import pytest
+from recordStore import RecordStore
+
+
+def test_keeps_every_record_in_order():
+    store = RecordStore()
+    for index in range(5):
+        store.append(1000 + index, index, seq=index)
+    assert len(store) == 5
+    assert list(store) == [(1000 + index, index) for index in range(5)]
+    assert list(store.to_columns()["seq"]) == list(range(5))
+
+
+def test_answers_are_stored_as_their_index():
+    store = RecordStore()
+    answer = RecordStore.ANSWERS[0]
+    store.append(1, answer)
+    store.append(2, "not an answer")
+    store.append(3, 1.5)
+    assert list(store) == [(1, answer), (3, 1.5)]
+
+
+def test_ring_buffer_keeps_the_last_records():
+    store = RecordStore(max_records=4)
+    for index in range(10):
+        store.append(index, index * 10, seq=index)
+    assert len(store) == 4
+    assert store.dropped == 6
+    assert list(store) == [(index, index * 10) for index in range(6, 10)]
+    assert list(store.to_columns()["seq"]) == [6, 7, 8, 9]
+
+
+def test_ring_buffer_not_full():
+    store = RecordStore(max_records=4)
+    store.append(1, 10)
+    store.append(2, 20)
+    assert len(store) == 2
+    assert store.dropped == 0
+    assert list(store) == [(1, 10), (2, 20)]
+
+
+def test_spill_writes_chunks_and_reads_them_back(tmp_path):
+    store = RecordStore(spill_chunk=3, spill_dir=str(tmp_path))
+    for index in range(8):
+        store.append(index, index + 0.5, seq=index)
+    assert len(store.spilled_files) == 2
+    assert all(os.path.exists(path) for path in store.spilled_files)
+    assert len(store) == 8
+    assert list(store) == [(index, index + 0.5) for index in range(8)]
+    assert list(store.to_columns()["seq"]) == list(range(8))
+    store.close()
+    assert not os.path.exists(store.spill_dir)
+
+
+@pytest.mark.parametrize("options", [
+    {"max_records": 0},
+    {"max_records": -1},
+    {"spill_chunk": 0},
+    {"max_records": 10, "spill_chunk": 10},
+])
+def test_invalid_options(options):
+    with pytest.raises(ValueError):
+        RecordStore(**options)
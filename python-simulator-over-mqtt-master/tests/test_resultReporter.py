@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+from resultReporter import ResultReporter
+
+BASE_NS = 1700000000 * 10**9
+
+
+def frame(rows):
+    return pd.DataFrame(rows, columns=["timestamp_ns", "seq", "value"])
+
+
+def test_match_by_sequence():
+    sent = frame([(BASE_NS + seq * 10**6, seq, seq * 10) for seq in range(5)])
+    # seq 2 lost, seq 4 before seq 3 (reordered), seq 1 twice, seq 9 unknown to the sender
+    received = frame([
+        (BASE_NS + 2 * 10**6, 0, 0),
+        (BASE_NS + 3 * 10**6, 1, 10),
+        (BASE_NS + 4 * 10**6, 1, 10),
+        (BASE_NS + 6 * 10**6, 4, 40),
+        (BASE_NS + 7 * 10**6, 3, 30),
+        (BASE_NS + 8 * 10**6, 9, 90),
+    ])
+    report, stats = ResultReporter.match_by_sequence(sent, received)
+    assert stats["sent"] == 5
+    assert stats["received"] == 6
+    assert stats["matched"] == 4
+    assert stats["lost"] == 1
+    assert stats["duplicates"] == 1
+    assert stats["reordered"] == 1
+    assert stats["unknown"] == 1
+    assert stats["transit_min_s"] == pytest.approx(0.002)
+    assert stats["transit_max_s"] == pytest.approx(0.004)
+    assert len(report) == 6
+
+
+def test_match_by_sequence_keeps_nanoseconds():
+    sent = frame([(BASE_NS + 1, 0, 1)])
+    received = frame([(BASE_NS + 1001, 0, 1)])
+    _, stats = ResultReporter.match_by_sequence(sent, received)
+    assert stats["transit_min_s"] == pytest.approx(1e-6)
@@ -0,0 +1,25 @@
+import pytest
+from sampleBatcher import SampleBatcher
+
+
+@pytest.mark.parametrize("spec", ["", " ", "1", "0", "-3", "0ms", "-5ms", "0.0ms"])
+def test_no_batching(spec):
+    assert SampleBatcher.from_spec(250, spec) is None
+
+
+def test_sizes():
+    assert SampleBatcher.from_spec(250, "25").size == 25
+    assert SampleBatcher.from_spec(250, "40ms").size == 10
+    assert SampleBatcher.from_spec(250, "40MS ").period_us == 4000
+
+
+def test_batches_and_rate_change():
+    batcher = SampleBatcher(100, window_ms=30) # 3 values
+    assert [batcher.add(value, seq) for seq, value in enumerate((7, 8))] == [None, None]
+    _, period_us, values, base_seq = batcher.add(9, 2)
+    assert (period_us, values, base_seq) == (10000, [7, 8, 9], 0)
+    batcher.add(10, 3)
+    assert batcher.follow_rate(100) is None
+    _, period_us, values, base_seq = batcher.follow_rate(200) # the pending batch was produced at the old period
+    assert (period_us, values, base_seq) == (10000, [10], 3)
+    assert (batcher.size, batcher.period_us) == (6, 5000)
@@ -0,0 +1,33 @@
+import threading
+import paho.mqtt.client as mqtt
+from brokerInformator import BrokerInformator
+from messageCodec import JsonCodec
+from metrics import MetricsRegistry
+from mqttConnector import MqttConnector
+from mode.sensorMode import SensorMode
+
+
+def test_received_commands_are_counted():
+    # Not connected: the answers stay in paho's queue
+    sensor = SensorMode(MqttConnector(BrokerInformator.embedded()), rate=10, ordered=True, batch="", topic="s1")
+    for command in ("ping", "stop"):
+        message = mqtt.MQTTMessage(topic=sensor.topic_for_hearing_from_server.encode())
+        message.payload = JsonCodec.encode({"timestamp": 1, "cmd": command})
+        sensor.on_message_for_sensor(sensor.mqtt_service.client, None, message)
+    assert sensor.messages_received == 2
+    assert sensor.messages_sent == 2 # the answers
+
+
+def test_transit_histogram_shared_by_the_receive_workers():
+    sensor = SensorMode(MqttConnector(BrokerInformator.embedded()), rate=10, ordered=True, batch="", topic="s2")
+    sensor.register_metrics(MetricsRegistry())
+    message = {"timestamp": 1, "value": 1}
+    workers = [threading.Thread(target=lambda: [sensor.record_transit(2000 + index, message) for index in range(20000)])
+               for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sensor.transit_histogram.total == 80000
+    assert sensor.transit_histogram.counts.sum() == 80000
+
@@ -0,0 +1,68 @@
+from sequenceTracker import SequenceTracker
+
+
+def counters(tracker):
+    return tracker.lost, tracker.late, tracker.duplicates, tracker.gaps, tracker.max_gap
+
+
+def test_in_order():
+    tracker = SequenceTracker()
+    for seq in range(0, 20, 5):
+        tracker.track(seq, 5)
+    assert counters(tracker) == (0, 0, 0, 0, 0)
+    assert tracker.max_seq == 19
+
+
+def test_reordered_values_fill_their_gap():
+    tracker = SequenceTracker()
+    for seq in (0, 1, 4, 2, 3, 5):
+        tracker.track(seq, 1)
+    assert counters(tracker) == (0, 2, 0, 1, 2)
+
+
+def test_duplicates_do_not_hide_a_gap():
+    tracker = SequenceTracker()
+    tracker.track(0, 1)
+    tracker.track(1, 1)
+    tracker.track(3, 1) # 2 lost
+    tracker.track(1, 1) # QoS 1 redelivery
+    tracker.track(3, 1)
+    assert counters(tracker) == (1, 0, 2, 1, 1)
+
+
+def test_late_value_received_twice():
+    tracker = SequenceTracker()
+    tracker.track(0, 1)
+    tracker.track(2, 1)
+    tracker.track(1, 1)
+    tracker.track(1, 1)
+    assert counters(tracker) == (0, 1, 1, 1, 1)
+
+
+def test_batch_partly_filling_gaps():
+    tracker = SequenceTracker()
+    tracker.track(0, 5)   # 0..4
+    tracker.track(10, 5)  # 10..14, 5..9 missing
+    tracker.track(20, 5)  # 20..24, 15..19 missing
+    tracker.track(7, 10)  # 7..16: 7..9 and 15..16 fill, 10..14 are duplicates
+    assert counters(tracker) == (5, 5, 5, 2, 5)
+    assert list(zip(tracker.gap_starts, tracker.gap_ends)) == [(5, 7), (17, 20)]
+
+
+def test_batch_overlapping_the_highest_value():
+    tracker = SequenceTracker()
+    tracker.track(0, 5)  # 0..4
+    tracker.track(3, 5)  # 3..4 duplicated, 5..7 new
+    assert counters(tracker) == (0, 0, 2, 0, 0)
+    assert tracker.max_seq == 7
+
+
+def test_forgotten_gaps_stay_lost():
+    tracker = SequenceTracker()
+    for index in range(SequenceTracker.MAX_OPEN_GAPS + 1):
+        tracker.track(2 * index + 1, 1) # 0, 2, 4... are missing
+    assert len(tracker.gap_starts) == SequenceTracker.MAX_OPEN_GAPS
+    assert tracker.lost == SequenceTracker.MAX_OPEN_GAPS + 1
+    tracker.track(0, 1) # below the forgotten holes: late, still counted as lost
+    tracker.track(2, 1)
+    assert (tracker.lost, tracker.late, tracker.duplicates) == (SequenceTracker.MAX_OPEN_GAPS, 2, 0)
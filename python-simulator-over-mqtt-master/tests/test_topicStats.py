@@ -0,0 +1,59 @@
+from clockSync import ClockSync
+from topicStats import TopicStats, TopicStatsTable
+
+BASE_NS = 1700000000 * 10**9
+
+
+def batch(seq, count, sent_us):
+    return {"timestamp": sent_us, "values": list(range(count)), "period": 1000, "seq": seq}
+
+
+def test_reordered_batch_is_late_not_lost():
+    stats = TopicStats("t")
+    stats.record(BASE_NS, batch(0, 5, BASE_NS // 1000))   # 0..4
+    stats.record(BASE_NS, batch(10, 5, BASE_NS // 1000))  # 10..14, 5..9 missing
+    row = stats.get_row(BASE_NS)
+    assert (row["lost"], row["late"], row["gaps"], row["max_gap"]) == (5, 0, 1, 5)
+    assert row["loss_percent"] == 100.0 * 5 / 15
+    stats.record(BASE_NS, batch(5, 5, BASE_NS // 1000))   # 5..9 arrives late
+    row = stats.get_row(BASE_NS)
+    assert (row["lost"], row["late"], row["duplicates"], row["loss_percent"]) == (0, 5, 0, 0.0)
+
+
+def test_duplicated_batch_does_not_hide_a_loss():
+    stats = TopicStats("t")
+    stats.record(BASE_NS, batch(0, 5, BASE_NS // 1000))   # 0..4
+    stats.record(BASE_NS, batch(10, 5, BASE_NS // 1000))  # 5..9 lost
+    stats.record(BASE_NS, batch(0, 5, BASE_NS // 1000))   # QoS 1 redelivery of 0..4
+    row = stats.get_row(BASE_NS)
+    assert (row["values"], row["lost"], row["late"], row["duplicates"]) == (15, 5, 0, 5)
+    assert row["loss_percent"] == 100.0 * 5 / 15
+    assert "1 topics, 15 values, 0.0 values/s, 5 lost, 0 late, 5 duplicates" in TopicStatsTable.format_rows([row])
+
+
+def test_record_counts_values_and_sequences():
+    stats = TopicStats("t")
+    stats.record(BASE_NS + 2_000_000, batch(0, 5, BASE_NS // 1000))
+    stats.record(BASE_NS + 3_000_000, batch(10, 5, BASE_NS // 1000 + 1000))
+    stats.record(BASE_NS + 4_000_000, {"timestamp": 1, "ans": "ok"}) # answers are left out
+    row = stats.get_row(BASE_NS + 4_000_000)
+    assert (row["messages"], row["values"], row["lost"], row["gaps"]) == (2, 10, 5, 1)
+    assert row["loss_percent"] == 100.0 * 5 / 15
+    assert row["p50_ms"] == 2.0 # transit of 2 ms, within the precision of the histogram
+
+
+def test_no_rate_before_one_second():
+    stats = TopicStats("t")
+    for index in range(10):
+        stats.record(BASE_NS + index * 10**6, {"timestamp": BASE_NS // 1000, "value": index})
+    assert stats.get_row(BASE_NS + 500 * 10**6)["rate_per_s"] is None
+    assert stats.get_row(BASE_NS + 2 * 10**9)["rate_per_s"] == 5.0
+
+
+def test_no_latency_without_a_clock_estimate():
+    table = TopicStatsTable(ClockSync())
+    table.record("t", BASE_NS + 10**6, {"timestamp": BASE_NS // 1000, "value": 1, "seq": 0})
+    row = table.topics["t"].get_row(BASE_NS + 10**6)
+    assert row["values"] == 1
+    assert row["p50_ms"] is None
+    assert TopicStatsTable(None).get_clock_offset(BASE_NS) == 0
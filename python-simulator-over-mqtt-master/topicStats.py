@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+from constants import MqttAppConstants
+from latencyHistogram import LatencyHistogram
+from sequenceTracker import SequenceTracker
+
+# TopicStats keeps running aggregates of the values received on ONE topic, in constant memory whatever the length of
+# the session (the records can be bounded or not kept at all, see recordStore.py): they are updated once per message
+# and read a few times per second by the dashboard (see dashboard.py), instead of waiting for ResultReporter.
+#   - count and rate, mean/min/max of the values over the last WINDOW_S to 2 x WINDOW_S seconds (two tumbling windows),
+#     no rate before MIN_RATE_SPAN_NS (a few values received together would give an absurd rate)
+#   - mean inter-arrival time and jitter, as in RTP (RFC 3550): smoothed difference between the transit times of two
+#     consecutive messages. The offset between the clocks cancels out, the jitter is right even without ClockSync.
+#   - gaps in the sequence numbers (SequenceTracker, shared with the ward mode): lost, late and duplicated values, number
+#     and largest size of the gaps
+#   - latency quantiles from a LatencyHistogram (sender timestamp -> reception), corrected with the offset of the sensor
+#     clock estimated by the ClockSync of the mode (see clockSync.py): none until a first estimate exists. Without a
+#     ClockSync (disabled), the clocks are taken as synchronized.
+class WindowAggregate:
+    __slots__ = ("start_ns", "count", "total", "minimum", "maximum")
+
+    def __init__(self, start_ns):
+        self.start_ns = start_ns
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+
+class TopicStats:
+    __slots__ = ("topic", "lock", "messages", "values", "first_ns", "last_ns", "current", "previous", "interarrival_ns",
+                 "last_transit_ns", "jitter_ns", "sequence", "histogram")
+
+    WINDOW_NS = 10 * 10**9
+    MIN_RATE_SPAN_NS = 10**9
+    GAIN = 1 / 16 # smoothing of the inter-arrival time and of the jitter (RFC 3550)
+
+    def __init__(self, topic):
+        self.topic = topic
+        # Several receive workers can process messages of the same topic
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.values = 0
+        self.first_ns = None
+        self.last_ns = None
+        self.current = None # WindowAggregate of the running window
+        self.previous = None # WindowAggregate of the window before
+        self.interarrival_ns = None
+        self.last_transit_ns = None
+        self.jitter_ns = 0.0
+        self.sequence = SequenceTracker()
+        self.histogram = LatencyHistogram()
+
+    def record(self, timestamp_ns, message, clock_offset_ns=0):
+        # One received message (decoded), the answers are left out. clock_offset_ns: sensor clock - server clock, None
+        # when it is not known yet
+        if MqttAppConstants.MSG_VALUES in message:
+            values = message[MqttAppConstants.MSG_VALUES]
+        elif MqttAppConstants.MSG_VALUE in message:
+            values = (message[MqttAppConstants.MSG_VALUE],)
+        else:
+            return
+        self.messages += 1
+        self.values += len(values)
+        if self.last_ns is None:
+            self.first_ns = timestamp_ns
+        else:
+            gap_ns = timestamp_ns - self.last_ns
+            self.interarrival_ns = gap_ns if self.interarrival_ns is None else self.interarrival_ns + (gap_ns - self.interarrival_ns) * TopicStats.GAIN
+        self.last_ns = timestamp_ns
+        if self.current is None or timestamp_ns - self.current.start_ns >= TopicStats.WINDOW_NS:
+            # A window without any message in between is not kept as the previous one
+            self.previous = self.current if self.current is not None and timestamp_ns - self.current.start_ns < 2 * TopicStats.WINDOW_NS else None
+            self.current = WindowAggregate(timestamp_ns)
+        for value in values:
+            self.current.add(value)
+        # Transit of the message (the first value of a batch, see Mode.record_transit). The jitter takes the raw transit
+        # times: the offset cancels out, and a new clock estimate does not show as jitter.
+        transit_ns = timestamp_ns - message[MqttAppConstants.MSG_TIMESTAMP] * 1000
+        if clock_offset_ns is not None:
+            self.histogram.record(transit_ns + clock_offset_ns)
+        if self.last_transit_ns is not None:
+            self.jitter_ns += (abs(transit_ns - self.last_transit_ns) - self.jitter_ns) * TopicStats.GAIN
+        self.last_transit_ns = transit_ns
+        seq = message.get(MqttAppConstants.MSG_SEQ, -1)
+        if seq >= 0:
+            self.sequence.track(seq, len(values))
+
+    def get_row(self, now_ns):
+        # Values of the last windows still running at now_ns
+        windows = [window for window in (self.previous, self.current)
+                   if window is not None and now_ns - window.start_ns < 2 * TopicStats.WINDOW_NS]
+        count = sum(window.count for window in windows)
+        since_ns = windows[0].start_ns if windows else now_ns
+        sequence = self.sequence
+        sent = self.values - sequence.duplicates + sequence.lost
+        return {
+            "topic": self.topic,
+            "messages": self.messages,
+            "values": self.values,
+            "rate_per_s": count / ((now_ns - since_ns) / 1e9) if now_ns - since_ns >= TopicStats.MIN_RATE_SPAN_NS else None,
+            "mean": sum(window.total for window in windows) / count if count else None,
+            "min": min(window.minimum for window in windows) if count else None,
+            "max": max(window.maximum for window in windows) if count else None,
+            "interarrival_ms": self.interarrival_ns / 1e6 if self.interarrival_ns is not None else None,
+            "jitter_ms": self.jitter_ns / 1e6,
+            "lost": sequence.lost,
+            # Among the values sent (the duplicates were sent once)
+            "loss_percent": 100.0 * sequence.lost / sent if sent else 0.0,
+            "late": sequence.late,
+            "duplicates": sequence.duplicates,
+            "gaps": sequence.gaps,
+            "max_gap": sequence.max_gap,
+            "p50_ms": TopicStats.to_ms(self.histogram.value_at_percentile(50)),
+            "p99_ms": TopicStats.to_ms(self.histogram.value_at_percentile(99)),
+            "max_ms": TopicStats.to_ms(self.histogram.max_ns),
+            "last_seen_s": (now_ns - self.last_ns) / 1e9 if self.last_ns is not None else None,
+        }
+
+    @staticmethod
+    def to_ms(value_ns):
+        return None if value_ns is None else value_ns / 1e6
+
+
+class TopicStatsTable:
+    # The TopicStats of every topic a mode receives values on (one for the server, more with a wildcard topic)
+
+    COLUMNS = (("topic", "{:<28.28}", 28), ("values", "{:>10}", 10), ("rate/s", "{:>9.1f}", 9), ("mean", "{:>9.2f}", 9),
+               ("min", "{:>8.2f}", 8), ("max", "{:>8.2f}", 8), ("iat ms", "{:>8.2f}", 8), ("jit ms", "{:>8.3f}", 8),
+               ("lost", "{:>7}", 7), ("loss %", "{:>7.2f}", 7), ("late", "{:>6}", 6), ("dup", "{:>6}", 6), ("gaps", "{:>6}", 6),
+               ("p50 ms", "{:>9.3f}", 9), ("p99 ms", "{:>9.3f}", 9), ("max ms", "{:>9.3f}", 9), ("seen", "{:>7.1f}", 7))
+    ROW_KEYS = ("topic", "values", "rate_per_s", "mean", "min", "max", "interarrival_ms", "jitter_ms", "lost", "loss_percent",
+                "late", "duplicates", "gaps", "p50_ms", "p99_ms", "max_ms", "last_seen_s")
+
+    CLOCK_REFRESH_NS = 10**9 # the clock estimate (a line fit) is computed again once per second, not per message
+
+    def __init__(self, clock_sync=None):
+        # clock_sync: ClockSync of the mode, None when the clocks are taken as synchronized
+        self.topics = {} # received topic -> TopicStats
+        self.lock = threading.Lock()
+        self.clock_sync = clock_sync
+        self.clock_estimate = None
+        self.next_clock_refresh_ns = 0
+
+    def record(self, topic, timestamp_ns, message):
+        stats = self.topics.get(topic)
+        if stats is None:
+            with self.lock:
+                # Another worker may have added it in the meantime
+                stats = self.topics.setdefault(topic, TopicStats(topic))
+        clock_offset_ns = self.get_clock_offset(timestamp_ns)
+        with stats.lock:
+            stats.record(timestamp_ns, message, clock_offset_ns)
+
+    def get_clock_offset(self, timestamp_ns):
+        # Offset of the sensor clock at timestamp_ns (as ClockSync.offset_at), from the cached estimate
+        if self.clock_sync is None:
+            return 0
+        if timestamp_ns >= self.next_clock_refresh_ns:
+            self.next_clock_refresh_ns = timestamp_ns + TopicStatsTable.CLOCK_REFRESH_NS
+            self.clock_estimate = self.clock_sync.estimate()
+        estimate = self.clock_estimate
+        if estimate is None:
+            return None
+        return round(estimate["offset_ns"] + estimate["drift_ppm"] / 1e6 * (timestamp_ns - estimate["reference_ns"]))
+
+    def get_rows(self):
+        now_ns = time.time_ns()
+        rows = []
+        for stats in list(self.topics.values()):
+            with stats.lock:
+                rows.append(stats.get_row(now_ns))
+        return sorted(rows, key=lambda row: row["topic"])
+
+    @staticmethod
+    def format_rows(rows):
+        # Lines of a table (header, one line per topic, total), "-" for the values not known yet
+        lines = [" ".join("{:>{}}".format(name, width) if index else "{:<{}}".format(name, width)
+                          for index, (name, _, width) in enumerate(TopicStatsTable.COLUMNS))]
+        for row in rows:
+            lines.append(" ".join("{:>{}}".format("-", width) if row[key] is None else value_format.format(row[key])
+                                  for key, (_, value_format, width) in zip(TopicStatsTable.ROW_KEYS, TopicStatsTable.COLUMNS)))
+        lines.append("{} topics, {} values, {:.1f} values/s, {} lost, {} late, {} duplicates".format(
+            len(rows), sum(row["values"] for row in rows), sum(row["rate_per_s"] or 0.0 for row in rows),
+            sum(row["lost"] for row in rows), sum(row["late"] for row in rows), sum(row["duplicates"] for row in rows)))
+        return lines
+
+    def save(self, path):
+        # One row per topic, None when nothing was received
+        rows = self.get_rows()
+        if not rows:
+            return None
+        with open(path, "w") as file:
+            json.dump(rows, file, indent=1)
+        return path
+
+    @staticmethod
+    def get_file_path(results_path):
+        # Saved next to the results file of the server (a .json file: not taken for a results file by the report mode)
+        # results/<broker>-server-<date>.csv -> results/<broker>-server-<date>-topics.json
+        return results_path[:-len(".csv")] + "-topics.json"